@@ -0,0 +1,718 @@
+# Разбор общих PDF прайс-листов Контур (Нулевая отчетность, налоговые представители,
+# Стартовый онлайн). Отдельный модуль нужен процессам разбора PDF: они импортируют только его,
+# а не весь скрипт бота с конфигом, aiogram, selenium и пулами
+import os
+import re
+import itertools
+import logging
+import threading
+
+LOG_FORMAT = '%(asctime)s - %(message)s'
+LOG_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def add_error_prefix(record):
+    """Добавляет префикс ERROR только для записей с уровнем ERROR"""
+    if record.levelname == "ERROR":
+        record.msg = f"ERROR {record.msg}"
+    else:
+        record.msg = f"......{record.msg}"
+    return True
+
+def init_pdf_worker(log_file_name):
+    """Начальная настройка процесса разбора PDF: записи дописываются в общий лог бота"""
+    logging.basicConfig(
+        level=logging.INFO,
+        filename=log_file_name,
+        filemode="a",
+        format=LOG_FORMAT,
+        datefmt=LOG_DATE_FORMAT
+    )
+    logging.getLogger().addFilter(add_error_prefix)
+
+# === ИНДЕКС СТРАНИЦ PDF ===
+# Каждый PDF декодируется один раз за запуск: текст страниц извлекается по первому обращению
+# и запоминается, а все функции разбора читают его через общий индекс. Разделы ищутся
+# по заголовку, а не по номерам страниц, которые меняются вместе с версткой документа
+
+class PdfIndex:
+    """Ленивый постраничный доступ к тексту PDF с кэшем уже извлеченных страниц"""
+
+    def __init__(self, pdf_path):
+        import PyPDF2
+        self.path = pdf_path
+        self.reader = PyPDF2.PdfReader(pdf_path)
+        self.page_count = len(self.reader.pages)
+        self.texts = [None] * self.page_count
+        self.lock = threading.Lock()
+
+    def page(self, number):
+        """Текст страницы (с нуля); ошибка извлечения одной страницы дает пустой текст"""
+        with self.lock:
+            if self.texts[number] is None:
+                try:
+                    self.texts[number] = self.reader.pages[number].extract_text() or ""
+                except Exception as e:
+                    logging.error(f"Не удалось извлечь текст страницы {number + 1} из {self.path}: {e}")
+                    self.texts[number] = ""
+            return self.texts[number]
+
+    def pages(self, start=0, stop=None):
+        """Тексты страниц диапазона [start, stop) по одной, без извлечения остальных"""
+        stop = self.page_count if stop is None else min(stop, self.page_count)
+        for number in range(start, stop):
+            yield self.page(number)
+
+    def text(self, start=0, stop=None):
+        return "".join(self.pages(start, stop))
+
+    def lines(self, number):
+        return self.page(number).split('\n')
+
+    def find(self, heading, near=()):
+        """
+        Номера страниц, текст которых совпадает с регулярным выражением заголовка, по одной:
+        страница извлекается, только когда до нее дошел поиск. Сначала проверяются страницы
+        near (ожидаемое место раздела), затем остальные по порядку
+        """
+        pattern = re.compile(heading, re.IGNORECASE)
+        near = [number for number in near if 0 <= number < self.page_count]
+        rest = (number for number in range(self.page_count) if number not in near)
+        for number in itertools.chain(near, rest):
+            if pattern.search(self.page(number)):
+                yield number
+
+    def section(self, heading, is_content, next_heading, near=()):
+        """
+        Строки раздела: после строки с заголовком heading и до заголовка следующего раздела
+        (next_heading) или до страницы без строк раздела (is_content). Строка, совпадающая
+        и с heading (общий заголовок документа), концом раздела не считается.
+        Совпадения заголовка в оглавлении, где до следующего заголовка нет ни одной строки
+        раздела, пропускаются. Поиск останавливается на первом найденном разделе; страницы
+        near проверяются первыми. Возвращает (номера страниц, строки) или ([], [])
+        """
+        own = re.compile(heading, re.IGNORECASE)
+        other = re.compile(next_heading, re.IGNORECASE)
+        for start in self.find(heading, near):
+            numbers, lines = [], []
+            seen_heading = False
+            ended = False
+            for number in range(start, self.page_count):
+                page_has_content = False
+                for line in self.lines(number):
+                    line = line.strip()
+                    if not seen_heading:
+                        seen_heading = bool(own.search(line))
+                        continue
+                    if is_content(line):
+                        page_has_content = True
+                        lines.append(line)
+                    elif other.search(line) and not own.search(line):
+                        ended = True
+                        break
+                if page_has_content:
+                    numbers.append(number)
+                if ended or (not page_has_content and number > start):
+                    break
+            if lines:
+                return numbers, lines
+        return [], []
+
+pdf_indexes = {}
+pdf_indexes_lock = threading.Lock()
+
+def pdf_index(pdf_path):
+    """Общий индекс файла: все функции разбора одного PDF используют один декодированный документ"""
+    stat = os.stat(pdf_path)
+    key = (os.path.abspath(pdf_path), stat.st_size, stat.st_mtime_ns)
+    with pdf_indexes_lock:
+        index = pdf_indexes.get(key)
+        if index is None:
+            index = pdf_indexes[key] = PdfIndex(pdf_path)
+        return index
+
+def release_pdf_indexes():
+    """Освобождает тексты PDF после разбора"""
+    with pdf_indexes_lock:
+        pdf_indexes.clear()
+
+# === ФУНКЦИИ ДЛЯ PDF ===
+
+def extract_text_from_pdf(pdf_path):
+    """Извлекает текст из PDF файла"""
+    try:
+        return pdf_index(pdf_path).text()
+    except Exception:
+        return ""
+
+# Заголовок раздела с Нулевой отчетностью и строки его таблицы
+NULL_REPORT_HEADING = r"Нулев\w*\s+отч[её]тност"
+# Заголовки остальных тарифов того же прайс-листа: таблицы у них того же формата,
+# поэтому раздел заканчивается на первом из них
+NULL_REPORT_NEXT_HEADING = r"Общ\w*\s+Лайт|Кадров\w*\s+отч[её]т|Классическ\w*"
+# Страницы раздела в прежней верстке (49-54 в документе = индексы 48-53)
+NULL_REPORT_LEGACY_PAGES = range(48, 54)
+# Заголовок раздела сначала ищется на этих страницах (прежняя верстка с запасом в обе стороны),
+# чтобы не извлекать текст всего документа; остальные страницы - только если там его нет
+NULL_REPORT_SEARCH_MARGIN = 4
+NULL_REPORT_SEARCH_PAGES = range(
+    NULL_REPORT_LEGACY_PAGES.start - NULL_REPORT_SEARCH_MARGIN, NULL_REPORT_LEGACY_PAGES.stop + NULL_REPORT_SEARCH_MARGIN
+)
+
+def is_null_price_line(line):
+    return 'Право использования ПО' in line and len(line) >= 2 and line[:2].isdigit()
+
+def parse_null_price_lines(lines):
+    """
+    {код региона: итоговая стоимость с НДС} по строкам таблицы. Берется первое значение
+    региона; повтор уже встреченного кода означает начало следующей таблицы
+    """
+    null_reporting_data = {}
+    for line_clean in lines:
+        # Ищем строки с "Право использования ПО"
+        if not is_null_price_line(line_clean):
+            continue
+        region_code = line_clean[:2]
+        if region_code in null_reporting_data:
+            logging.warning(f"Нулевая отчетность: код {region_code} встретился повторно, таблица закончилась")
+            break
+
+        # Ищем паттерн: "– число" (итоговая стоимость после тире)
+        # Формат: "... – 2 200,00 ..."
+        match = re.search(r'–\s+([\d\s,]+)', line_clean)
+        if match:
+            price_str = match.group(1).strip()
+            # Убираем пробелы и заменяем запятую на точку
+            price_str = price_str.replace(' ', '').replace(',', '.')
+
+            try:
+                null_reporting_data.setdefault(region_code, float(price_str))
+            except ValueError:
+                continue
+    return null_reporting_data
+
+def extract_all_null_prices(pdf_path):
+    """
+    Извлекает итоговую стоимость с НДС для Нулевой отчетности по всем регионам
+    """
+    try:
+        pdf = pdf_index(pdf_path)
+        legacy_pages = [number for number in NULL_REPORT_LEGACY_PAGES if number < pdf.page_count]
+
+        # Страницы прежней верстки входят в окно поиска, поэтому сверка и запасной путь
+        # берут их текст из кэша индекса
+        def legacy_lines():
+            return [line.strip() for number in legacy_pages for line in pdf.lines(number)]
+
+        pages, lines = pdf.section(
+            NULL_REPORT_HEADING, is_null_price_line, NULL_REPORT_NEXT_HEADING, near=NULL_REPORT_SEARCH_PAGES
+        )
+        if not pages:
+            logging.error("Раздел Нулевой отчетности не найден по заголовку, читаются страницы прежней верстки")
+            return parse_null_price_lines(legacy_lines())
+
+        logging.info(f"Нулевая отчетность: страницы {pages[0] + 1}-{pages[-1] + 1}")
+        null_reporting_data = parse_null_price_lines(lines)
+
+        # Сверка с прежней версткой: расхождение в числе регионов - повод проверить прайс-лист
+        legacy_count = len(parse_null_price_lines(legacy_lines()))
+        if legacy_count != len(null_reporting_data):
+            logging.warning(
+                f"Нулевая отчетность: найдено регионов {len(null_reporting_data)}, "
+                f"на страницах прежней верстки - {legacy_count}"
+            )
+        return null_reporting_data
+
+    except Exception as e:
+        print(f"Ошибка при парсинге Нулевой отчетности: {e}")
+        import traceback
+        traceback.print_exc()
+        return {}
+
+def extract_all_tax_representative_prices(pdf_path):
+    """Извлекает все цены налогового представителя из PDF с учетом регрессивных шкал"""
+    text = extract_text_from_pdf(pdf_path)
+    if not text:
+        return {}
+    return parse_tax_representative_text(text)
+
+def parse_tax_representative_text_legacy(text):
+    """Прежний разбор текста налогового представителя (оставлен для сравнения, --bench-tax)"""
+    regression_zones = extract_regression_zones(text)
+
+    if not regression_zones:
+        pass
+
+    lines = text.split('\n')
+    prices_dict = {}
+
+    # Список всех настоящих кодов регионов
+    real_region_codes = [str(i).zfill(2) for i in range(1, 96)]
+    real_region_codes += ['77', '78', '79', '83', '86', '87', '89', '90', '91', '92', '93', '94', '95', '99']
+
+    # Объединяем строки для каждого региона
+    current_region = ""
+    combined_text = ""
+
+    for line in lines:
+        line_clean = line.strip()
+        if not line_clean:
+            continue
+
+        # Строгая проверка: строка должна начинаться с настоящего кода региона и содержать название
+        is_region_line = False
+        for region_code in real_region_codes:
+            if (line_clean.startswith(region_code + ' ') and
+                len(line_clean) > 10 and
+                any(char.isalpha() for char in line_clean[3:10])):
+                is_region_line = True
+                break
+
+        if is_region_line:
+            if current_region and combined_text:
+                process_tax_region_with_zones(current_region, combined_text, prices_dict, real_region_codes, regression_zones)
+
+            current_region = line_clean.split()[0] if line_clean.split() else ""
+            combined_text = line_clean
+        else:
+            if current_region:
+                combined_text += " " + line_clean
+
+    if current_region and combined_text:
+        process_tax_region_with_zones(current_region, combined_text, prices_dict, real_region_codes, regression_zones)
+
+    return prices_dict
+
+def extract_regression_zones(text):
+    """Извлекает данные регрессивных шкал из текста PDF"""
+    zones = {}
+
+    lines = text.split('\n')
+
+    # Создаем структуры для всех зон
+    all_zones = ['1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11', '12']
+    for zone in all_zones:
+        zones[zone] = {}
+
+    zone_headers = ['1', '2', '3', '5', '6', '7', '8', '9', '11', '12']
+
+    for i, line in enumerate(lines):
+        line_clean = line.strip()
+
+        if "До 199" in line_clean or "До 192" in line_clean:
+            all_numbers = re.findall(r'\b(\d{2,3})\b', line_clean)
+            prices = all_numbers[1:] if len(all_numbers) > 1 else []
+
+            if len(prices) >= len(zone_headers):
+                for j, price_str in enumerate(prices):
+                    if j < len(zone_headers):
+                        # ОЧИЩАЕМ от нецифровых символов
+                        clean_str = re.sub(r'[^\d]', '', price_str)
+                        if clean_str.isdigit():
+                            zone_num = zone_headers[j]
+                            zones[zone_num]["до_199"] = int(clean_str)
+
+        elif "От 200 до 499" in line_clean:
+            parts = line_clean.split("499")
+            if len(parts) > 1:
+                prices_part = parts[1]
+                prices = re.findall(r'\b(\d{2,3})\b', prices_part)
+
+                if len(prices) >= len(zone_headers):
+                    for j, price_str in enumerate(prices):
+                        if j < len(zone_headers):
+                            # ОЧИЩАЕМ от нецифровых символов
+                            clean_str = re.sub(r'[^\d]', '', price_str)
+                            if clean_str.isdigit():
+                                zone_num = zone_headers[j]
+                                zones[zone_num]["от_200_до_499"] = int(clean_str)
+
+        elif "От 500 до 999" in line_clean:
+            parts = line_clean.split("999")
+            if len(parts) > 1:
+                prices_part = parts[1]
+                prices = re.findall(r'\b(\d{2,3})\b', prices_part)
+
+                if len(prices) >= len(zone_headers):
+                    for j, price_str in enumerate(prices):
+                        if j < len(zone_headers):
+                            # ОЧИЩАЕМ от нецифровых символов
+                            clean_str = re.sub(r'[^\d]', '', price_str)
+                            if clean_str.isdigit():
+                                zone_num = zone_headers[j]
+                                zones[zone_num]["от_500_до_999"] = int(clean_str)
+
+        elif "От 1000 до 1999" in line_clean:
+            parts = line_clean.split("1999")
+            if len(parts) > 1:
+                prices_part = parts[1]
+                prices = re.findall(r'\b(\d{2,3})\b', prices_part)
+
+                if len(prices) >= len(zone_headers):
+                    for j, price_str in enumerate(prices):
+                        if j < len(zone_headers):
+                            # ОЧИЩАЕМ от нецифровых символов
+                            clean_str = re.sub(r'[^\d]', '', price_str)
+                            if clean_str.isdigit():
+                                zone_num = zone_headers[j]
+                                zones[zone_num]["от_1000_до_1999"] = int(clean_str)
+
+        elif "От 2000" in line_clean and "От 2000 до" not in line_clean:
+            parts = line_clean.split("2000")
+            if len(parts) > 1:
+                prices_part = parts[1]
+                prices = re.findall(r'\b(\d{2,3})\b', prices_part)
+
+                if len(prices) >= len(zone_headers):
+                    for j, price_str in enumerate(prices):
+                        if j < len(zone_headers):
+                            # ОЧИЩАЕМ от нецифровых символов
+                            clean_str = re.sub(r'[^\d]', '', price_str)
+                            if clean_str.isdigit():
+                                zone_num = zone_headers[j]
+                                zones[zone_num]["от_2000"] = int(clean_str)
+
+    # ПАРСИМ ДАННЫЕ ДЛЯ ЗОН 4 И 10 ОТДЕЛЬНО (ИЗ ДРУГОЙ ТАБЛИЦЫ)
+    for i, line in enumerate(lines):
+        line_clean = line.strip()
+
+        # Ищем данные для зон 4 и 10 с их специфичными диапазонами
+        if "До 349" in line_clean:
+            all_numbers = re.findall(r'\b(\d{2,3})\b', line_clean)
+            prices = all_numbers[1:] if len(all_numbers) > 1 else []  # Исключаем 349
+            if len(prices) >= 2:
+                # ОЧИЩАЕМ от нецифровых символов
+                clean_price1 = re.sub(r'[^\d]', '', prices[0])
+                clean_price2 = re.sub(r'[^\d]', '', prices[1])
+                if clean_price1.isdigit():
+                    zones["4"]["до_349"] = int(clean_price1)
+                if clean_price2.isdigit():
+                    zones["10"]["до_349"] = int(clean_price2)
+
+        elif "От 350 до 599" in line_clean:
+            parts = line_clean.split("599")
+            if len(parts) > 1:
+                prices_part = parts[1]
+                prices = re.findall(r'\b(\d{2,3})\b', prices_part)
+                if len(prices) >= 2:
+                    # ОЧИЩАЕМ от нецифровых символов
+                    clean_price1 = re.sub(r'[^\d]', '', prices[0])
+                    clean_price2 = re.sub(r'[^\d]', '', prices[1])
+                    if clean_price1.isdigit():
+                        zones["4"]["от_350_до_599"] = int(clean_price1)
+                    if clean_price2.isdigit():
+                        zones["10"]["от_350_до_599"] = int(clean_price2)
+
+        elif "От 600 до 999" in line_clean:
+            parts = line_clean.split("999")
+            if len(parts) > 1:
+                prices_part = parts[1]
+                prices = re.findall(r'\b(\d{2,3})\b', prices_part)
+                if len(prices) >= 2:
+                    # ОЧИЩАЕМ от нецифровых символов
+                    clean_price1 = re.sub(r'[^\d]', '', prices[0])
+                    clean_price2 = re.sub(r'[^\d]', '', prices[1])
+                    if clean_price1.isdigit():
+                        zones["4"]["от_600_до_999"] = int(clean_price1)
+                    if clean_price2.isdigit():
+                        zones["10"]["от_600_до_999"] = int(clean_price2)
+
+        # Строка "От 1000" для зон 4 и 10 (у них только один диапазон "от 1000")
+        elif "От 1000" in line_clean:
+            parts = line_clean.split()
+            for idx, part in enumerate(parts):
+                if part == "1000" and idx + 2 < len(parts):
+                    # ОЧИЩАЕМ от нецифровых символов
+                    clean_price1 = re.sub(r'[^\d]', '', parts[idx + 1])
+                    clean_price2 = re.sub(r'[^\d]', '', parts[idx + 2])
+                    if clean_price1.isdigit():
+                        zones["4"]["от_1000"] = int(clean_price1)
+                    if clean_price2.isdigit():
+                        zones["10"]["от_1000"] = int(clean_price2)
+                    break
+
+    return zones
+
+def process_tax_region_with_zones(region_code, text, prices_dict, real_region_codes, regression_zones):
+    """Обрабатывает один регион с учетом регрессивных шкал"""
+    if region_code not in real_region_codes:
+        return
+
+    # ВАЖНО: Если регион уже обработан, не перезаписываем!
+    if region_code in prices_dict:
+        return
+
+    zone_match = re.search(r'(\d{1,2})(?=\s+\d+\s+\d+\s+\d+\s+\d+)', text)
+    zone_number = None
+
+    if zone_match:
+        zone_number = zone_match.group(1)
+    else:
+        numbers = re.findall(r'\b(\d{1,2})\b', text)
+        for num in numbers:
+            if num in ['1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11', '12']:
+                zone_number = num
+                break
+
+    tax_data = {
+        "zone": zone_number,
+        "base_price": None,
+        "regression_prices": {}
+    }
+
+    # Ищем паттерн: текст между "Право" и "Услуги"
+    right_pattern = r'Право\s+(.*?)\s+Услуги'
+    right_match = re.search(right_pattern, text)
+
+    if right_match:
+        right_text = right_match.group(1)
+        # Находим все цены
+        prices = re.findall(r'(\d[\d\s]*,\d+)', right_text)
+
+        # Четвёртая цена (индекс 3) = итоговая за 12 месяцев
+        if len(prices) >= 4:
+            tax_price_str = prices[3].replace(' ', '').replace(',', '.')
+
+            try:
+                tax_price = float(tax_price_str)
+
+                # ФИЛЬТР: Базовый имеет цены в диапазоне 6500-17000
+                if 6500 <= tax_price <= 17000:
+                    tax_data["base_price"] = tax_price
+
+                    if zone_number and zone_number in regression_zones:
+                        tax_data["regression_prices"] = regression_zones[zone_number]
+
+                    prices_dict[region_code] = tax_data
+            except ValueError:
+                pass
+
+    return
+
+# === РАЗБОР ТЕКСТА НАЛОГОВОГО ПРЕДСТАВИТЕЛЯ ЗА ОДИН ПРОХОД ===
+# Текст просматривается один раз: строки делятся на блоки регионов, а строки регрессивных шкал
+# сразу заносятся в таблицу "зона × диапазон". Блоки разбираются после прохода, когда таблица
+# шкал заполнена. Результат совпадает с parse_tax_representative_text_legacy
+
+# Начало строки региона: настоящий код региона (01-95, 99) и пробел
+TAX_REGION_LINE = re.compile(r'(0[1-9]|[1-8][0-9]|9[0-5]|99) ')
+# Быстрая проверка, что в строке может быть диапазон регрессивной шкалы
+TAX_BRACKET_HINT = re.compile(r'До 19[29]|До 349|От (?:200|350|500|600|1000|2000)')
+TAX_BRACKET_NUMBER = re.compile(r'\b(\d{2,3})\b')
+TAX_NON_DIGITS = re.compile(r'[^\d]')
+TAX_ZONE = re.compile(r'(\d{1,2})(?=\s+\d+\s+\d+\s+\d+\s+\d+)')
+TAX_ZONE_FALLBACK = re.compile(r'\b(\d{1,2})\b')
+TAX_RIGHT = re.compile(r'Право\s+(.*?)\s+Услуги')
+TAX_PRICE = re.compile(r'(\d[\d\s]*,\d+)')
+
+TAX_ZONES = ['1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11', '12']
+# Зоны первой таблицы шкал (по порядку колонок) и зоны 4 и 10 со своими диапазонами
+TAX_MAIN_ZONES = ['1', '2', '3', '5', '6', '7', '8', '9', '11', '12']
+TAX_SPECIAL_ZONES = ['4', '10']
+
+def set_zone_prices(zones, zone_names, key, prices):
+    for zone, price in zip(zone_names, prices):
+        clean = TAX_NON_DIGITS.sub('', price)
+        if clean.isdigit():
+            zones[zone][key] = int(clean)
+
+def bracket_prices(line, boundary):
+    """Числа после первой границы диапазона (до следующего ее вхождения)"""
+    parts = line.split(boundary)
+    return TAX_BRACKET_NUMBER.findall(parts[1]) if len(parts) > 1 else []
+
+def scan_tax_bracket_line(line, zones):
+    """Заносит строку регрессивной шкалы в таблицу зон"""
+    # Первая таблица: зоны 1-3, 5-9, 11, 12
+    prices = None
+    if "До 199" in line or "До 192" in line:
+        prices, key = TAX_BRACKET_NUMBER.findall(line)[1:], "до_199"
+    elif "От 200 до 499" in line:
+        prices, key = bracket_prices(line, "499"), "от_200_до_499"
+    elif "От 500 до 999" in line:
+        prices, key = bracket_prices(line, "999"), "от_500_до_999"
+    elif "От 1000 до 1999" in line:
+        prices, key = bracket_prices(line, "1999"), "от_1000_до_1999"
+    elif "От 2000" in line and "От 2000 до" not in line:
+        prices, key = bracket_prices(line, "2000"), "от_2000"
+    if prices is not None and len(prices) >= len(TAX_MAIN_ZONES):
+        set_zone_prices(zones, TAX_MAIN_ZONES, key, prices)
+
+    # Вторая таблица: зоны 4 и 10
+    prices = None
+    if "До 349" in line:
+        prices, key = TAX_BRACKET_NUMBER.findall(line)[1:], "до_349"
+    elif "От 350 до 599" in line:
+        prices, key = bracket_prices(line, "599"), "от_350_до_599"
+    elif "От 600 до 999" in line:
+        prices, key = bracket_prices(line, "999"), "от_600_до_999"
+    elif "От 1000" in line:
+        parts = line.split()
+        for idx, part in enumerate(parts):
+            if part == "1000" and idx + 2 < len(parts):
+                set_zone_prices(zones, TAX_SPECIAL_ZONES, "от_1000", parts[idx + 1:idx + 3])
+                break
+    if prices is not None and len(prices) >= len(TAX_SPECIAL_ZONES):
+        set_zone_prices(zones, TAX_SPECIAL_ZONES, key, prices)
+
+def tokenize_tax_text(text):
+    """Один проход по тексту: список блоков (код региона, текст) и таблица шкал {зона: {диапазон: цена}}"""
+    zones = {zone: {} for zone in TAX_ZONES}
+    blocks = []
+    region = None
+    parts = []
+
+    for line in text.split('\n'):
+        line_clean = line.strip()
+        if not line_clean:
+            continue
+
+        if TAX_BRACKET_HINT.search(line_clean):
+            scan_tax_bracket_line(line_clean, zones)
+
+        match = TAX_REGION_LINE.match(line_clean)
+        if match and len(line_clean) > 10 and any(char.isalpha() for char in line_clean[3:10]):
+            if region:
+                blocks.append((region, " ".join(parts)))
+            region = match.group(1)
+            parts = [line_clean]
+        elif region:
+            parts.append(line_clean)
+
+    if region:
+        blocks.append((region, " ".join(parts)))
+    return blocks, zones
+
+def parse_tax_region_block(text, zones):
+    """Данные налогового представителя одного региона или None"""
+    zone_match = TAX_ZONE.search(text)
+    if zone_match:
+        zone_number = zone_match.group(1)
+    else:
+        zone_number = next((num for num in TAX_ZONE_FALLBACK.findall(text) if num in zones), None)
+
+    right_match = TAX_RIGHT.search(text)
+    if not right_match:
+        return None
+    # Четвёртая цена (индекс 3) = итоговая за 12 месяцев
+    prices = TAX_PRICE.findall(right_match.group(1))
+    if len(prices) < 4:
+        return None
+    try:
+        tax_price = float(prices[3].replace(' ', '').replace(',', '.'))
+    except ValueError:
+        return None
+
+    # ФИЛЬТР: Базовый имеет цены в диапазоне 6500-17000
+    if not 6500 <= tax_price <= 17000:
+        return None
+    return {
+        "zone": zone_number,
+        "base_price": tax_price,
+        "regression_prices": zones[zone_number] if zone_number and zone_number in zones else {},
+    }
+
+def parse_tax_representative_text(text):
+    """Цены налогового представителя по регионам из текста PDF"""
+    blocks, zones = tokenize_tax_text(text)
+    prices_dict = {}
+    for region, block in blocks:
+        # Регион уже найден - повторные упоминания не перезаписывают его
+        if region in prices_dict:
+            continue
+        tax_data = parse_tax_region_block(block, zones)
+        if tax_data is not None:
+            prices_dict[region] = tax_data
+    return prices_dict
+
+def extract_all_start_online_prices(pdf_path):
+    """Извлекает все цены Стартовый онлайн из PDF"""
+    text = extract_text_from_pdf(pdf_path)
+    if not text:
+        return {}
+
+    lines = text.split('\n')
+    prices_dict = {}
+
+    current_region = ""
+    current_text = ""
+
+    for i, line in enumerate(lines):
+        line = line.strip()
+        if not line:
+            continue
+
+        if re.match(r'^\d{2}', line):
+            if current_region and current_text:
+                process_region_for_start_online_improved(current_region, current_text, prices_dict)
+
+            current_region = line.split()[0] if line.split() else ""
+            current_text = line
+        else:
+            if current_region:
+                current_text += " " + line
+
+    if current_region and current_text:
+        process_region_for_start_online_improved(current_region, current_text, prices_dict)
+
+    return prices_dict
+
+def process_region_for_start_online_improved(region_code, text, prices_dict):
+    """Обрабатывает текст региона для извлечения цен Стартовый онлайн"""
+
+    # Ищем все пары чисел в формате "число1 – число2" где число2 - итоговая цена
+    pattern = r'(\d[\d\s,\.]*)\s*–\s*(\d[\d\s,\.]+)'
+    matches = re.findall(pattern, text)
+
+    prices = []
+
+    for base_price, final_price in matches:
+        # Очищаем итоговую цену (второе число после тире)
+        clean_price = final_price.replace(' ', '').replace(',', '').replace('\xa0', '').strip()
+
+        # Число приходит с копейками: "4 800,00" -> "480000"
+        # Делим на 100 чтобы получить правильную цену
+        if clean_price.isdigit() and len(clean_price) >= 5:
+            price = int(clean_price) // 100
+
+            if 3000 <= price <= 20000 and price != int(region_code):
+                prices.append(price)
+
+    # НЕ удаляем дубликаты! Нам нужны все 4 цены для 4 категорий
+    if len(prices) >= 4:
+        prices_dict[region_code] = prices[:4]
+    else:
+        alternative_prices = extract_start_online_alternative_improved(text, region_code)
+        if alternative_prices and len(alternative_prices) >= 4:
+            prices_dict[region_code] = alternative_prices
+
+def extract_start_online_alternative_improved(text, region_code):
+    """Альтернативный метод извлечения цен Стартовый онлайн"""
+    spaced_prices = re.findall(r'(\d{1,2}\s?\d{3})', text)
+    if spaced_prices:
+        prices = []
+        for price_str in spaced_prices:
+            clean_price = int(price_str.replace(' ', ''))
+            if 3000 <= clean_price <= 20000 and clean_price != int(region_code):
+                prices.append(clean_price)
+                if len(prices) >= 4:
+                    break
+        if len(prices) >= 4:
+            return prices[:4]
+    return None
+
+# === ЗАДАНИЕ ПРОЦЕССА РАЗБОРА ===
+PDF_EXTRACTORS = {
+    "null_prices": extract_all_null_prices,
+    "tax_rep_prices": extract_all_tax_representative_prices,
+    "start_online_prices": extract_all_start_online_prices,
+}
+
+def run_pdf_extractors(pdf_path, parsers):
+    """
+    Задание процесса: все разборщики одного файла по очереди на общем индексе страниц,
+    чтобы одинаковый документ, скачанный по разным ссылкам, декодировался один раз
+    """
+    try:
+        return {parser: PDF_EXTRACTORS[parser](pdf_path) for parser in parsers}
+    finally:
+        release_pdf_indexes()
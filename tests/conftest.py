@@ -0,0 +1,49 @@
+"""
+Общие фикстуры тестов. Скрипт парсера читает конфиг и пишет лог и базу в папку stat
+текущего каталога, поэтому он загружается из временной рабочей папки с тестовым конфигом
+"""
+
+import importlib.util
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+SCRIPT_PATH = REPO_DIR / "Парсерсулучшеннымконфигом.py"
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures"
+
+# kontur_pdf импортируется и скриптом, и тестами напрямую
+sys.path.insert(0, str(REPO_DIR))
+
+TEST_CONFIG = """\
+regions_sbis = [["77", "Москва"], ["01", "Республика Адыгея"]]
+regions_kontur = [["01", "Республика Адыгея"], ["77", "Москва"]]
+
+[telegram]
+token = "123456789:AAHdqTcvCH1vGWJxfSeofSAs0K5PALDsaw"
+chat_id = "1"
+"""
+
+
+@pytest.fixture(scope="session")
+def parser(tmp_path_factory):
+    """Модуль скрипта парсера, загруженный во временной рабочей папке"""
+    work_dir = tmp_path_factory.mktemp("work")
+    (work_dir / "stat").mkdir()
+    (work_dir / "stat" / "config.toml").write_text(TEST_CONFIG, encoding="utf-8")
+
+    previous_dir = os.getcwd()
+    os.chdir(work_dir)
+    spec = importlib.util.spec_from_file_location("parser_script", SCRIPT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["parser_script"] = module
+    spec.loader.exec_module(module)
+    yield module
+    os.chdir(previous_dir)
+
+
+@pytest.fixture
+def fixture_path():
+    return lambda name: str(FIXTURES_DIR / name)
@@ -0,0 +1,57 @@
+"""Прямое скачивание прайс-листов: хранилище по хэшу и условные запросы"""
+
+import hashlib
+import http.server
+import os
+import threading
+
+import pytest
+
+CONTENT = b"PK\x03\x04" + bytes(range(256)) * 40
+ETAG = '"price-v1"'
+
+
+class PriceHandler(http.server.BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.headers.get("If-None-Match"))
+        if self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+        self.send_header("Content-Length", str(len(CONTENT)))
+        self.send_header("ETag", ETAG)
+        self.end_headers()
+        self.wfile.write(CONTENT)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def price_url():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), PriceHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    PriceHandler.requests = []
+    yield f"http://127.0.0.1:{server.server_address[1]}/price-download/01/price.docx"
+    server.shutdown()
+    server.server_close()
+
+
+def test_download_is_stored_by_hash_and_revalidated(parser, price_url):
+    downloader = parser.HttpDownloader(2)
+    try:
+        first = downloader.submit(price_url).result(30)
+        second = downloader.submit(price_url).result(30)
+    finally:
+        downloader.close()
+
+    content_hash = hashlib.sha256(CONTENT).hexdigest()
+    assert os.path.basename(first) == content_hash + ".docx"
+    assert open(first, "rb").read() == CONTENT
+    assert second == first
+    assert PriceHandler.requests == [None, ETAG]
@@ -0,0 +1,40 @@
+"""Журнал запусков: какие регионы считаются готовыми при продолжении прерванного запуска"""
+
+
+def test_failed_sbis_region_is_rescraped_on_resume(parser):
+    complete = {field: 1000 for field in parser.SBIS_FIELDS}
+    partial = dict(complete, **{parser.SBIS_FIELDS[-1]: None})
+    error = {"Ошибка": "Timeout"}
+
+    run_id = parser.journal_start_run("sbis", parser.run_date_str())
+    for code, region_data in (("77", complete), ("01", partial), ("02", error)):
+        parser.journal_record_region(run_id, code, parser.sbis_region_status(region_data), region_data)
+    assert parser.journal_finish_run(run_id, ["77", "01", "02"], cancelled=False) == "incomplete"
+
+    assert parser.journal_find_resumable("sbis") == run_id
+    done = parser.journal_ok_regions(parser.journal_load_regions(run_id))
+    assert set(done) == {"77"}
+
+
+def test_failed_kontur_region_is_rescraped_on_resume(parser):
+    width = parser.NULL_COL + 11
+    empty_row = [1, "Республика Адыгея"] + ["❌"] * (width - 2)
+    pdf_only_row = list(empty_row)
+    pdf_only_row[parser.NULL_COL - 1] = 900
+    priced_row = list(pdf_only_row)
+    priced_row[2] = 11250
+
+    assert parser.kontur_region_status("01.docx", priced_row) == "ok"
+    assert parser.kontur_region_status("01.docx", empty_row) == "failed"
+    assert parser.kontur_region_status("01.docx", pdf_only_row) == "failed"
+    assert parser.kontur_region_status(None, priced_row) == "failed"
+
+    run_id = parser.journal_start_run("kontur", parser.run_date_str())
+    parser.journal_record_region(run_id, "01", parser.kontur_region_status("01.docx", priced_row), priced_row)
+    parser.journal_record_region(run_id, "02", parser.kontur_region_status("02.doc", pdf_only_row), pdf_only_row)
+    # Бот перезапущен посреди запуска: запуск остался в статусе running
+    parser.active_runs.discard(run_id)
+
+    assert parser.journal_find_resumable("kontur") == run_id
+    done = parser.journal_ok_regions(parser.journal_load_regions(run_id))
+    assert done == {"01": priced_row}
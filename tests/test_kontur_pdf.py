@@ -0,0 +1,60 @@
+"""Раздел Нулевой отчетности в PDF прайс-листе Контур"""
+
+import threading
+
+import pytest
+
+import kontur_pdf
+
+
+def price_line(code, price):
+    return f"{code} Право использования ПО на 12 мес – {price},00 руб"
+
+
+class TextIndex(kontur_pdf.PdfIndex):
+    """Индекс с готовым текстом страниц вместо PDF; считает, сколько страниц извлечено"""
+
+    def __init__(self, page_texts):
+        self.path = "price.pdf"
+        self.source = list(page_texts)
+        self.page_count = len(page_texts)
+        self.texts = [None] * self.page_count
+        self.lock = threading.Lock()
+        self.extracted = []
+
+    def page(self, number):
+        if self.texts[number] is None:
+            self.extracted.append(number)
+            self.texts[number] = self.source[number]
+        return self.texts[number]
+
+
+@pytest.fixture
+def price_list(monkeypatch):
+    # Оглавление, 47 страниц других тарифов, раздел на страницах прежней верстки, хвост документа
+    pages = ["Прайс-лист\nСодержание\n«Нулевая отчетность» 49"]
+    pages += ["Тариф «Общий Лайт»\n" + price_line("01", 100)] * 47
+    pages += [
+        "Тариф «Нулевая отчетность»\n" + price_line("01", 2200) + "\n" + price_line("02", 2200),
+        price_line("77", 2300),
+        "Тариф «Кадровые отчеты»\n" + price_line("01", 999),
+    ]
+    pages += ["Условия обслуживания"] * 60
+    index = TextIndex(pages)
+    monkeypatch.setattr(kontur_pdf, "pdf_index", lambda path: index)
+    return index
+
+
+def test_null_section_is_found_without_extracting_whole_document(price_list):
+    prices = kontur_pdf.extract_all_null_prices("price.pdf")
+
+    assert prices == {"01": 2200.0, "02": 2200.0, "77": 2300.0}
+    assert set(price_list.extracted) <= set(kontur_pdf.NULL_REPORT_SEARCH_PAGES)
+    # Сверка с прежней версткой читает те же страницы из кэша
+    assert len(price_list.extracted) == len(set(price_list.extracted))
+
+
+def test_find_stops_at_first_match(price_list):
+    pages = price_list.find(kontur_pdf.NULL_REPORT_HEADING)
+    assert next(pages) == 0
+    assert price_list.extracted == [0]
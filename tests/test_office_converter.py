@@ -0,0 +1,46 @@
+"""Пакетная конвертация .doc → .docx: один запуск soffice на все файлы очереди"""
+
+import os
+import stat
+import sys
+
+FAKE_SOFFICE = """\
+#!{python}
+# Заменитель soffice: записывает аргументы запуска и кладет в --outdir .docx для каждого файла
+import os, shutil, sys
+args = sys.argv[1:]
+with open({calls!r}, "a") as log:
+    log.write(" ".join(args) + "\\n")
+outdir = args[args.index("--outdir") + 1]
+for path in args[args.index("--outdir") + 2:]:
+    name = os.path.splitext(os.path.basename(path))[0] + ".docx"
+    shutil.copy({docx!r}, os.path.join(outdir, name))
+"""
+
+
+def test_convert_many_uses_one_soffice_run(parser, fixture_path, tmp_path):
+    calls = tmp_path / "calls.log"
+    soffice = tmp_path / "soffice"
+    soffice.write_text(FAKE_SOFFICE.format(
+        python=sys.executable, calls=str(calls), docx=fixture_path("kontur_price.docx")
+    ))
+    soffice.chmod(soffice.stat().st_mode | stat.S_IEXEC)
+
+    doc_paths = []
+    for number in range(5):
+        path = tmp_path / f"region{number}.doc"
+        path.write_bytes(b"not an OLE2 file %d" % number)
+        doc_paths.append(str(path))
+
+    converter = parser.OfficeConverter(1)
+    converter.checked = True
+    converter.binary = str(soffice)
+    try:
+        docx_paths = converter.convert_many(doc_paths, timeout=60)
+    finally:
+        converter.close()
+
+    assert docx_paths == [os.path.splitext(path)[0] + ".docx" for path in doc_paths]
+    assert all(os.path.exists(path) for path in docx_paths)
+    assert converter.batch_sizes == [5]
+    assert len(calls.read_text().splitlines()) == 1
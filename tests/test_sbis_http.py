@@ -0,0 +1,70 @@
+"""Быстрый режим СБИС: страницы тарифов забираются без браузера (локальный сервер вместо saby.ru)"""
+
+import asyncio
+import http.server
+import threading
+import urllib.parse
+from pathlib import Path
+
+import pytest
+
+FIXTURE = Path(__file__).resolve().parent / "fixtures" / "sbis_tariffs.html"
+
+
+class TariffsHandler(http.server.BaseHTTPRequestHandler):
+    """77 - полная страница тарифов, 01 - страница без корпоративного тарифа, остальные - ошибка сервера"""
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        page = FIXTURE.read_text(encoding="utf-8")
+        region = query.get("region", [""])[0]
+        if url.path != "/tariffs" or query.get("tab") != ["ereport"] or region not in ("77", "01"):
+            self.send_error(500)
+            return
+        if region == "01":
+            page = page.split('<div class="billing-PriceList__title">Корпоративный</div>')[0]
+        body = page.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def sbis_url(parser, monkeypatch):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), TariffsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/tariffs?tab=ereport"
+    monkeypatch.setattr(parser, "SBIS_URL", url)
+    yield url
+    server.shutdown()
+    server.server_close()
+
+
+def test_region_is_fully_parsed_over_http(parser, sbis_url):
+    regions = [("77", "Москва"), ("01", "Республика Адыгея"), ("02", "Республика Башкортостан")]
+    progress = parser.EngineProgress(len(regions))
+    recorded = []
+
+    results = asyncio.run(parser.fetch_sbis_regions_http(
+        regions, progress, lambda: False, lambda code, data: recorded.append((code, data))
+    ))
+
+    # Только полностью разобранный регион; остальные остаются для браузера
+    assert list(results) == [0]
+    region = results[0]
+    assert parser.sbis_region_complete(region)
+    assert region["Код региона"] == 77
+    assert [region[field] for field in parser.SBIS_FIELDS] == [
+        2500, 4900, 3900, 4500, 4200, 7400, 6300, 7100,
+        1500, 9900,
+        3000, 1500, 40, 35, 30,
+        18500, 33000, 72000, 125000,
+    ]
+    assert recorded == [("77", region)]
+    assert progress.done == 1
@@ -0,0 +1,84 @@
+"""
+Чтение .doc (Word 97) встроенным читателем.
+kontur_price.doc и kontur_price.docx - один и тот же документ с прайс-таблицами
+(объединенные по горизонтали и вертикали ячейки, ячейка из нескольких абзацев),
+сохраненный Aspose.Words в форматы Word 97 и Word 2007
+"""
+
+import shutil
+
+import pytest
+from docx import Document
+
+
+def table_texts(tables):
+    return [[[cell.text for cell in row.cells] for row in table.rows] for table in tables]
+
+
+def fib_offset(data):
+    """Смещение заголовка FIB (wIdent 0xA5EC) потока WordDocument в файле"""
+    for offset in range(512, len(data), 512):
+        if data[offset:offset + 2] == b"\xec\xa5":
+            return offset
+    raise AssertionError("в файле не найден заголовок FIB")
+
+
+def with_fib_flag(source, target, flag):
+    data = bytearray(open(source, "rb").read())
+    offset = fib_offset(data) + 0x0A
+    data[offset:offset + 2] = (int.from_bytes(data[offset:offset + 2], "little") | flag).to_bytes(2, "little")
+    open(target, "wb").write(bytes(data))
+
+
+class FakeConverter:
+    """Конвертер вместо LibreOffice: возвращает заранее подготовленный .docx"""
+
+    def __init__(self, docx_path):
+        self.docx_path = docx_path
+        self.converted = []
+
+    def convert(self, doc_path):
+        self.converted.append(doc_path)
+        return self.docx_path
+
+
+def test_doc_tables_match_python_docx(parser, fixture_path):
+    expected = table_texts(Document(fixture_path("kontur_price.docx")).tables)
+    tables = parser.load_word_tables(fixture_path("kontur_price.doc"))
+
+    assert table_texts(tables) == expected
+    assert expected[0][0] == ["Тариф", "Стоимость, руб.", "Стоимость, руб."]
+    assert expected[0][1] == ["Тариф", "Базовая", "Итоговая"]
+
+
+def test_doc_rows_match_python_docx(parser, fixture_path):
+    expected = [[cell.text for cell in row.cells] for table in Document(fixture_path("kontur_price.docx")).tables for row in table.rows]
+    rows = [cells for _, cells in parser.iter_word_rows(fixture_path("kontur_price.doc"))]
+    streamed = [cells for _, cells in parser.iter_word_rows(fixture_path("kontur_price.docx"))]
+    assert rows == expected
+    assert streamed == expected
+
+
+@pytest.mark.parametrize("flag, reason", [(0x0100, "зашифрован"), (0x0004, "быстрым сохранением")])
+def test_unsupported_doc_falls_back_to_converter(parser, fixture_path, tmp_path, monkeypatch, flag, reason):
+    doc_path = str(tmp_path / "price.doc")
+    with_fib_flag(fixture_path("kontur_price.doc"), doc_path, flag)
+    with pytest.raises(ValueError, match=reason):
+        parser.read_doc_tables(doc_path)
+
+    converter = FakeConverter(fixture_path("kontur_price.docx"))
+    monkeypatch.setattr(parser, "OFFICE_CONVERTER", converter)
+    tables = parser.load_word_tables(doc_path)
+
+    assert converter.converted == [doc_path]
+    assert table_texts(tables) == table_texts(Document(fixture_path("kontur_price.docx")).tables)
+
+
+def test_docx_saved_as_doc_falls_back_to_converter(parser, fixture_path, tmp_path, monkeypatch):
+    doc_path = str(tmp_path / "price.doc")
+    shutil.copy(fixture_path("kontur_price.docx"), doc_path)
+    converter = FakeConverter(fixture_path("kontur_price.docx"))
+    monkeypatch.setattr(parser, "OFFICE_CONVERTER", converter)
+
+    assert parser.load_word_tables(doc_path) is not None
+    assert converter.converted == [doc_path]
@@ -7,21 +7,48 @@ import logging
 import toml
 
 import asyncio
+import aiohttp
 import subprocess
+import threading
+import queue
+import functools
+import collections
+import multiprocessing
+import importlib.machinery
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager, closing
 from aiogram import Bot, Dispatcher, Router, F
 from aiogram.enums import ParseMode
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.client.default import DefaultBotProperties
+from aiogram.exceptions import (
+    TelegramRetryAfter, TelegramBadRequest, TelegramForbiddenError, TelegramUnauthorizedError, TelegramNotFound
+)
 from bs4 import BeautifulSoup
 import pandas as pd
 import time
 import re
+import json
+import hashlib
+import ctypes
+import select
+import struct
+import bisect
+import zipfile
+import shutil
+import tempfile
+from urllib.parse import urlparse, unquote
+import sqlite3
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from openpyxl import Workbook
 from aiogram.types import FSInputFile
+from kontur_pdf import (
+    LOG_FORMAT, LOG_DATE_FORMAT, add_error_prefix, init_pdf_worker, PDF_EXTRACTORS, run_pdf_extractors,
+    release_pdf_indexes, extract_text_from_pdf, parse_tax_representative_text, parse_tax_representative_text_legacy
+)
 
 # ========== КОНФИГУРАЦИЯ И ЛОГГИРОВАНИЕ ==========
 CONFIG_DIR = 'stat'
@@ -34,26 +61,16 @@ os.makedirs(CONFIG_DIR, exist_ok=True)
 CONFIG_FILE_NAME = Path(CURRENT_DIR, CONFIG_DIR, 'config.toml')
 LOG_FILE_NAME = Path(CURRENT_DIR, CONFIG_DIR, 'bot_log.log')
 
-CURRENT_DATE = datetime.datetime.now().date()
-CURRENT_DATE_STR = CURRENT_DATE.strftime('%d.%m.%y')
-
-FILE_NAME_SBIS = str(Path(CURRENT_DIR, CONFIG_DIR, f'sbis_price_на_{CURRENT_DATE_STR}.xlsx'))
-FILE_NAME_KONTUR = str(Path(CURRENT_DIR, CONFIG_DIR, f'kontur_price_на_{CURRENT_DATE_STR}.xlsx'))
-
-def add_error_prefix(record):
-    """Добавляет префикс ERROR только для записей с уровнем ERROR"""
-    if record.levelname == "ERROR":
-        record.msg = f"ERROR {record.msg}"
-    else:
-        record.msg = f"......{record.msg}"
-    return True
+DB_FILE_NAME = str(Path(CURRENT_DIR, CONFIG_DIR, 'parser.sqlite'))
+HTTP_DOWNLOAD_DIR = str(Path(CURRENT_DIR, CONFIG_DIR, 'http_downloads'))
+FILE_STORE_DIR = str(Path(CURRENT_DIR, CONFIG_DIR, 'file_store'))
 
 logging.basicConfig(
     level=logging.INFO,
     filename=LOG_FILE_NAME,
     filemode="w",
-    format='%(asctime)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
+    format=LOG_FORMAT,
+    datefmt=LOG_DATE_FORMAT
 )
 logging.info("________________________________________________")
 logging.info(f"*****СТАРТ программы '{PROGRAMM_NAME}'")
@@ -74,6 +91,9 @@ else:
 # ========== НАСТРОЙКИ ИЗ КОНФИГА ==========
 TELEGRAM_TOKEN = DATA.get('telegram', {}).get('token', '')
 TELEGRAM_CHAT_ID = DATA.get('telegram', {}).get('chat_id', '')
+# chat_id может быть списком: файлы с результатами отправляются во все чаты
+TELEGRAM_CHAT_IDS = list(TELEGRAM_CHAT_ID) if isinstance(TELEGRAM_CHAT_ID, list) else [TELEGRAM_CHAT_ID]
+TELEGRAM_CHAT_IDS = [chat_id for chat_id in TELEGRAM_CHAT_IDS if chat_id]
 
 if not TELEGRAM_TOKEN:
     logging.error("В конфигурационном файле отсутствует токен telegram!")
@@ -82,6 +102,134 @@ if not TELEGRAM_TOKEN:
 if not TELEGRAM_CHAT_ID:
     logging.warning("В конфигурационном файле отсутствует chat_id для отправки файлов")
 
+# Сколько браузеров каждого профиля запускать вместе с ботом
+BROWSER_WARM = max(0, int(DATA.get('browser', {}).get('warm', 1)))
+# Через сколько открытых страниц перезапускать браузер, чтобы не копилась память
+BROWSER_RECYCLE_AFTER = max(1, int(DATA.get('browser', {}).get('recycle_after', 50)))
+
+# Облегченная загрузка страниц: блокировка картинок, шрифтов и счетчиков
+BROWSER_LEAN = bool(DATA.get('browser', {}).get('lean', True))
+# Стратегия загрузки страницы Selenium: "normal", "eager" (до DOMContentLoaded) или "none"
+BROWSER_PAGE_LOAD_STRATEGY = DATA.get('browser', {}).get('page_load_strategy', 'eager')
+# Типы ресурсов, которые браузер не загружает в облегченном режиме: "image", "font", "media"
+BROWSER_BLOCKED_RESOURCES = DATA.get('browser', {}).get('blocked_resources', ["image", "font", "media"])
+# Шаблоны адресов каждого типа ресурсов (CDP блокирует запросы по адресу)
+RESOURCE_URL_PATTERNS = {
+    "image": ["*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.avif", "*.svg", "*.ico", "*.bmp"],
+    "font": ["*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot", "*fonts.googleapis.com*", "*fonts.gstatic.com*"],
+    "media": ["*.mp4", "*.webm", "*.ogv", "*.mp3", "*.m4a", "*.m3u8", "*.mov"],
+}
+# Типичный размер ресурса каждого типа (по данным CDP), по нему оценивается сэкономленный трафик
+BLOCKED_TYPICAL_BYTES = {"Image": 20 * 1024, "Font": 30 * 1024, "Media": 300 * 1024, "Script": 25 * 1024}
+BLOCKED_TYPICAL_BYTES_OTHER = 5 * 1024
+# Дополнительные шаблоны адресов (по умолчанию - счетчики аналитики)
+BROWSER_BLOCKED_URLS = [
+    pattern for resource in BROWSER_BLOCKED_RESOURCES for pattern in RESOURCE_URL_PATTERNS.get(resource, [])
+] + DATA.get('browser', {}).get('blocked_urls', [
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*",
+    "*mc.yandex.ru*", "*top-fwz1.mail.ru*", "*counter.yadro.ru*",
+    "*vk.com/rtrg*", "*connect.facebook.net*",
+])
+
+# Количество параллельных браузеров для СБИС
+SBIS_WORKERS = max(1, int(DATA.get('sbis', {}).get('workers', 4)))
+# Режим получения данных СБИС: "http" - сначала без браузера, "browser" - только через Chrome
+SBIS_FETCH_MODE = DATA.get('sbis', {}).get('fetch_mode', 'http')
+# Размер пула HTTP-соединений для быстрого режима
+SBIS_HTTP_CONNECTIONS = max(1, int(DATA.get('sbis', {}).get('http_connections', 16)))
+
+# Сколько минут готовый полный результат отдается повторным запросам без нового парсинга (0 - не отдавать)
+SBIS_RESULT_TTL_MINUTES = max(0, int(DATA.get('sbis', {}).get('result_ttl_minutes', 60)))
+KONTUR_RESULT_TTL_MINUTES = max(0, int(DATA.get('kontur', {}).get('result_ttl_minutes', 60)))
+
+# Режим скачивания файлов Контур: "http" - напрямую по ссылке с cookies браузера, "browser" - кликом в Chrome
+KONTUR_DOWNLOAD_MODE = DATA.get('kontur', {}).get('download_mode', 'http')
+# Сколько файлов Контур скачивать одновременно
+KONTUR_HTTP_CONNECTIONS = max(1, int(DATA.get('kontur', {}).get('http_connections', 8)))
+# Ограничения хранилища скачанных файлов: общий размер и срок хранения неиспользуемых файлов
+CACHE_MAX_SIZE_MB = max(1, int(DATA.get('cache', {}).get('max_size_mb', 500)))
+CACHE_MAX_AGE_DAYS = max(1, int(DATA.get('cache', {}).get('max_age_days', 30)))
+
+# Сколько процессов LibreOffice одновременно конвертируют .doc в .docx
+KONTUR_OFFICE_WORKERS = max(1, int(DATA.get('kontur', {}).get('office_workers', 2)))
+# Сколько процессов одновременно разбирают общие PDF прайс-листы Контур
+KONTUR_PDF_PROCESSES = max(1, int(DATA.get('kontur', {}).get('pdf_processes', 3)))
+# Сколько Word файлов Контур разбирается одновременно
+KONTUR_PARSE_WORKERS = max(1, int(DATA.get('kontur', {}).get('parse_workers', 2)))
+
+# Сколько заданий парсинга выполняется одновременно: всего и по одному поставщику.
+# Остальные ждут в очереди
+JOBS_MAX_TOTAL = max(1, int(DATA.get('jobs', {}).get('max_total', 2)))
+JOBS_MAX_PER_VENDOR = max(1, int(DATA.get('jobs', {}).get('max_per_vendor', 1)))
+
+# Не чаще чем раз во столько секунд обновлять сообщение с прогрессом парсинга
+PROGRESS_INTERVAL = max(1, int(DATA.get('telegram', {}).get('progress_interval', 3)))
+
+# === ОТПРАВКА В TELEGRAM ===
+# Повторы при сбоях: при ограничении частоты ждем столько, сколько просит Telegram,
+# при остальных временных ошибках - экспоненциально растущую паузу
+TELEGRAM_SEND_ATTEMPTS = 5
+TELEGRAM_RETRY_DELAY = 1
+TELEGRAM_RETRY_MAX_DELAY = 60
+# Ошибки, которые повтор не исправит
+TELEGRAM_PERMANENT_ERRORS = (TelegramBadRequest, TelegramForbiddenError, TelegramUnauthorizedError, TelegramNotFound)
+
+# file_id уже загруженных файлов: (путь, размер, время изменения) -> file_id.
+# Повторная отправка того же файла ссылается на него, а не загружает файл заново
+telegram_file_ids = {}
+
+async def telegram_retry(description, call):
+    """Выполняет await call(), повторяя при временных ошибках Telegram"""
+    delay = TELEGRAM_RETRY_DELAY
+    for attempt in range(1, TELEGRAM_SEND_ATTEMPTS + 1):
+        try:
+            return await call()
+        except TELEGRAM_PERMANENT_ERRORS:
+            raise
+        except TelegramRetryAfter as e:
+            if attempt == TELEGRAM_SEND_ATTEMPTS:
+                raise
+            wait = e.retry_after
+            logging.warning(f"{description}: Telegram просит подождать {wait} с (попытка {attempt})")
+        except Exception as e:
+            if attempt == TELEGRAM_SEND_ATTEMPTS:
+                raise
+            wait = delay
+            delay = min(delay * 2, TELEGRAM_RETRY_MAX_DELAY)
+            logging.warning(f"{description}: {str(e)}, повтор через {wait} с (попытка {attempt})")
+        await asyncio.sleep(wait)
+
+def telegram_file_key(doc):
+    stat = os.stat(doc)
+    return (os.path.abspath(doc), stat.st_size, stat.st_mtime)
+
+async def send_document(chat_id, doc):
+    """Отправляет файл по сохраненному file_id, а если его нет - загружает и запоминает file_id"""
+    key = telegram_file_key(doc)
+    file_id = telegram_file_ids.get(key)
+    if file_id is not None:
+        try:
+            rez = await telegram_retry(
+                f"Отправка {doc} в чат {chat_id}",
+                lambda: bot.send_document(chat_id=chat_id, document=file_id)
+            )
+            logging.info(f"✓ Файл {doc} отправлен в чат {chat_id} по file_id, message_id: {rez.message_id}")
+            return rez
+        except TelegramBadRequest as e:
+            logging.warning(f"file_id файла {doc} не принят ({str(e)}), загружаем файл заново")
+            telegram_file_ids.pop(key, None)
+
+    rez = await telegram_retry(
+        f"Загрузка {doc} в чат {chat_id}",
+        lambda: bot.send_document(chat_id=chat_id, document=FSInputFile(doc))
+    )
+    # Старые версии того же файла больше не понадобятся
+    for old_key in [k for k in telegram_file_ids if k[0] == key[0]]:
+        del telegram_file_ids[old_key]
+    telegram_file_ids[key] = rez.document.file_id
+    logging.info(f"✓ Файл {doc} загружен в чат {chat_id}, message_id: {rez.message_id}")
+    return rez
+
 async def send_file_into_chat(chat_id, doc, comment):
     """Отправляем файл в телеграм-чат"""
     try:
@@ -90,22 +238,14 @@ async def send_file_into_chat(chat_id, doc, comment):
         logging.info(f"Комментарий: {comment}")
 
         # Отправляем сообщение
-        msg = await bot.send_message(chat_id=chat_id, text=comment, parse_mode='HTML')
+        msg = await telegram_retry(
+            f"Сообщение в чат {chat_id}",
+            lambda: bot.send_message(chat_id=chat_id, text=comment, parse_mode='HTML')
+        )
         logging.info(f"✓ Сообщение успешно отправлено в чат {chat_id}, message_id: {msg.message_id}")
 
         # Отправляем файл
-        rez = None
-        try:
-            rez = await bot.send_document(chat_id=chat_id, document=FSInputFile(doc))
-            logging.info(f'✓ Файл {doc} успешно отправлен в чат {chat_id}, message_id: {rez.message_id}')
-            return rez
-        except Exception as e:
-            logging.error(f"✗ Ошибка отправки файла: {str(e)}", exc_info=True)
-            # Повторная попытка
-            logging.info("Пробуем повторно отправить файл...")
-            rez = await bot.send_document(chat_id=chat_id, document=FSInputFile(doc))
-            logging.info(f'✓ Файл отправлен повторно, message_id: {rez.message_id}')
-            return rez
+        return await send_document(chat_id, doc)
     except Exception as e:
         logging.error(f"✗ КРИТИЧЕСКАЯ ошибка в send_file_into_chat: {str(e)}", exc_info=True)
         return None
@@ -119,12 +259,13 @@ bot = Bot(
     default=DefaultBotProperties(parse_mode=ParseMode.HTML)
 )
 
-# Флаг отмены парсинга
-cancel_flag = False
+VENDOR_NAMES = {"sbis": "СБИС", "kontur": "Контур"}
 
-# Кнопка отмены
-cancel_button = InlineKeyboardButton(text="Отменить", callback_data="cancel_parsing")
-cancel_keyboard = InlineKeyboardMarkup(inline_keyboard=[[cancel_button]])
+def cancel_keyboard(job):
+    """Кнопка отмены конкретного задания"""
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="Отменить", callback_data=f"cancel:{job.id}")
+    ]])
 
 # Создание диспетчера и маршрутизатора
 dp = Dispatcher()
@@ -139,6 +280,10 @@ async def start_handler(message: Message):
             [
                 InlineKeyboardButton(text="СБИС", callback_data="sbis"),
                 InlineKeyboardButton(text="Контур", callback_data="kontur")
+            ],
+            [
+                InlineKeyboardButton(text="Продолжить СБИС", callback_data="resume_sbis"),
+                InlineKeyboardButton(text="Продолжить Контур", callback_data="resume_kontur")
             ]
         ]
     )
@@ -147,263 +292,1999 @@ async def start_handler(message: Message):
         reply_markup=keyboard
     )
 
-# Обработчик отмены парсинга
-@router.callback_query(F.data == "cancel_parsing")
+@router.message(F.text.lower() == "/jobs")
+async def jobs_handler(message: Message):
+    jobs = JOB_MANAGER.recent()
+    if not jobs:
+        await message.answer("Заданий парсинга пока не было")
+        return
+    await message.answer("\n".join(job.describe() for job in jobs))
+
+# Обработчик отмены парсинга: отменяется только задание, к которому относится кнопка
+@router.callback_query(F.data.startswith("cancel:"))
 async def cancel_parsing_handler(callback_query: CallbackQuery):
-    global cancel_flag
-    cancel_flag = True
+    try:
+        job = await JOB_MANAGER.cancel(int(callback_query.data.split(":", 1)[1]))
+    except ValueError:
+        job = None
+    if job is None:
+        await callback_query.answer("Задание уже завершено")
+        return
     # ОТВЕЧАЕМ СРАЗУ! Не ждем завершения парсинга
     await callback_query.answer("⏹ Парсинг отменяется...")
     # Дополнительно отправляем сообщение в чат
-    await callback_query.message.answer("❌ Парсинг отменен пользователем.")
+    await callback_query.message.answer(
+        f"❌ Парсинг {VENDOR_NAMES[job.vendor]} (задание #{job.id}) отменен пользователем."
+    )
+
+# Кнопки отмены из сообщений, отправленных до появления заданий, отменяют все текущие задания
+@router.callback_query(F.data == "cancel_parsing")
+async def cancel_all_handler(callback_query: CallbackQuery):
+    jobs = await JOB_MANAGER.cancel_all()
+    await callback_query.answer("⏹ Парсинг отменяется..." if jobs else "Нет выполняющихся заданий")
+    if jobs:
+        await callback_query.message.answer("❌ Парсинг отменен пользователем.")
+
+async def publish_progress(job, text):
+    """
+    Обновляет сообщения с прогрессом задания во всех чатах, которые его ждут.
+    Возвращает, сколько секунд Telegram просит не отправлять правки (0, если не просит)
+    """
+    if text == job.progress_text:
+        return 0
+    job.progress_text = text
+    retry_after = 0
+    for chat_id, message_id in list(job.progress_messages.items()):
+        try:
+            await bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text)
+        except TelegramRetryAfter as e:
+            retry_after = max(retry_after, e.retry_after)
+            logging.warning(f"Прогресс задания #{job.id}: Telegram просит подождать {e.retry_after} с")
+        except Exception as e:
+            logging.error(f"Не удалось обновить прогресс задания #{job.id} в чате {chat_id}: {str(e)}")
+    return retry_after
+
+async def deliver_result(job, doc, comment):
+    """Отправляет файл в чаты из конфига и в чаты, присоединившиеся к заданию"""
+    chats = list(TELEGRAM_CHAT_IDS)
+    for chat_id in job.subscribers:
+        if str(chat_id) not in {str(chat) for chat in chats}:
+            chats.append(chat_id)
+    if not chats:
+        return
+    # Файл загружается один раз, остальные чаты получают его по file_id
+    await send_file_into_chat(chats[0], doc, comment)
+    await asyncio.gather(*(send_file_into_chat(chat_id, doc, comment) for chat_id in chats[1:]))
+
+async def subscribe_job(job, callback_query):
+    """Присоединяет повторный запрос к уже идущему заданию вместо второго парсинга"""
+    vendor_name = VENDOR_NAMES[job.vendor]
+    chat_id = callback_query.message.chat.id
+    if chat_id == job.chat_id or chat_id in job.progress_messages or chat_id in job.subscribers:
+        await callback_query.message.answer(
+            f"Парсинг {vendor_name} за сегодня уже {job.STATUS_NAMES[job.status]} (задание #{job.id}), "
+            f"повторно не запускаю."
+        )
+        return
+
+    # Подписываемся до первого await, чтобы не пропустить отправку результата
+    job.subscribers.append(chat_id)
+    logging.info(f"Чат {chat_id} присоединился к заданию #{job.id} ({job.vendor})")
+    message = await callback_query.message.answer(
+        f"Парсинг {vendor_name} за сегодня уже {job.STATUS_NAMES[job.status]} (задание #{job.id}). "
+        f"Прогресс и файл с результатом придут в этот чат.\n{job.progress_text or ''}"
+    )
+    if job.active:
+        job.progress_messages[chat_id] = message.message_id
+
+def refresh_keyboard(vendor):
+    """Кнопка принудительного нового парсинга вместо готового результата"""
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text=f"Обновить {VENDOR_NAMES[vendor]}", callback_data=f"refresh_{vendor}")
+    ]])
+
+async def send_cached_result(callback_query, vendor, cached):
+    """Отправляет готовый файл недавнего полного запуска в чат запроса"""
+    vendor_name = VENDOR_NAMES[vendor]
+    logging.info(f"{vendor_name}: отдаем готовый результат от {cached['created_at']}")
+    await send_file_into_chat(
+        callback_query.message.chat.id,
+        cached["file_path"],
+        f"♻️ Результат парсинга {vendor_name} от {cached['created_at']} "
+        f"(регионов: {cached['regions_ok']}, все без ошибок)\n{cached['comment']}"
+    )
+    await callback_query.message.answer(
+        f"Новый парсинг {vendor_name} будет запущен по кнопке не раньше чем через "
+        f"{cached['expires_in']} мин. Нужны данные прямо сейчас - нажмите «Обновить».",
+        reply_markup=refresh_keyboard(vendor)
+    )
+
+async def run_parse_job(callback_query, vendor, resume_run_id=None, force=False):
+    """Создает задание, ждет свободного места по лимитам и выполняет парсинг"""
+    vendor_name = VENDOR_NAMES[vendor]
+    # Недавний полный результат отдаем сразу, если не просили обновить
+    if resume_run_id is None and not force:
+        cached = await run_lookup(result_lookup, vendor)
+        if cached is not None:
+            await send_cached_result(callback_query, vendor, cached)
+            return
+    # Такой же запрос за сегодня уже в работе - ждем его результат, а не парсим второй раз
+    job = JOB_MANAGER.find_active(vendor)
+    if job is not None:
+        await subscribe_job(job, callback_query)
+        return
+    job = JOB_MANAGER.create(vendor, callback_query.message.chat.id)
+    if not JOB_MANAGER.can_start(job):
+        await callback_query.message.answer(
+            f"Парсинг {vendor_name} (задание #{job.id}) поставлен в очередь и начнется, "
+            f"когда завершатся текущие задания.",
+            reply_markup=cancel_keyboard(job)
+        )
+
+    async def runner(job):
+        # Отправляем кнопку "Отменить"
+        started = "продолжен" if resume_run_id is not None else "начат"
+        await callback_query.message.answer(
+            f"Парсинг {vendor_name} {started} (задание #{job.id}).", reply_markup=cancel_keyboard(job)
+        )
+        if vendor == "sbis":
+            await parse_sbis(callback_query, job, resume_run_id=resume_run_id)
+        else:
+            await parse_kontur(callback_query, job, resume_run_id=resume_run_id)
+        await callback_query.message.answer(f"Парсинг {vendor_name} завершен.")
+
+    await JOB_MANAGER.run(job, runner)
 
 @router.callback_query(F.data == "sbis")
 async def sbis_handler(callback_query: CallbackQuery):
-    global cancel_flag
-    cancel_flag = False
     await callback_query.answer("Запускаю парсинг СБИС...")
-    # Отправляем кнопку "Отменить"
-    await callback_query.message.answer("Парсинг СБИС начат.", reply_markup=cancel_keyboard)
-    await parse_sbis(callback_query)
-    await callback_query.message.answer("Парсинг СБИС завершен.")
+    await run_parse_job(callback_query, "sbis")
 
 @router.callback_query(F.data == "kontur")
 async def kontur_handler(callback_query: CallbackQuery):
-    global cancel_flag
-    cancel_flag = False
     await callback_query.answer("Запускаю парсинг Контур...")
-    # Отправляем кнопку "Отменить"
-    await callback_query.message.answer("Парсинг Контур начат.", reply_markup=cancel_keyboard)
-    await parse_kontur(callback_query)
-    await callback_query.message.answer("Парсинг Контур завершен.")
+    await run_parse_job(callback_query, "kontur")
+
+@router.callback_query(F.data.in_({"refresh_sbis", "refresh_kontur"}))
+async def refresh_handler(callback_query: CallbackQuery):
+    vendor = callback_query.data.split("_", 1)[1]
+    await callback_query.answer(f"Запускаю новый парсинг {VENDOR_NAMES[vendor]}...")
+    await run_parse_job(callback_query, vendor, force=True)
+
+@router.callback_query(F.data.in_({"resume_sbis", "resume_kontur"}))
+async def resume_handler(callback_query: CallbackQuery):
+    vendor = callback_query.data.split("_", 1)[1]
+    vendor_name = VENDOR_NAMES[vendor]
+
+    run_id = await run_lookup(journal_find_resumable, vendor)
+    if run_id is None:
+        await callback_query.answer(f"Нет прерванного запуска {vendor_name} за сегодня")
+        return
 
-async def parse_sbis(callback_query: CallbackQuery):
-    global cancel_flag
-    progress_message = await bot.send_message(callback_query.from_user.id, "СБИС: 0%")
+    await callback_query.answer(f"Продолжаю парсинг {vendor_name}...")
+    await run_parse_job(callback_query, vendor, resume_run_id=run_id)
+
+# ========== ВЫПОЛНЕНИЕ ДВИЖКА ВНЕ ЦИКЛА СОБЫТИЙ ==========
+# Selenium, time.sleep, LibreOffice и разбор PDF/Word блокируют поток,
+# поэтому весь движок работает в отдельном пуле, а обработчики бота только ждут результат
+# Каждое задание занимает поток на все время парсинга (пул браузеров СБИС или движок Контур)
+# и еще поток под короткие вызовы (разбор страницы, журнал, сохранение xlsx); запас - для
+# запуска и остановки браузеров, LibreOffice и процессов разбора PDF
+ENGINE_THREADS_PER_JOB = 2
+ENGINE_THREADS_RESERVE = 3
+ENGINE_THREADS = JOBS_MAX_TOTAL * ENGINE_THREADS_PER_JOB + ENGINE_THREADS_RESERVE
+ENGINE_EXECUTOR = ThreadPoolExecutor(max_workers=ENGINE_THREADS, thread_name_prefix="engine")
+
+# Быстрые запросы к базе из обработчиков кнопок (готовый результат, прерванный запуск)
+# идут в свой пул, чтобы бот отвечал сразу, даже когда все потоки движка заняты парсингом
+LOOKUP_THREADS = 2
+LOOKUP_EXECUTOR = ThreadPoolExecutor(max_workers=LOOKUP_THREADS, thread_name_prefix="lookup")
+
+class EngineProgress:
+    """
+    Потокобезопасный счетчик обработанных регионов с оценкой оставшегося времени.
+    Время замеряется отдельно по сериям (например, "http" и браузер), оценка строится по
+    текущей серии. Регионы, взятые из журнала, учитываются в счетчике без замера времени
+    """
+
+    # По скольким последним регионам серии считается среднее время на регион
+    ETA_WINDOW = 20
+
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.series = "main"
+        self.series_started = {"main": time.monotonic()}
+        self.finished_times = {}
+        self._lock = threading.Lock()
+
+    def begin(self, series="main"):
+        """Начало серии: от этого момента отсчитывается время первого региона серии"""
+        with self._lock:
+            self.series = series
+            self.series_started[series] = time.monotonic()
+
+    def restore(self, count=1):
+        """Регионы, готовые без работы (из журнала прерванного запуска)"""
+        with self._lock:
+            self.done += count
+
+    def advance(self, series="main"):
+        with self._lock:
+            self.done += 1
+            times = self.finished_times.setdefault(series, collections.deque(maxlen=self.ETA_WINDOW))
+            times.append(time.monotonic())
+            self.series = series
+
+    def eta(self):
+        """Сколько секунд примерно осталось, None - пока в текущей серии не обработан ни один регион"""
+        with self._lock:
+            times = list(self.finished_times.get(self.series, ()))
+            started = self.series_started.get(self.series, self.series_started["main"])
+            remaining = self.total - self.done
+        if not times:
+            return None
+        if len(times) > 1:
+            per_region = (times[-1] - times[0]) / (len(times) - 1)
+        else:
+            per_region = times[0] - started
+        return max(0, per_region * remaining - (time.monotonic() - times[-1]))
+
+def run_in_engine(func, *args):
+    """Запускает блокирующую функцию движка в пуле потоков и возвращает asyncio future"""
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(ENGINE_EXECUTOR, functools.partial(func, *args))
+
+def run_lookup(func, *args):
+    """Запускает быстрый запрос к базе в пуле запросов и возвращает asyncio future"""
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(LOOKUP_EXECUTOR, functools.partial(func, *args))
+
+def format_eta(seconds):
+    if seconds is None:
+        return ""
+    minutes = int(seconds // 60)
+    if minutes == 0:
+        return ", осталось меньше минуты"
+    if minutes < 60:
+        return f", осталось ~{minutes} мин"
+    return f", осталось ~{minutes // 60} ч {minutes % 60} мин"
+
+class ProgressReporter:
+    """
+    Показывает прогресс задания в Telegram из отдельной задачи цикла событий.
+    Движок только увеличивает счетчик EngineProgress; репортер раз в interval секунд
+    берет его текущее значение и правит сообщение, если текст изменился.
+    Медленный или ограничивающий частоту Telegram не задерживает парсинг
+    """
+
+    def __init__(self, job, label, progress, interval=PROGRESS_INTERVAL):
+        self.job = job
+        self.label = label
+        self.progress = progress
+        self.interval = interval
+        self.task = None
+
+    def text(self):
+        done, total = self.progress.done, self.progress.total
+        percent = int(done / total * 100) if total else 100
+        eta = format_eta(self.progress.eta()) if done < total else ""
+        return f"{self.label}: {percent}% ({done}/{total}){eta}"
+
+    async def loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                retry_after = await publish_progress(self.job, self.text())
+            except Exception as e:
+                logging.error(f"Не удалось обновить прогресс: {str(e)}")
+                retry_after = 0
+            if retry_after:
+                await asyncio.sleep(retry_after)
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.loop())
+        return self
+
+    async def stop(self):
+        """Останавливает обновления и публикует итоговое состояние (100% без ETA после успешного прогона)"""
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+        try:
+            await publish_progress(self.job, self.text())
+        except Exception as e:
+            logging.error(f"Не удалось обновить прогресс: {str(e)}")
+
+class StagePipeline:
+    """
+    Конвейер этапов с ограниченными очередями между ними. У каждого этапа свое число потоков,
+    заполненная очередь притормаживает предыдущий этап. Этап получает элемент и результат
+    предыдущего этапа. Результаты выдаются в порядке подачи элементов.
+    При отмене новые элементы не подаются, а уже поданные проходят этапы без работы,
+    чтобы все потоки завершились
+    """
+
+    def __init__(self, name, stages, queue_size, is_cancelled):
+        self.name = name
+        self.stages = stages
+        self.queue_size = queue_size
+        self.is_cancelled = is_cancelled
+        self.stopped = threading.Event()
+
+    def cancelled(self):
+        return self.stopped.is_set() or self.is_cancelled()
+
+    def run(self, items):
+        """Генератор (элемент, результат последнего этапа, ошибка или None) в порядке items"""
+        queues = [queue.Queue(self.queue_size) for _ in self.stages]
+        # Выход не ограничен: потребитель не должен останавливать этапы
+        queues.append(queue.Queue())
+        remaining = [workers for _, _, workers in self.stages]
+        lock = threading.Lock()
+
+        def worker(number):
+            stage_name, func, _ = self.stages[number]
+            while True:
+                entry = queues[number].get()
+                if entry is None:
+                    break
+                seq, item, value, error = entry
+                if error is None:
+                    if self.cancelled():
+                        error = "отменено"
+                    else:
+                        try:
+                            value = func(item, value)
+                        except Exception as e:
+                            logging.error(f"{self.name}: этап '{stage_name}' для {item}: {str(e)}")
+                            error = str(e)
+                queues[number + 1].put((seq, item, value, error))
+            # Последний поток этапа передает завершение следующему этапу
+            with lock:
+                remaining[number] -= 1
+                last = remaining[number] == 0
+            if last:
+                next_workers = self.stages[number + 1][2] if number + 1 < len(self.stages) else 1
+                for _ in range(next_workers):
+                    queues[number + 1].put(None)
+
+        def feeder():
+            for seq, item in enumerate(items):
+                if self.cancelled():
+                    break
+                queues[0].put((seq, item, None, None))
+            for _ in range(self.stages[0][2]):
+                queues[0].put(None)
+
+        # Потоки этапов видят признак отмены задания, запустившего конвейер
+        worker = with_current_job(worker)
+        threads = [threading.Thread(target=with_current_job(feeder), name=f"{self.name}-feed", daemon=True)]
+        for number, (stage_name, _, workers) in enumerate(self.stages):
+            threads += [
+                threading.Thread(target=worker, args=(number,), name=f"{self.name}-{stage_name}", daemon=True)
+                for _ in range(workers)
+            ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            ready = {}
+            next_seq = 0
+            while True:
+                entry = queues[-1].get()
+                if entry is None:
+                    break
+                seq, item, value, error = entry
+                ready[seq] = (item, value, error)
+                while next_seq in ready:
+                    yield ready.pop(next_seq)
+                    next_seq += 1
+        finally:
+            # Потребитель перестал читать (отмена или ошибка) - остальное проходит без работы
+            self.stopped.set()
+            for thread in threads:
+                thread.join()
+
+# ========== ЗАДАНИЯ ПАРСИНГА ==========
+# Каждый запуск - отдельное задание со своим номером, признаком отмены, статусом и временем.
+# Кнопка "Отменить" отменяет только свое задание. Лимиты на число одновременных заданий
+# (всего и по поставщику) не дают двум запускам делить браузеры и файлы результатов:
+# лишние задания ждут в очереди. Признак отмены привязывается к потокам движка, поэтому
+# его видят и долгие ожидания (загрузка страницы, скачивание, конвертация)
+
+job_context = threading.local()
+
+def current_cancel_token():
+    return getattr(job_context, "token", None)
+
+@contextmanager
+def job_token_bound(token):
+    """Привязывает признак отмены задания к текущему потоку"""
+    previous = current_cancel_token()
+    job_context.token = token
+    try:
+        yield
+    finally:
+        job_context.token = previous
+
+def job_cancelled():
+    """Отменено ли задание, в потоке которого выполняется код"""
+    token = current_cancel_token()
+    return token is not None and token.is_cancelled()
+
+def with_current_job(func):
+    """Функция для нового потока с тем же признаком отмены, что и у текущего"""
+    token = current_cancel_token()
+    return token.bind(func) if token is not None else func
+
+def wait_future(future, timeout=None, poll=0.5):
+    """future.result() с проверкой отмены задания: при отмене возвращает None, не дожидаясь результата"""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        remaining = poll if deadline is None else min(poll, deadline - time.monotonic())
+        try:
+            return future.result(max(remaining, 0))
+        except FutureTimeoutError:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise
+            if job_cancelled():
+                return None
+
+class CancelToken:
+    """Признак отмены одного задания. Вызов token() равносилен token.is_cancelled()"""
+
+    def __init__(self):
+        self._event = threading.Event()
 
+    def cancel(self):
+        self._event.set()
+
+    def is_cancelled(self):
+        return self._event.is_set()
+
+    def __call__(self):
+        return self.is_cancelled()
+
+    def bind(self, func):
+        """Обертка, выполняющая func с этим признаком отмены в любом потоке"""
+        @functools.wraps(func)
+        def bound(*args, **kwargs):
+            with job_token_bound(self):
+                return func(*args, **kwargs)
+        return bound
+
+class Job:
+    STATUS_NAMES = {
+        "queued": "в очереди", "running": "выполняется", "done": "завершено",
+        "cancelled": "отменено", "failed": "ошибка",
+    }
+
+    def __init__(self, job_id, vendor, chat_id):
+        self.id = job_id
+        self.vendor = vendor
+        self.chat_id = chat_id
+        self.token = CancelToken()
+        self.status = "queued"
+        self.created_at = now_str()
+        self.started_at = None
+        self.finished_at = None
+        # Одинаковые запросы за один день присоединяются к уже идущему заданию
+        self.day = datetime.date.today()
+        self.subscribers = []
+        # Сообщения с прогрессом во всех чатах задания: chat_id -> message_id
+        self.progress_messages = {}
+        self.progress_text = None
+
+    @property
+    def cancelled(self):
+        return self.token.is_cancelled()
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    def describe(self):
+        times = f"создано {self.created_at}"
+        if self.started_at:
+            times += f", начато {self.started_at}"
+        if self.finished_at:
+            times += f", завершено {self.finished_at}"
+        return f"#{self.id} {VENDOR_NAMES[self.vendor]}: {self.STATUS_NAMES[self.status]} ({times})"
+
+class JobManager:
+    """Номера, статусы и отмена заданий; ограничение числа одновременных заданий"""
+
+    KEEP_FINISHED = 20
+
+    def __init__(self, max_total, max_per_vendor):
+        self.max_total = max_total
+        self.max_per_vendor = max_per_vendor
+        self.jobs = {}
+        self.next_id = 1
+        self._condition = None
+
+    @property
+    def condition(self):
+        # Создается внутри цикла событий бота
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    def create(self, vendor, chat_id):
+        job = Job(self.next_id, vendor, chat_id)
+        self.next_id += 1
+        self.jobs[job.id] = job
+        finished = [j.id for j in self.jobs.values() if not j.active]
+        for job_id in finished[:-self.KEEP_FINISHED]:
+            del self.jobs[job_id]
+        return job
+
+    def find_active(self, vendor):
+        """Задание того же сайта за сегодня, которое еще в очереди или выполняется"""
+        today = datetime.date.today()
+        for job in self.jobs.values():
+            if job.vendor == vendor and job.active and not job.cancelled and job.day == today:
+                return job
+        return None
+
+    def running(self, vendor=None):
+        return [
+            job for job in self.jobs.values()
+            if job.status == "running" and (vendor is None or job.vendor == vendor)
+        ]
+
+    def fits(self, job):
+        return len(self.running()) < self.max_total and len(self.running(job.vendor)) < self.max_per_vendor
+
+    def can_start(self, job):
+        """Есть ли место для задания; задания, вставшие в очередь раньше и тоже помещающиеся, идут первыми"""
+        if not self.fits(job):
+            return False
+        return not any(
+            other.status == "queued" and other.id < job.id and not other.cancelled and self.fits(other)
+            for other in self.jobs.values()
+        )
+
+    async def run(self, job, runner):
+        """Дожидается места по лимитам и выполняет await runner(job)"""
+        async with self.condition:
+            await self.condition.wait_for(lambda: job.cancelled or self.can_start(job))
+            if job.cancelled:
+                job.status = "cancelled"
+                job.finished_at = now_str()
+                self.condition.notify_all()
+                logging.info(f"Задание #{job.id} ({job.vendor}) отменено в очереди")
+                return
+            job.status = "running"
+            job.started_at = now_str()
+        logging.info(f"Задание #{job.id} ({job.vendor}) начато")
+
+        try:
+            await runner(job)
+            job.status = "cancelled" if job.cancelled else "done"
+        except Exception as e:
+            job.status = "failed"
+            logging.error(f"Задание #{job.id} ({job.vendor}) завершилось ошибкой: {str(e)}", exc_info=True)
+        finally:
+            job.finished_at = now_str()
+            logging.info(f"Задание #{job.id} ({job.vendor}): {job.STATUS_NAMES[job.status]}")
+            async with self.condition:
+                self.condition.notify_all()
+
+    async def cancel(self, job_id):
+        """Отменяет задание; None, если такого задания нет или оно уже завершено"""
+        job = self.jobs.get(job_id)
+        if job is None or not job.active:
+            return None
+        job.token.cancel()
+        async with self.condition:
+            self.condition.notify_all()
+        return job
+
+    async def cancel_all(self):
+        jobs = [job for job in self.jobs.values() if job.active]
+        for job in jobs:
+            await self.cancel(job.id)
+        return jobs
+
+    def recent(self):
+        return sorted(self.jobs.values(), key=lambda job: job.id)
+
+JOB_MANAGER = JobManager(JOBS_MAX_TOTAL, JOBS_MAX_PER_VENDOR)
+
+# ========== ОЖИДАНИЕ ГОТОВНОСТИ СТРАНИЦ ==========
+# Вместо фиксированных time.sleep ждем конкретное условие (цены на странице, файл скачан,
+# DOM перестал меняться). Прежние паузы остались только верхней границей ожидания
+WAIT_POLL_INTERVAL = 0.1
+
+# Сколько реально длилось каждое ожидание: имя -> [(секунды, лимит, условие выполнено)]
+wait_stats = {}
+wait_stats_lock = threading.Lock()
+
+def wait_for(name, predicate, timeout, poll=WAIT_POLL_INTERVAL):
+    """
+    Ждет, пока predicate() вернет истинное значение, но не дольше timeout секунд.
+    Возвращает значение предиката (ложное по таймауту) и записывает фактическое время ожидания
+    """
+    started = time.monotonic()
+    result = None
+    while True:
+        try:
+            result = predicate()
+        except Exception:
+            result = None
+        if result or time.monotonic() - started >= timeout or job_cancelled():
+            break
+        time.sleep(poll)
+
+    record_wait(name, time.monotonic() - started, timeout, bool(result))
+    return result
+
+def record_wait(name, elapsed, timeout, ok):
+    """Записывает в статистику одно ожидание (в том числе выполненное внутри страницы)"""
+    with wait_stats_lock:
+        wait_stats.setdefault(name, []).append((elapsed, timeout, ok))
+
+def log_wait_stats(prefix):
+    """Пишет в лог статистику ожиданий с данным префиксом и очищает ее"""
+    with wait_stats_lock:
+        names = sorted(name for name in wait_stats if name.startswith(prefix))
+        stats = {name: wait_stats.pop(name) for name in names}
+
+    for name, records in stats.items():
+        waited = sum(r[0] for r in records)
+        budget = sum(r[1] for r in records)
+        timeouts = sum(1 for r in records if not r[2])
+        logging.info(
+            f"Ожидание {name}: {len(records)} раз, в среднем {waited / len(records):.2f} с, "
+            f"максимум {max(r[0] for r in records):.2f} с, по таймауту {timeouts}, "
+            f"сэкономлено {max(budget - waited, 0):.1f} с из {budget:.1f} с"
+        )
+
+def dom_stable(driver, quiet_ms=300):
+    """Предикат: DOM не меняется (число узлов и длина текста) хотя бы quiet_ms миллисекунд"""
+    state = {"signature": None, "since": time.monotonic()}
+
+    def predicate():
+        signature = driver.execute_script(
+            "return [document.getElementsByTagName('*').length, "
+            "document.body ? document.body.innerText.length : 0, document.readyState];"
+        )
+        now = time.monotonic()
+        if signature != state["signature"]:
+            state["signature"] = signature
+            state["since"] = now
+            return False
+        return signature[2] == "complete" and (now - state["since"]) * 1000 >= quiet_ms
+
+    return predicate
+
+def sbis_prices_ready(driver):
+    """Предикат СБИС: на странице отрисованы кнопки с ценами тарифов"""
+    return len(driver.find_elements(By.CLASS_NAME, "billing-PriceList__priceButton")) >= 8
+
+def kontur_links_ready(driver):
+    """Предикат Контур: на странице есть ссылки на скачивание прайс-листов"""
+    return driver.execute_script(
+        "return document.readyState === 'complete' && "
+        "Array.from(document.links).some(function (a) { return a.textContent.indexOf('Скачать') !== -1; });"
+    )
+
+def download_finished(directory, known_files):
+    """Предикат загрузки: в папке появился новый полностью скачанный файл, возвращает его путь"""
+    def predicate():
+        names = os.listdir(directory)
+        if any(f.endswith('.crdownload') for f in names):
+            return None
+        for f in names:
+            if f in known_files or f.startswith('.') or f.startswith('~'):
+                continue
+            path = os.path.join(directory, f)
+            if os.path.getsize(path) > 100:
+                return path
+        return None
+
+    return predicate
+
+# Скачивание кликом идет в отдельную папку, созданную под этот файл. Готовность отслеживается
+# через inotify (Chrome переименовывает .crdownload в итоговое имя), а если inotify недоступен -
+# прежним опросом папки. В отдельной папке не может оказаться чужой или старый файл
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct("iIII")
+
+# inotify есть только в Linux; на Windows и macOS остается опрос папки
+libc = None
+if sys.platform.startswith("linux"):
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError, TypeError):
+        libc = None
+
+def downloaded_file(directory, name):
+    """Путь к готовому файлу или None для временных и пустых файлов"""
+    if name.startswith('.') or name.startswith('~') or name.endswith(('.crdownload', '.tmp')):
+        return None
+    path = os.path.join(directory, name)
+    if os.path.isfile(path) and os.path.getsize(path) > 100:
+        return path
+    return None
+
+def wait_download_inotify(directory, timeout):
+    """Ждет события inotify о готовом файле в папке. None - таймаут, False - inotify недоступен"""
+    if libc is None:
+        return False
+    fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if fd < 0:
+        return False
+    try:
+        if libc.inotify_add_watch(fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            return False
+
+        # Файл мог докачаться до установки наблюдения
+        for name in os.listdir(directory):
+            path = downloaded_file(directory, name)
+            if path:
+                return path
+
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or job_cancelled():
+                return None
+            # Ждем частями, чтобы вовремя заметить отмену задания
+            readable, _, _ = select.select([fd], [], [], min(remaining, 0.5))
+            if not readable:
+                continue
+            buffer = os.read(fd, 64 * 1024)
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(buffer, offset)
+                offset += INOTIFY_EVENT.size
+                name = buffer[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+                offset += length
+                path = downloaded_file(directory, name)
+                if path:
+                    return path
+    finally:
+        os.close(fd)
+
+def wait_download(directory, timeout):
+    """Возвращает путь к скачанному в папку файлу, как только загрузка завершится (None по таймауту)"""
+    started = time.monotonic()
+    path = wait_download_inotify(directory, timeout)
+    if path is False:
+        return wait_for("kontur.download", download_finished(directory, set()), timeout)
+    record_wait("kontur.download", time.monotonic() - started, timeout, path is not None)
+    return path
+
+# ========== ПУЛ БРАУЗЕРОВ ==========
+# Браузеры запускаются вместе с ботом и переиспользуются между командами: для каждого
+# сайта свой профиль настроек. Перед выдачей сессия проверяется на живость, упавшие
+# сессии пересоздаются, а после BROWSER_RECYCLE_AFTER страниц браузер перезапускается
+BROWSER_USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+DOWNLOAD_DIR = os.path.abspath("downloads")
+
+def lean_load_options(options):
+    """
+    Облегченный профиль загрузки: стратегия загрузки страницы и журнал сети для статистики.
+    Журнал производительности Chrome включается только в этом режиме и только для событий сети
+    """
+    if not BROWSER_LEAN:
+        return
+    options.page_load_strategy = BROWSER_PAGE_LOAD_STRATEGY
+    options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+    options.add_experimental_option('perfLoggingPrefs', {'enableNetwork': True, 'enablePage': False})
+
+def enable_resource_blocking(driver):
+    """
+    Через CDP запрещает браузеру загружать ресурсы типов BROWSER_BLOCKED_RESOURCES и счетчики.
+    Перехват Fetch по типу ресурса здесь не подходит: на каждый перехваченный запрос нужно
+    отвечать из обработчика событий CDP, а Selenium умеет только отправлять команды
+    """
+    if not BROWSER_LEAN:
+        return
+    driver.execute_cdp_cmd('Network.enable', {})
+    driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BROWSER_BLOCKED_URLS})
+
+def report_network_usage(driver, label):
+    """
+    Пишет в лог, сколько запросов сделала страница, сколько из них заблокировано (по типам ресурсов),
+    сколько загружено и примерно сколько трафика сэкономлено (по типичному размеру ресурса типа)
+    """
+    if not BROWSER_LEAN:
+        return
+    try:
+        entries = driver.get_log('performance')
+    except Exception:
+        return
+
+    requests_sent = 0
+    blocked_types = collections.Counter()
+    bytes_loaded = 0
+    for entry in entries:
+        try:
+            message = json.loads(entry['message'])['message']
+        except (KeyError, ValueError):
+            continue
+        method = message.get('method')
+        params = message.get('params', {})
+        if method == 'Network.requestWillBeSent':
+            requests_sent += 1
+        elif method == 'Network.loadingFailed' and params.get('blockedReason'):
+            blocked_types[params.get('type', 'Other')] += 1
+        elif method == 'Network.loadingFinished':
+            bytes_loaded += params.get('encodedDataLength', 0)
+
+    bytes_saved = sum(
+        BLOCKED_TYPICAL_BYTES.get(resource, BLOCKED_TYPICAL_BYTES_OTHER) * count
+        for resource, count in blocked_types.items()
+    )
+    blocked_detail = ", ".join(f"{resource} {count}" for resource, count in blocked_types.most_common())
+    logging.info(
+        f"{label}: запросов {requests_sent}, заблокировано {sum(blocked_types.values())}"
+        f"{f' ({blocked_detail})' if blocked_detail else ''}, загружено {bytes_loaded / 1024:.0f} КБ, "
+        f"сэкономлено ~{bytes_saved / 1024:.0f} КБ"
+    )
+
+def create_sbis_driver():
+    """Создает headless Chrome для парсинга СБИС"""
     options = webdriver.ChromeOptions()
     options.add_argument('--headless')
     options.add_argument('--disable-gpu')
     options.add_argument('--no-sandbox')
     options.add_argument('--disable-dev-shm-usage')
+    lean_load_options(options)
     driver = webdriver.Chrome(options=options)
+    enable_resource_blocking(driver)
+    # Скрипт извлечения сам ждет раскрытия блоков, поэтому ему нужен запас времени
+    driver.set_script_timeout(20)
+    return driver
+
+def parse_sbis_price_list(soup):
+    """Извлекает основные тарифы, нулевку и корпоративный тариф из разметки страницы СБИС"""
+    price_spans = soup.find_all("span", class_="billing-PriceList__priceButton")
+    null_span = soup.find("span", {"data-qa": "EOpNull"})
+    return parse_sbis_prices([span.text for span in price_spans], null_span.text if null_span else None)
+
+def parse_sbis_prices(price_texts, null_text):
+    """Разбирает тексты кнопок с ценами и цену нулевки"""
+    # ОСНОВНЫЕ ТАРИФЫ
+    prices = [text.strip().replace(" ", "") for text in price_texts]
+    filtered_prices = prices[:8] if len(prices) >= 8 else []
+
+    # НУЛЕВКА
+    null_price_raw = null_text.strip().replace(" ", "") if null_text else None
+    null_price = safe_int(null_price_raw)
+
+    # КОРПОРАТИВНЫЙ ТАРИФ
+    corporate_prices = []
+    if len(prices) >= 13:
+        corporate_prices = [
+            safe_int(prices[9]),
+            safe_int(prices[10]),
+            safe_int(prices[11]),
+            safe_int(prices[12])
+        ]
 
-    url = "https://saby.ru/tariffs?tab=ereport"
-    driver.get(url)
-    time.sleep(5)
+    return filtered_prices, null_price, corporate_prices
+
+def parse_sbis_buhta_text(container_text):
+    """Ищет цену Бухты/УПБ в тексте блока тарифа"""
+    matches = re.findall(r'(\d{1,3}\s?\d{3,4})', container_text)
+    for match in matches:
+        price_clean = match.replace(' ', '')
+        if price_clean.isdigit() and 5000 <= int(price_clean) <= 20000:
+            return int(price_clean)
+    return None
+
+def parse_sbis_auth_buh_text(full_text):
+    """Разбирает цены 'Уполномоченной бухгалтерии' из полного текста страницы"""
+    auth = {
+        "стоимость лицензии": None,
+        "за квартал (минимум)": None,
+        "1-199": None,
+        "200-999": None,
+        ">1000": None,
+    }
 
-    wait = WebDriverWait(driver, 20)
-    all_data = []
+    # Парсим стоимость лицензии (подключение)
+    connect_match = re.search(r'Подключение[^\d]*(\d[\d\s]*)', full_text, re.IGNORECASE)
+    if connect_match:
+        connect_price_str = connect_match.group(1).replace(' ', '')
+        if connect_price_str.isdigit():
+            auth["стоимость лицензии"] = int(connect_price_str)
+
+    # Парсим за квартал (минимум)
+    quarter_match = re.search(r'(?:квартал|Квартал)[^\d]*(\d[\d\s]*)', full_text, re.IGNORECASE)
+    if not quarter_match:
+        quarter_match = re.search(r'от\s*(\d[\d\s]*)\s*[₽руб]*\s*за\s*квартал', full_text, re.IGNORECASE)
+    if quarter_match:
+        quarter_price_str = quarter_match.group(1).replace(' ', '')
+        if quarter_price_str.isdigit():
+            auth["за квартал (минимум)"] = int(quarter_price_str)
+
+    # ПАРСИНГ ЦЕН ОТЧЕТОВ
+    auth_index = full_text.find("Уполномоченная бухгалтерия")
+    if auth_index != -1:
+        auth_section = full_text[auth_index:]
+
+        # 1-199 (берем первые 2 цифры)
+        range_1_match = re.search(r'1[–-]199[^\d]*(\d{2,3})', auth_section)
+        if range_1_match:
+            price_str = range_1_match.group(1)
+            if len(price_str) >= 2:
+                auth["1-199"] = int(price_str[:2])
+
+        # 200-999
+        range_2_match = re.search(r'200[–-]999[^\d]*(\d{2,3})', auth_section)
+        if range_2_match:
+            auth["200-999"] = int(range_2_match.group(1))
+
+        # >1000
+        range_3_match = re.search(r'≥1\s*000\s*(\d{2,3})', auth_section)
+        if not range_3_match:
+            range_3_match = re.search(r'≥1000\s*(\d{2,3})', auth_section)
+        if not range_3_match:
+            range_3_match = re.search(r'>1\s*000\s*(\d{2,3})', auth_section)
+        if not range_3_match:
+            range_3_match = re.search(r'>1000\s*(\d{2,3})', auth_section)
+        if range_3_match:
+            auth[">1000"] = int(range_3_match.group(1))
+
+    return auth
+
+def build_sbis_region_data(region_code, region_name, filtered_prices, null_price, corporate_prices, buhta_price, auth):
+    """Собирает словарь данных региона СБИС в формате, который ожидает Excel"""
+    return {
+        "Код региона": int(region_code),
+        "Название региона": region_name,
+        "Легкий_ИП": safe_int(filtered_prices[0]) if filtered_prices else None,
+        "Легкий_Бюджет": safe_int(filtered_prices[1]) if filtered_prices else None,
+        "Легкий_УСН": safe_int(filtered_prices[2]) if filtered_prices else None,
+        "Легкий_ОСНО": safe_int(filtered_prices[3]) if filtered_prices else None,
+        "Базовый_ИП": safe_int(filtered_prices[4]) if len(filtered_prices) > 4 else None,
+        "Базовый_Бюджет": safe_int(filtered_prices[5]) if len(filtered_prices) > 5 else None,
+        "Базовый_УСН": safe_int(filtered_prices[6]) if len(filtered_prices) > 6 else None,
+        "Базовый_ОСНО": safe_int(filtered_prices[7]) if len(filtered_prices) > 7 else None,
+        "Нулевка или ИП без сотрудников": null_price,
+        "ОБ (Buhta) и УПБ": buhta_price,
+        "стоимость лицензии": auth["стоимость лицензии"],
+        "за квартал (минимум)": auth["за квартал (минимум)"],
+        "1-199": auth["1-199"],
+        "200-999": auth["200-999"],
+        ">1000": auth[">1000"],
+        "5": corporate_prices[0] if corporate_prices else None,
+        "10": corporate_prices[1] if len(corporate_prices) > 1 else None,
+        "25": corporate_prices[2] if len(corporate_prices) > 2 else None,
+        "50": corporate_prices[3] if len(corporate_prices) > 3 else None,
+    }
+
+def sbis_region_complete(region_data):
+    """Проверяет, что у региона СБИС заполнены все 19 тарифных полей"""
+    return all(region_data.get(field) is not None for field in SBIS_FIELDS)
+
+def sbis_region_status(region_data):
+    """Статус региона СБИС для журнала: неполный регион при продолжении обходится заново"""
+    return "ok" if sbis_region_complete(region_data) else "failed"
+
+def create_kontur_driver(download_dir):
+    """Создает headless Chrome для Контур с настройками загрузки и скрытием WebDriver"""
+    # === УЛУЧШЕННАЯ НАСТРОЙКА SELENIUM ДЛЯ HEADLESS ===
+    options = webdriver.ChromeOptions()
+
+    # Headless режим с улучшенными настройками
+    options.add_argument('--headless=new')
+    options.add_argument('--no-sandbox')
+    options.add_argument('--disable-dev-shm-usage')
+    options.add_argument('--disable-gpu')
+    options.add_argument('--window-size=1920,1080')
+
+    # Настройки для обхода защиты и улучшения совместимости
+    options.add_argument('--disable-blink-features=AutomationControlled')
+    options.add_experimental_option("excludeSwitches", ["enable-automation", "enable-logging"])
+    options.add_experimental_option('useAutomationExtension', False)
+
+    # Улучшенный User-Agent
+    options.add_argument(f'--user-agent={BROWSER_USER_AGENT}')
+
+    # Настройки загрузки файлов
+    profile = {
+        "download.default_directory": download_dir,
+        "download.prompt_for_download": False,
+        "download.directory_upgrade": True,
+        "plugins.always_open_pdf_externally": True,
+        "safebrowsing.enabled": True,
+        "profile.default_content_settings.popups": 0
+    }
+    options.add_experimental_option("prefs", profile)
+
+    # Дополнительные опции для стабильности
+    options.add_argument('--disable-features=VizDisplayCompositor')
+    options.add_argument('--disable-software-rasterizer')
+    options.add_argument('--disable-extensions')
+    options.add_argument('--disable-plugins')
+    options.add_argument('--disable-background-timer-throttling')
+    options.add_argument('--disable-backgrounding-occluded-windows')
+    options.add_argument('--disable-renderer-backgrounding')
+    lean_load_options(options)
+
+    driver = webdriver.Chrome(options=options)
+    enable_resource_blocking(driver)
+
+    # Улучшенное скрытие WebDriver
+    driver.execute_cdp_cmd('Network.setUserAgentOverride', {
+        "userAgent": BROWSER_USER_AGENT
+    })
+    driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {
+        'source': '''
+            Object.defineProperty(navigator, 'webdriver', {
+                get: () => undefined
+            });
+            Object.defineProperty(navigator, 'plugins', {
+                get: () => [1, 2, 3, 4, 5]
+            });
+            Object.defineProperty(navigator, 'languages', {
+                get: () => ['ru-RU', 'ru', 'en-US', 'en']
+            });
+        '''
+    })
+
+    return driver
+
+class BrowserSession:
+    """Один запущенный браузер из пула и счетчик открытых в нем страниц"""
+    def __init__(self, profile, driver):
+        self.profile = profile
+        self.driver = driver
+        self.pages = 0
+
+    def get(self, url):
+        self.driver.get(url)
+        self.pages += 1
+
+class BrowserPool:
+    """Долгоживущий пул браузеров с отдельными профилями для СБИС и Контур"""
+    def __init__(self, factories, max_sessions, recycle_after):
+        self._factories = factories
+        self._max_sessions = max_sessions
+        self._recycle_after = recycle_after
+        self._idle = {profile: [] for profile in factories}
+        self._count = {profile: 0 for profile in factories}
+        self._cond = threading.Condition()
+
+    @staticmethod
+    def is_alive(session):
+        try:
+            session.driver.execute_script("return 1;")
+            return True
+        except Exception:
+            return False
+
+    def _create(self, profile):
+        try:
+            driver = self._factories[profile]()
+        except Exception:
+            with self._cond:
+                self._count[profile] -= 1
+                self._cond.notify_all()
+            raise
+        logging.info(f"Пул браузеров: запущен браузер профиля {profile}")
+        return BrowserSession(profile, driver)
+
+    def _quit(self, session):
+        try:
+            session.driver.quit()
+        except Exception:
+            pass
+        with self._cond:
+            self._count[session.profile] -= 1
+            self._cond.notify_all()
+
+    def acquire(self, profile):
+        """Выдает живую сессию профиля, при необходимости запуская новый браузер"""
+        while True:
+            with self._cond:
+                while not self._idle[profile] and self._count[profile] >= self._max_sessions[profile]:
+                    self._cond.wait()
+                if self._idle[profile]:
+                    session = self._idle[profile].pop()
+                else:
+                    self._count[profile] += 1
+                    session = None
+
+            if session is None:
+                return self._create(profile)
+            if self.is_alive(session):
+                return session
+
+            logging.error(f"Пул браузеров: браузер профиля {profile} не отвечает, перезапускаем")
+            self._quit(session)
+
+    def release(self, session, broken=False):
+        """Возвращает сессию в пул; сломанные и отработавшие свое браузеры закрываются"""
+        if broken or session.pages >= self._recycle_after:
+            if not broken:
+                logging.info(f"Пул браузеров: браузер профиля {session.profile} открыл {session.pages} страниц, перезапускаем")
+            self._quit(session)
+            return
+        with self._cond:
+            self._idle[session.profile].append(session)
+            self._cond.notify_all()
+
+    @contextmanager
+    def session(self, profile):
+        session = self.acquire(profile)
+        broken = False
+        try:
+            yield session
+        except Exception:
+            broken = not self.is_alive(session)
+            raise
+        finally:
+            self.release(session, broken)
+
+    def start(self, warm):
+        """Заранее запускает по warm браузеров каждого профиля"""
+        for profile in self._factories:
+            sessions = []
+            for _ in range(min(warm, self._max_sessions[profile])):
+                try:
+                    sessions.append(self.acquire(profile))
+                except Exception as e:
+                    logging.error(f"Пул браузеров: не удалось запустить браузер профиля {profile}: {str(e)}")
+                    break
+            for session in sessions:
+                self.release(session)
+
+    def close(self):
+        with self._cond:
+            sessions = [session for idle in self._idle.values() for session in idle]
+            for idle in self._idle.values():
+                idle.clear()
+        for session in sessions:
+            self._quit(session)
+
+BROWSER_POOL = BrowserPool(
+    factories={
+        "sbis": create_sbis_driver,
+        "kontur": lambda: create_kontur_driver(DOWNLOAD_DIR),
+    },
+    max_sessions={"sbis": SBIS_WORKERS, "kontur": 1},
+    recycle_after=BROWSER_RECYCLE_AFTER
+)
+
+# ========== ЛОКАЛЬНАЯ БАЗА И ЖУРНАЛ ЗАПУСКОВ ==========
+# Каждый готовый регион сразу записывается в журнал (SQLite). Если бот упал, браузер
+# сломался или парсинг отменили, кнопка "Продолжить" дообходит только недостающие
+# и неудачные регионы, а Excel собирается заново из журнала
+DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    vendor TEXT NOT NULL,
+    run_date TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    finished_at TEXT,
+    status TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_vendor_date ON runs (vendor, run_date);
+
+CREATE TABLE IF NOT EXISTS run_regions (
+    run_id INTEGER NOT NULL,
+    region_code TEXT NOT NULL,
+    status TEXT NOT NULL,
+    data TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (run_id, region_code)
+);
+
+CREATE TABLE IF NOT EXISTS price_history (
+    vendor TEXT NOT NULL,
+    region_code TEXT NOT NULL,
+    field TEXT NOT NULL,
+    price_date TEXT NOT NULL,
+    region_name TEXT,
+    value TEXT NOT NULL,
+    PRIMARY KEY (vendor, region_code, field, price_date)
+);
+CREATE INDEX IF NOT EXISTS price_history_vendor_date ON price_history (vendor, price_date);
+
+CREATE TABLE IF NOT EXISTS http_cache (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    file_path TEXT NOT NULL,
+    fetched_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS file_store (
+    content_hash TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS file_store_last_used ON file_store (last_used);
+
+CREATE TABLE IF NOT EXISTS parsed_cache (
+    content_hash TEXT NOT NULL,
+    parser TEXT NOT NULL,
+    parser_version INTEGER NOT NULL,
+    result TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    PRIMARY KEY (content_hash, parser, parser_version)
+);
+
+CREATE TABLE IF NOT EXISTS results (
+    vendor TEXT PRIMARY KEY,
+    run_id INTEGER NOT NULL,
+    file_path TEXT NOT NULL,
+    file_size INTEGER NOT NULL,
+    file_mtime REAL NOT NULL,
+    regions_ok INTEGER NOT NULL,
+    regions_failed INTEGER NOT NULL,
+    cancelled INTEGER NOT NULL,
+    comment TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    created_ts REAL NOT NULL
+);
+"""
+
+db_initialized = False
+db_init_lock = threading.Lock()
+
+# Запуски, которые выполняются в этом процессе прямо сейчас (их продолжать нельзя)
+active_runs = set()
+
+def db_connect():
+    """Открывает соединение с локальной базой парсера, при первом обращении создает таблицы"""
+    global db_initialized
+    connection = sqlite3.connect(DB_FILE_NAME, timeout=30)
+    if not db_initialized:
+        with db_init_lock:
+            if not db_initialized:
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.executescript(DB_SCHEMA)
+                db_initialized = True
+    return connection
+
+def now_str():
+    return datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def run_date_str():
+    """Дата запуска для журнала. Бот работает сутками, поэтому берется в момент запуска, а не при старте"""
+    return datetime.date.today().strftime('%d.%m.%y')
+
+def result_file_name(vendor, run_date):
+    """Путь xlsx результата поставщика ("sbis" или "kontur") с датой запуска из run_date_str()"""
+    return str(Path(CURRENT_DIR, CONFIG_DIR, f'{vendor}_price_на_{run_date}.xlsx'))
+
+def journal_start_run(vendor, run_date):
+    """Создает запись о новом запуске с датой run_date и возвращает его номер"""
+    with closing(db_connect()) as connection, connection:
+        cursor = connection.execute(
+            "INSERT INTO runs (vendor, run_date, started_at, status) VALUES (?, ?, ?, 'running')",
+            (vendor, run_date, now_str())
+        )
+        run_id = cursor.lastrowid
+    active_runs.add(run_id)
+    logging.info(f"Журнал: начат запуск {run_id} ({vendor})")
+    return run_id
+
+def journal_reopen_run(run_id):
+    """Помечает прерванный запуск как снова выполняющийся"""
+    with closing(db_connect()) as connection, connection:
+        connection.execute("UPDATE runs SET status = 'running', finished_at = NULL WHERE run_id = ?", (run_id,))
+    active_runs.add(run_id)
+    logging.info(f"Журнал: продолжаем запуск {run_id}")
+
+def journal_record_region(run_id, region_code, status, data):
+    """Сохраняет результат одного региона сразу после его обработки"""
+    try:
+        with closing(db_connect()) as connection, connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO run_regions (run_id, region_code, status, data, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (run_id, str(region_code), status, json.dumps(data, ensure_ascii=False), now_str())
+            )
+    except Exception as e:
+        logging.error(f"Журнал: не удалось записать регион {region_code} запуска {run_id}: {str(e)}")
+
+def journal_load_regions(run_id):
+    """Возвращает {код региона: (статус, данные)} для запуска"""
+    with closing(db_connect()) as connection:
+        rows = connection.execute(
+            "SELECT region_code, status, data FROM run_regions WHERE run_id = ?", (run_id,)
+        ).fetchall()
+    return {code: (status, json.loads(data)) for code, status, data in rows}
+
+def journal_ok_regions(regions):
+    """Из {код: (статус, данные)} журнала - данные успешно записанных регионов, остальные обходятся заново"""
+    return {code: data for code, (status, data) in regions.items() if status == "ok"}
+
+def journal_finish_run(run_id, region_codes, cancelled):
+    """Закрывает запуск: complete, если все регионы записаны успешно, иначе cancelled/incomplete"""
+    regions = journal_load_regions(run_id)
+    all_ok = all(regions.get(str(code), ("missing", None))[0] == "ok" for code in region_codes)
+    status = "cancelled" if cancelled else ("complete" if all_ok else "incomplete")
+    with closing(db_connect()) as connection, connection:
+        connection.execute(
+            "UPDATE runs SET status = ?, finished_at = ? WHERE run_id = ?", (status, now_str(), run_id)
+        )
+    active_runs.discard(run_id)
+    logging.info(f"Журнал: запуск {run_id} завершен со статусом {status}")
+    return status
+
+def journal_find_resumable(vendor):
+    """Последний незавершенный запуск за сегодня, который сейчас не выполняется"""
+    with closing(db_connect()) as connection:
+        rows = connection.execute(
+            "SELECT run_id FROM runs WHERE vendor = ? AND run_date = ? AND status != 'complete' "
+            "ORDER BY run_id DESC",
+            (vendor, run_date_str())
+        ).fetchall()
+    for (run_id,) in rows:
+        if run_id not in active_runs:
+            return run_id
+    return None
+
+# ========== ГОТОВЫЕ РЕЗУЛЬТАТЫ ==========
+# Последний xlsx каждого поставщика с данными о полноте запуска. Повторный запрос в пределах
+# result_ttl_minutes получает этот файл сразу, если запуск был полным и файл с тех пор не менялся
+RESULT_TTL_MINUTES = {"sbis": SBIS_RESULT_TTL_MINUTES, "kontur": KONTUR_RESULT_TTL_MINUTES}
+
+def result_store(vendor, run_id, file_path, region_codes, cancelled, comment):
+    """Запоминает файл результата запуска и сколько регионов в нем получено без ошибок"""
+    regions = journal_load_regions(run_id)
+    regions_ok = sum(1 for code in region_codes if regions.get(str(code), ("missing", None))[0] == "ok")
+    stat = os.stat(file_path)
+    with closing(db_connect()) as connection, connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO results (vendor, run_id, file_path, file_size, file_mtime, regions_ok, "
+            "regions_failed, cancelled, comment, created_at, created_ts) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (vendor, run_id, file_path, stat.st_size, stat.st_mtime, regions_ok, len(region_codes) - regions_ok,
+             int(bool(cancelled)), comment, now_str(), time.time())
+        )
+    logging.info(
+        f"Результат {vendor}: запуск {run_id}, регионов без ошибок {regions_ok} из {len(region_codes)}"
+        f"{', отменен' if cancelled else ''}"
+    )
 
-    def safe_int(val):
-        if val and str(val).isdigit():
-            return int(val)
+def result_lookup(vendor):
+    """Свежий полный результат поставщика: dict с файлом и описанием или None"""
+    ttl_minutes = RESULT_TTL_MINUTES[vendor]
+    if ttl_minutes == 0:
         return None
+    with closing(db_connect()) as connection:
+        row = connection.execute(
+            "SELECT file_path, file_size, file_mtime, regions_ok, regions_failed, cancelled, comment, "
+            "created_at, created_ts FROM results WHERE vendor = ?",
+            (vendor,)
+        ).fetchone()
+    if row is None:
+        return None
+    file_path, file_size, file_mtime, regions_ok, regions_failed, cancelled, comment, created_at, created_ts = row
 
+    age = time.time() - created_ts
+    if cancelled or regions_failed or age > ttl_minutes * 60:
+        return None
+    # Файл могли перезаписать или удалить после запуска
     try:
-        # Загружаем регионы из конфига
-        regions_to_process = DATA.get('regions_sbis', [])
-        # Преобразуем в кортежи если нужно
-        regions_to_process = [tuple(r) for r in regions_to_process]
-
-        if not regions_to_process:
-            logging.error("В конфиге отсутствует список регионов для СБИС!")
-            await callback_query.message.answer("❌ Ошибка: список регионов не найден в конфиге")
-            driver.quit()
-            return
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    if stat.st_size != file_size or stat.st_mtime != file_mtime:
+        return None
 
-        logging.info(f"Загружено {len(regions_to_process)} регионов для СБИС из конфига")
+    return {
+        "file_path": file_path,
+        "comment": comment,
+        "created_at": created_at,
+        "regions_ok": regions_ok,
+        "expires_in": int((ttl_minutes * 60 - age) // 60) + 1,
+    }
 
-        total = len(regions_to_process)
+# ========== ИСТОРИЯ ЦЕН ==========
+# Значения каждого запуска хранятся в price_history по ключу (поставщик, регион, колонка, дата).
+# Лист "Изменения" строится запросом к базе против предыдущей даты, старые xlsx не перечитываются.
+# Дата берется в момент сохранения запуска: бот работает сутками, и дата старта устаревает
+DIFF_SHEET_TITLE = "Изменения"
 
-        for i, (region_code, region_name) in enumerate(regions_to_process):
-            if cancel_flag:
-                break
+def region_key(region_code):
+    """Код региона без ведущих нулей: в конфиге "01", в таблицах 1"""
+    try:
+        return str(int(region_code))
+    except (TypeError, ValueError):
+        return str(region_code)
+
+def history_store(vendor, rows, price_date):
+    """Сохраняет значения запуска за price_date. rows - список (код региона, название, {колонка: значение})"""
+    records = []
+    for region_code, region_name, values in rows:
+        for field, value in values.items():
+            # Неизвлеченные значения не сохраняем, чтобы сбой парсинга не выглядел как изменение цены
+            if value is None or value == "" or value == "❌":
+                continue
+            records.append((
+                vendor, region_key(region_code), field, price_date, region_name,
+                json.dumps(value, ensure_ascii=False)
+            ))
+
+    with closing(db_connect()) as connection, connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO price_history (vendor, region_code, field, price_date, region_name, value) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            records
+        )
+    logging.info(f"История цен: {vendor} - сохранено {len(records)} значений за {price_date}")
+
+def history_diff(vendor, price_date):
+    """
+    Сравнивает значения за price_date с предыдущей датой. Возвращает
+    (предыдущая дата, [(код, название, колонка, было, стало)]) только по изменившимся ячейкам
+    """
+    with closing(db_connect()) as connection:
+        (previous_date,) = connection.execute(
+            "SELECT MAX(price_date) FROM price_history WHERE vendor = ? AND price_date < ?",
+            (vendor, price_date)
+        ).fetchone()
+        if previous_date is None:
+            return None, []
+
+        rows = connection.execute(
+            "SELECT cur.region_code, cur.region_name, cur.field, prev.value, cur.value "
+            "FROM price_history AS cur "
+            "JOIN price_history AS prev ON prev.vendor = cur.vendor AND prev.region_code = cur.region_code "
+            "AND prev.field = cur.field AND prev.price_date = ? "
+            "WHERE cur.vendor = ? AND cur.price_date = ? AND prev.value != cur.value "
+            "ORDER BY CAST(cur.region_code AS INTEGER), cur.field",
+            (previous_date, vendor, price_date)
+        ).fetchall()
+
+    changes = [
+        (code, name, field, json.loads(old_value), json.loads(new_value))
+        for code, name, field, old_value, new_value in rows
+    ]
+    return previous_date, changes
+
+def history_report(vendor, rows):
+    """
+    Сохраняет значения запуска в историю. Возвращает краткое описание изменений для подписи
+    к файлу и (предыдущая дата, дата запуска, изменения) для листа "Изменения" или None
+    """
+    try:
+        price_date = datetime.date.today().isoformat()
+        history_store(vendor, rows, price_date)
+        previous_date, changes = history_diff(vendor, price_date)
+        if previous_date is None:
+            return "Предыдущих данных для сравнения нет", None
+
+        logging.info(f"История цен: {vendor} - изменений относительно {previous_date}: {len(changes)}")
+        diff = (previous_date, price_date, changes)
+        if not changes:
+            return f"Изменений относительно {previous_date} нет", diff
+        return f"Изменений относительно {previous_date}: {len(changes)} (лист \"{DIFF_SHEET_TITLE}\")", diff
+    except Exception as e:
+        logging.error(f"История цен: ошибка для {vendor}: {str(e)}", exc_info=True)
+        return "", None
+
+# ========== ЗАПИСЬ РЕЗУЛЬТАТОВ В EXCEL ==========
+# Во время парсинга строки хранятся в памяти по колонкам, а контрольные точки - это дозапись
+# готовой строки в журнал (SQLite), поэтому их стоимость не растет вместе с таблицей.
+# Файл xlsx собирается один раз в конце: книга в режиме write_only пишется потоком,
+# а ячейки ссылаются на общие именованные стили вместо собственных объектов Font/Alignment
+
+STYLE_HEADER = "Заголовок"
+STYLE_BOLD = "Жирный"
+STYLE_LEFT = "Слева"
+STYLE_CENTER = "По центру"
+
+class ResultSink:
+    """Таблица результатов по колонкам: значения хранятся списками, без объектов ячеек openpyxl"""
+
+    def __init__(self, headers):
+        self.headers = list(headers)
+        self.columns = [[] for _ in self.headers]
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def _fit(self, row):
+        row = list(row)[:len(self.headers)]
+        return row + [None] * (len(self.headers) - len(row))
+
+    def append(self, row):
+        for column, value in zip(self.columns, self._fit(row)):
+            column.append(value)
+
+    def set_row(self, index, row):
+        for column, value in zip(self.columns, self._fit(row)):
+            column[index] = value
+
+    def set(self, index, column, value):
+        """column - номер колонки с 1, как в Excel"""
+        self.columns[column - 1][index] = value
+
+    def get(self, index, column):
+        return self.columns[column - 1][index]
+
+    def row(self, index):
+        return [column[index] for column in self.columns]
+
+    def rows(self):
+        return (list(row) for row in zip(*self.columns))
+
+def new_xlsx_workbook():
+    """Книга write_only с общими именованными стилями"""
+    from openpyxl.styles import NamedStyle, Font, Alignment
+
+    wb = Workbook(write_only=True)
+    wb.add_named_style(NamedStyle(
+        STYLE_HEADER, font=Font(bold=True), alignment=Alignment(horizontal='center', vertical='center')
+    ))
+    wb.add_named_style(NamedStyle(STYLE_BOLD, font=Font(bold=True)))
+    wb.add_named_style(NamedStyle(STYLE_LEFT, alignment=Alignment(horizontal='left', vertical='center')))
+    wb.add_named_style(NamedStyle(STYLE_CENTER, alignment=Alignment(horizontal='center', vertical='center')))
+    return wb
+
+def styled_row(ws, values, styles):
+    """Строка для write_only листа: styles - стиль для всех ячеек или список стилей по колонкам"""
+    from openpyxl.cell import WriteOnlyCell
+
+    if styles is None:
+        return list(values)
+    if isinstance(styles, str):
+        styles = [styles] * len(values)
+    row = []
+    for value, style in zip(values, styles):
+        cell = WriteOnlyCell(ws, value)
+        if style:
+            cell.style = style
+        row.append(cell)
+    return row
+
+def write_sheet(wb, title, header_rows, rows, widths=None, header_style=None, row_styles=None, merged=()):
+    """Записывает лист за один проход: ширины колонок, заголовки, строки и объединенные ячейки"""
+    ws = wb.create_sheet(title)
+    for col_letter, width in (widths or {}).items():
+        ws.column_dimensions[col_letter].width = width
+    for header in header_rows:
+        ws.append(styled_row(ws, header, header_style))
+    for row in rows:
+        ws.append(styled_row(ws, row, row_styles))
+    for cell_range in merged:
+        ws.merged_cells.add(cell_range)
+    return ws
+
+def write_diff_sheet(wb, diff):
+    """Добавляет лист со списком изменившихся значений (diff - результат history_report)"""
+    previous_date, price_date, changes = diff
+    write_sheet(
+        wb, DIFF_SHEET_TITLE,
+        [["Код региона", "Название региона", "Показатель", f"Было ({previous_date})", f"Стало ({price_date})"]],
+        ([int(code) if code.isdigit() else code, name, field, old_value, new_value]
+         for code, name, field, old_value, new_value in changes),
+        widths={'A': 12, 'B': 25, 'C': 30, 'D': 16, 'E': 16},
+        header_style=STYLE_BOLD
+    )
 
-            progress = int((i + 1) / total * 100)
-            await bot.edit_message_text(
-                chat_id=callback_query.from_user.id,
-                message_id=progress_message.message_id,
-                text=f"СБИС: {progress}% ({i+1}/{total})"
+# ========== ХРАНИЛИЩЕ ФАЙЛОВ И КЭШ РАЗБОРА ==========
+# Скачанные прайс-листы хранятся по SHA-256 содержимого, а результат разбора кэшируется под
+# тем же хэшем и версией разборщика. Неизменившийся файл не конвертируется и не разбирается
+# повторно. Старые и лишние файлы удаляются по сроку и общему размеру хранилища
+
+# Версия правил разбора: при изменении функций извлечения цен ее нужно увеличить,
+# тогда результаты, сохраненные прежними правилами, перестанут использоваться
+PARSER_VERSION = 2
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def store_file(path, content_hash=None):
+    """
+    Переносит файл в хранилище по хэшу содержимого (одинаковые файлы хранятся один раз), возвращает новый путь.
+    content_hash - sha256, уже посчитанный при скачивании (иначе файл читается еще раз)
+    """
+    content_hash = content_hash or file_sha256(path)
+    stored_path = os.path.join(FILE_STORE_DIR, content_hash[:2], content_hash + os.path.splitext(path)[1].lower())
+    if os.path.abspath(path) != stored_path:
+        os.makedirs(os.path.dirname(stored_path), exist_ok=True)
+        if os.path.exists(stored_path):
+            os.remove(path)
+        else:
+            shutil.move(path, stored_path)
+
+    with closing(db_connect()) as connection, connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO file_store (content_hash, path, size, last_used) VALUES (?, ?, ?, ?)",
+            (content_hash, stored_path, os.path.getsize(stored_path), now_str())
+        )
+    return stored_path
+
+def is_parse_cached(parser, path):
+    """Есть ли в кэше результат разбора этого содержимого текущей версией разборщика"""
+    with closing(db_connect()) as connection:
+        row = connection.execute(
+            "SELECT 1 FROM parsed_cache WHERE content_hash = ? AND parser = ? AND parser_version = ?",
+            (file_sha256(path), parser, PARSER_VERSION)
+        ).fetchone()
+    return row is not None
+
+def parse_result_useful(result):
+    """Пустой результат (ничего не извлечено) не кэшируем: причина может быть временной"""
+    if isinstance(result, dict):
+        return bool(result)
+    if isinstance(result, (list, tuple)):
+        return any(value != "❌" for value in result)
+    return result is not None
+
+def parse_cache_get(parser, content_hash, path):
+    """Сохраненный результат разбора или None"""
+    with closing(db_connect()) as connection:
+        row = connection.execute(
+            "SELECT result FROM parsed_cache WHERE content_hash = ? AND parser = ? AND parser_version = ?",
+            (content_hash, parser, PARSER_VERSION)
+        ).fetchone()
+    if row is None:
+        return None
+    logging.info(f"Кэш разбора: {parser} для {os.path.basename(path)} - файл не изменился, разбор пропущен")
+    return json.loads(row[0])
+
+def parse_cache_put(parser, content_hash, result):
+    if parse_result_useful(result):
+        with closing(db_connect()) as connection, connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO parsed_cache (content_hash, parser, parser_version, result, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (content_hash, parser, PARSER_VERSION, json.dumps(result, ensure_ascii=False), now_str())
             )
 
-            try:
-                region_url = f"https://saby.ru/tariffs?tab=ereport&region={region_code}"
-                driver.get(region_url)
-                WebDriverWait(driver, 15).until(
-                    EC.presence_of_element_located((By.TAG_NAME, "body"))
-                )
-                time.sleep(3)
-
-                driver.execute_script("window.scrollTo(0, 2500);")
-                time.sleep(2)
-
-                # ПАРСИНГ ДАННЫХ РЕГИОНА
-                html = driver.page_source
-                soup = BeautifulSoup(html, "html.parser")
-
-                # ОСНОВНЫЕ ТАРИФЫ
-                price_spans = soup.find_all("span", class_="billing-PriceList__priceButton")
-                prices = [span.text.strip().replace(" ", "") for span in price_spans]
-                filtered_prices = prices[:8] if len(prices) >= 8 else []
-
-                # НУЛЕВКА
-                null_span = soup.find("span", {"data-qa": "EOpNull"})
-                null_price_raw = null_span.text.strip().replace(" ", "") if null_span else None
-                null_price = safe_int(null_price_raw)
-
-                # КОРПОРАТИВНЫЙ ТАРИФ
-                corporate_prices = []
-                if len(prices) >= 13:
-                    corporate_prices = [
-                        safe_int(prices[9]),
-                        safe_int(prices[10]),
-                        safe_int(prices[11]),
-                        safe_int(prices[12])
-                    ]
-
-                buhta_price = None
-                auth_buh_connect_price = None
-                auth_buh_quarter_price = None
-                auth_buh_1_199 = None
-                auth_buh_200_999 = None
-                auth_buh_1000_plus = None
-
-                # ШАГ 1: Раскрываем Бухта/УПБ и извлекаем цену Бухты
-                try:
-                    buhta_elements = driver.find_elements(By.XPATH, "//*[contains(text(), 'Buhta') or contains(text(), 'УПБ')]")
-                    for element in buhta_elements:
-                        try:
-                            container = element.find_element(By.XPATH, "./ancestor::div[1]")
-                            container_text = container.text
-
-                            matches = re.findall(r'(\d{1,3}\s?\d{3,4})', container_text)
-                            for match in matches:
-                                price_clean = match.replace(' ', '')
-                                if price_clean.isdigit() and 5000 <= int(price_clean) <= 20000:
-                                    buhta_price = int(price_clean)
-                                    driver.execute_script("arguments[0].click();", element)
-                                    time.sleep(2)
-                                    break
-                        except:
-                            continue
-                except:
-                    pass
-
-                # ШАГ 2: Уполномоченная бухгалтерия
-                try:
-                    auth_elements = driver.find_elements(By.XPATH, "//*[contains(text(), 'Уполномоченная бухгалтерия')]")
+def cached_parse(parser, func, path):
+    """Результат func(path) из кэша по хэшу содержимого, иначе - разбор и сохранение в кэш"""
+    content_hash = file_sha256(path)
+    result = parse_cache_get(parser, content_hash, path)
+    if result is None:
+        result = func(path)
+        parse_cache_put(parser, content_hash, result)
+    return result
+
+def evict_file_store(max_size_mb=CACHE_MAX_SIZE_MB, max_age_days=CACHE_MAX_AGE_DAYS):
+    """Удаляет файлы, не использовавшиеся дольше срока, и самые старые - пока хранилище больше лимита"""
+    cutoff = (datetime.datetime.now() - datetime.timedelta(days=max_age_days)).strftime('%Y-%m-%d %H:%M:%S')
+    max_bytes = max_size_mb * 1024 * 1024
+    try:
+        with closing(db_connect()) as connection, connection:
+            rows = connection.execute(
+                "SELECT content_hash, path, size, last_used FROM file_store ORDER BY last_used"
+            ).fetchall()
+            total = sum(row[2] for row in rows)
+            removed = 0
+            for content_hash, path, size, last_used in rows:
+                if last_used >= cutoff and total <= max_bytes:
+                    break
+                # Вместе с .doc удаляем и сделанный из него .docx
+                for candidate in (path, str(Path(path).with_suffix(".docx"))):
+                    if os.path.exists(candidate):
+                        os.remove(candidate)
+                connection.execute("DELETE FROM file_store WHERE content_hash = ?", (content_hash,))
+                total -= size
+                removed += 1
+
+            connection.execute(
+                "DELETE FROM parsed_cache WHERE parser_version != ? OR created_at < ?", (PARSER_VERSION, cutoff)
+            )
+        logging.info(f"Хранилище файлов: удалено {removed}, осталось {total / 1024 / 1024:.1f} МБ")
+    except Exception as e:
+        logging.error(f"Хранилище файлов: ошибка очистки: {str(e)}")
+
+# ========== ДВИЖОК ПАРСИНГА СБИС ==========
+SBIS_URL = DATA.get('urls', {}).get('sbis_url', "https://saby.ru/tariffs?tab=ereport")
+
+# Тарифные поля региона СБИС (без кода и названия)
+SBIS_FIELDS = [
+    "Легкий_ИП", "Легкий_Бюджет", "Легкий_УСН", "Легкий_ОСНО",
+    "Базовый_ИП", "Базовый_Бюджет", "Базовый_УСН", "Базовый_ОСНО",
+    "Нулевка или ИП без сотрудников", "ОБ (Buhta) и УПБ",
+    "стоимость лицензии", "за квартал (минимум)", "1-199", "200-999", ">1000",
+    "5", "10", "25", "50"
+]
+
+# Скрипт, который за один вызов execute_async_script прокручивает страницу, раскрывает
+# Бухту/УПБ и "Уполномоченную бухгалтерию" и возвращает все нужные для региона значения.
+# Текст страницы собирается так же, как BeautifulSoup.get_text() (без script/style)
+SBIS_EXTRACT_JS = r'''
+var done = arguments[arguments.length - 1];
+var timings = {};
+
+function sleep(ms) {
+    return new Promise(function (resolve) { setTimeout(resolve, ms); });
+}
+
+function signature() {
+    return document.getElementsByTagName('*').length + ':' + document.body.innerText.length;
+}
+
+async function quiet(name, quietMs, limitMs) {
+    var start = performance.now(), last = signature(), since = start;
+    while (performance.now() - start < limitMs) {
+        await sleep(100);
+        var current = signature();
+        if (current !== last) {
+            last = current;
+            since = performance.now();
+        } else if (performance.now() - since >= quietMs) {
+            timings[name] = [performance.now() - start, limitMs, true];
+            return;
+        }
+    }
+    timings[name] = [performance.now() - start, limitMs, false];
+}
+
+async function until(name, check, limitMs) {
+    var start = performance.now();
+    while (performance.now() - start < limitMs) {
+        if (check()) {
+            timings[name] = [performance.now() - start, limitMs, true];
+            return;
+        }
+        await sleep(100);
+    }
+    timings[name] = [performance.now() - start, limitMs, false];
+}
+
+function byText(condition) {
+    var snapshot = document.evaluate('//*[' + condition + ']', document, null,
+                                     XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    var elements = [];
+    for (var i = 0; i < snapshot.snapshotLength; i++) {
+        elements.push(snapshot.snapshotItem(i));
+    }
+    return elements;
+}
 
-                    for auth_element in auth_elements:
-                        try:
-                            driver.execute_script("arguments[0].click();", auth_element)
-                            time.sleep(3)
-
-                            # Получаем полный текст страницы
-                            page_source = driver.page_source
-                            soup = BeautifulSoup(page_source, "html.parser")
-                            full_text = soup.get_text()
-
-                            # Парсим стоимость лицензии (подключение)
-                            connect_match = re.search(r'Подключение[^\d]*(\d[\d\s]*)', full_text, re.IGNORECASE)
-                            if connect_match:
-                                connect_price_str = connect_match.group(1).replace(' ', '')
-                                if connect_price_str.isdigit():
-                                    auth_buh_connect_price = int(connect_price_str)
-
-                            # Парсим за квартал (минимум)
-                            quarter_match = re.search(r'(?:квартал|Квартал)[^\d]*(\d[\d\s]*)', full_text, re.IGNORECASE)
-                            if not quarter_match:
-                                quarter_match = re.search(r'от\s*(\d[\d\s]*)\s*[₽руб]*\s*за\s*квартал', full_text, re.IGNORECASE)
-                            if quarter_match:
-                                quarter_price_str = quarter_match.group(1).replace(' ', '')
-                                if quarter_price_str.isdigit():
-                                    auth_buh_quarter_price = int(quarter_price_str)
-
-                            # ПАРСИНГ ЦЕН ОТЧЕТОВ
-                            auth_index = full_text.find("Уполномоченная бухгалтерия")
-                            if auth_index != -1:
-                                auth_section = full_text[auth_index:]
-
-                                # 1-199 (берем первые 2 цифры)
-                                range_1_match = re.search(r'1[–-]199[^\d]*(\d{2,3})', auth_section)
-                                if range_1_match:
-                                    price_str = range_1_match.group(1)
-                                    if len(price_str) >= 2:
-                                        auth_buh_1_199 = int(price_str[:2])
-
-                                # 200-999
-                                range_2_match = re.search(r'200[–-]999[^\d]*(\d{2,3})', auth_section)
-                                if range_2_match:
-                                    auth_buh_200_999 = int(range_2_match.group(1))
-
-                                # >1000
-                                range_3_match = re.search(r'≥1\s*000\s*(\d{2,3})', auth_section)
-                                if not range_3_match:
-                                    range_3_match = re.search(r'≥1000\s*(\d{2,3})', auth_section)
-                                if not range_3_match:
-                                    range_3_match = re.search(r'>1\s*000\s*(\d{2,3})', auth_section)
-                                if not range_3_match:
-                                    range_3_match = re.search(r'>1000\s*(\d{2,3})', auth_section)
-                                if range_3_match:
-                                    auth_buh_1000_plus = int(range_3_match.group(1))
+function parentDiv(element) {
+    var parent = element.parentElement;
+    while (parent && parent.tagName !== 'DIV') {
+        parent = parent.parentElement;
+    }
+    return parent;
+}
+
+function hasBuhtaPrice(text) {
+    var matches = text.match(/\d{1,3}\s?\d{3,4}/g) || [];
+    return matches.some(function (m) {
+        var value = parseInt(m.replace(' ', ''), 10);
+        return /^\d+$/.test(m.replace(' ', '')) && value >= 5000 && value <= 20000;
+    });
+}
+
+function pageText() {
+    var walker = document.createTreeWalker(document.documentElement, NodeFilter.SHOW_TEXT, {
+        acceptNode: function (node) {
+            var tag = node.parentNode ? node.parentNode.nodeName : '';
+            return (tag === 'SCRIPT' || tag === 'STYLE' || tag === 'TEMPLATE')
+                ? NodeFilter.FILTER_REJECT : NodeFilter.FILTER_ACCEPT;
+        }
+    });
+    var parts = [];
+    while (walker.nextNode()) {
+        parts.push(walker.currentNode.nodeValue);
+    }
+    return parts.join('');
+}
+
+(async function () {
+    try {
+        window.scrollTo(0, 2500);
+        await quiet('sbis.scroll', 300, 2000);
+
+        var nullSpan = document.querySelector('span[data-qa="EOpNull"]');
+        var result = {
+            prices: Array.from(document.querySelectorAll('span.billing-PriceList__priceButton'))
+                .map(function (span) { return span.textContent; }),
+            null_price: nullSpan ? nullSpan.textContent : null,
+            buhta: [],
+            auth_found: false,
+            text: '',
+            timings: timings
+        };
+
+        // ШАГ 1: Бухта/УПБ
+        var buhtaElements = byText("contains(text(), 'Buhta') or contains(text(), 'УПБ')");
+        for (var i = 0; i < buhtaElements.length; i++) {
+            var container = parentDiv(buhtaElements[i]);
+            if (!container) continue;
+            var containerText = container.innerText;
+            result.buhta.push(containerText);
+            if (hasBuhtaPrice(containerText)) {
+                buhtaElements[i].click();
+                await quiet('sbis.buhta', 300, 2000);
+            }
+        }
 
-                            break
+        // ШАГ 2: Уполномоченная бухгалтерия
+        var authElements = byText("contains(text(), 'Уполномоченная бухгалтерия')");
+        for (var j = 0; j < authElements.length; j++) {
+            try {
+                authElements[j].click();
+                await until('sbis.auth_buh', function () {
+                    var t = document.body.innerText;
+                    var k = t.indexOf('Уполномоченная бухгалтерия');
+                    return k !== -1 && /199/.test(t.slice(k));
+                }, 3000);
+                result.auth_found = true;
+                break;
+            } catch (e) {}
+        }
 
-                        except:
-                            continue
+        result.text = pageText();
+        done(result);
+    } catch (e) {
+        done({prices: [], null_price: null, buhta: [], auth_found: false, text: '',
+              timings: timings, error: String(e)});
+    }
+})();
+'''
+
+def safe_int(val):
+    if val and str(val).isdigit():
+        return int(val)
+    return None
+
+def scrape_sbis_region(session, region_code, region_name):
+    """
+    Парсит тарифы одного региона СБИС в уже открытом браузере.
+    Все раскрытия блоков и сбор значений выполняет один скрипт внутри страницы
+    """
+
+    driver = session.driver
+    region_url = f"{SBIS_URL}&region={region_code}"
+    session.get(region_url)
+    WebDriverWait(driver, 15).until(
+        EC.presence_of_element_located((By.TAG_NAME, "body"))
+    )
+    wait_for("sbis.prices", lambda: sbis_prices_ready(driver), 3)
 
-                except:
-                    pass
+    # ПАРСИНГ ДАННЫХ РЕГИОНА (одним обращением к браузеру)
+    extracted = driver.execute_async_script(SBIS_EXTRACT_JS)
+    if extracted.get("error"):
+        logging.error(f"СБИС: ошибка скрипта извлечения для региона {region_code}: {extracted['error']}")
+    for name, (elapsed_ms, limit_ms, ok) in extracted["timings"].items():
+        record_wait(name, elapsed_ms / 1000, limit_ms / 1000, ok)
 
-                # СОБИРАЕМ ДАННЫЕ РЕГИОНА
-                region_data = {
-                    "Код региона": int(region_code),
-                    "Название региона": region_name,
-                    "Легкий_ИП": safe_int(filtered_prices[0]) if filtered_prices else None,
-                    "Легкий_Бюджет": safe_int(filtered_prices[1]) if filtered_prices else None,
-                    "Легкий_УСН": safe_int(filtered_prices[2]) if filtered_prices else None,
-                    "Легкий_ОСНО": safe_int(filtered_prices[3]) if filtered_prices else None,
-                    "Базовый_ИП": safe_int(filtered_prices[4]) if len(filtered_prices) > 4 else None,
-                    "Базовый_Бюджет": safe_int(filtered_prices[5]) if len(filtered_prices) > 5 else None,
-                    "Базовый_УСН": safe_int(filtered_prices[6]) if len(filtered_prices) > 6 else None,
-                    "Базовый_ОСНО": safe_int(filtered_prices[7]) if len(filtered_prices) > 7 else None,
-                    "Нулевка или ИП без сотрудников": null_price,
-                    "ОБ (Buhta) и УПБ": buhta_price,
-                    "стоимость лицензии": auth_buh_connect_price,
-                    "за квартал (минимум)": auth_buh_quarter_price,
-                    "1-199": auth_buh_1_199,
-                    "200-999": auth_buh_200_999,
-                    ">1000": auth_buh_1000_plus,
-                    "5": corporate_prices[0] if corporate_prices else None,
-                    "10": corporate_prices[1] if len(corporate_prices) > 1 else None,
-                    "25": corporate_prices[2] if len(corporate_prices) > 2 else None,
-                    "50": corporate_prices[3] if len(corporate_prices) > 3 else None,
-                }
+    filtered_prices, null_price, corporate_prices = parse_sbis_prices(extracted["prices"], extracted["null_price"])
+
+    # Бухта/УПБ: берем последнее подходящее значение, как и раньше
+    buhta_price = None
+    for container_text in extracted["buhta"]:
+        price = parse_sbis_buhta_text(container_text)
+        if price is not None:
+            buhta_price = price
 
-                all_data.append(region_data)
+    report_network_usage(driver, f"СБИС, регион {region_code}")
+
+    # Уполномоченная бухгалтерия
+    if extracted["auth_found"]:
+        auth = parse_sbis_auth_buh_text(extracted["text"])
+    else:
+        auth = parse_sbis_auth_buh_text("")
+
+    # СОБИРАЕМ ДАННЫЕ РЕГИОНА
+    return build_sbis_region_data(region_code, region_name, filtered_prices, null_price, corporate_prices, buhta_price, auth)
+
+def parse_sbis_html(region_code, region_name, html):
+    """Разбирает серверную разметку страницы тарифов СБИС без браузера"""
+    soup = BeautifulSoup(html, "html.parser")
+    filtered_prices, null_price, corporate_prices = parse_sbis_price_list(soup)
+
+    # Бухта/УПБ: тот же поиск, что и в браузере - ближайший родительский div у текста
+    buhta_price = None
+    for node in soup.find_all(string=re.compile('Buhta|УПБ')):
+        container = node.parent.find_parent("div") if node.parent else None
+        if container is not None:
+            price = parse_sbis_buhta_text(container.get_text(" "))
+            if price is not None:
+                buhta_price = price
+
+    auth = parse_sbis_auth_buh_text(soup.get_text())
+    return build_sbis_region_data(region_code, region_name, filtered_prices, null_price, corporate_prices, buhta_price, auth)
+
+async def fetch_sbis_regions_http(regions, progress, is_cancelled, on_result):
+    """
+    Быстрый режим СБИС: забирает страницы тарифов общим пулом HTTP-соединений без браузера.
+    Возвращает {индекс региона: данные} только для регионов, прошедших проверку полноты
+    """
+    results = {}
+    connector = aiohttp.TCPConnector(limit=SBIS_HTTP_CONNECTIONS)
+    timeout = aiohttp.ClientTimeout(total=30)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                     headers={"User-Agent": BROWSER_USER_AGENT}) as session:
+        async def fetch(index, region_code, region_name):
+            if is_cancelled():
+                return
+            try:
+                async with session.get(f"{SBIS_URL}&region={region_code}") as response:
+                    response.raise_for_status()
+                    html = await response.text()
+
+                region_data = await run_in_engine(parse_sbis_html, region_code, region_name, html)
+                if sbis_region_complete(region_data):
+                    results[index] = region_data
+                    await run_in_engine(on_result, region_code, region_data)
+                    progress.advance("http")
+                else:
+                    logging.info(f"СБИС: регион {region_code} без браузера получен не полностью, будет открыт в браузере")
+            except Exception as e:
+                logging.info(f"СБИС: регион {region_code} без браузера не получен: {str(e)}")
+
+        await asyncio.gather(*(fetch(index, code, name) for index, (code, name) in enumerate(regions)))
+
+    logging.info(f"СБИС: без браузера получено {len(results)} из {len(regions)} регионов")
+    return results
+
+def run_sbis_pool(regions, workers, progress, is_cancelled, on_result):
+    """
+    Обходит регионы СБИС пулом из нескольких браузеров.
+    Воркеры разбирают общую очередь регионов, результат возвращается в порядке конфига
+    (None на месте регионов, до которых не дошли из-за отмены)
+    """
+    work = queue.Queue()
+    for item in enumerate(regions):
+        work.put(item)
+    results = [None] * len(regions)
+
+    def worker(worker_id):
+        while not is_cancelled():
+            try:
+                index, (region_code, region_name) = work.get_nowait()
+            except queue.Empty:
+                break
 
+            try:
+                with BROWSER_POOL.session("sbis") as session:
+                    results[index] = scrape_sbis_region(session, region_code, region_name)
             except Exception as e:
-                all_data.append({
+                logging.error(f"СБИС: воркер {worker_id}, регион {region_code}: {str(e)}")
+                results[index] = {
                     "Код региона": int(region_code),
                     "Название региона": region_name,
                     "Ошибка": f"Ошибка: {str(e)}",
-                })
+                }
+            on_result(region_code, results[index])
+            progress.advance()
 
-    except Exception as e:
-        pass
+    worker = with_current_job(worker)
+    threads = [
+        threading.Thread(target=worker, args=(n,), name=f"sbis-worker-{n}", daemon=True)
+        for n in range(max(1, min(workers, len(regions))))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
 
-    # СОЗДАЕМ EXCEL ФАЙЛ С ФОРМАТИРОВАНИЕМ
-    try:
-        from openpyxl.styles import Font, Alignment
-        from openpyxl.utils import get_column_letter
+    log_wait_stats("sbis.")
 
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Цены"
+    return results
 
-        bold_font = Font(bold=True)
-        center_alignment = Alignment(horizontal='center', vertical='center')
+def save_sbis_xlsx(all_data, file_name, diff=None):
+    """Сохраняет данные СБИС в Excel файл с форматированием (и листом изменений, если он есть)"""
+    try:
+        wb = new_xlsx_workbook()
 
         # Заголовки
         headers_row1 = [
@@ -411,7 +2292,6 @@ async def parse_sbis(callback_query: CallbackQuery):
             "", "", "Уполномоченная бухгалтерия", "", "", "", "",
             "Корпоративный тариф", "", "", ""
         ]
-        ws.append(headers_row1)
 
         headers_row2 = [
             "Код региона", "Название региона", "Тариф", "ИП", "Бюджет", "УСН", "ОСНО",
@@ -420,9 +2300,9 @@ async def parse_sbis(callback_query: CallbackQuery):
             "стоимость лицензии", "за квартал (минимум)", "1-199", "200-999", ">1000",
             "5", "10", "25", "50"
         ]
-        ws.append(headers_row2)
 
         # Данные
+        rows = []
         for region in all_data:
             if "Ошибка" in region:
                 continue
@@ -451,37 +2331,7 @@ async def parse_sbis(callback_query: CallbackQuery):
                 region["25"],
                 region["50"]
             ]
-            ws.append(row_data)
-
-        # Форматирование
-        ws.merge_cells('D1:G1')
-        ws['D1'].alignment = center_alignment
-        ws['D1'].font = bold_font
-
-        ws.merge_cells('H1:K1')
-        ws['H1'].alignment = center_alignment
-        ws['H1'].font = bold_font
-
-        ws.merge_cells('M1:R1')
-        ws['M1'].alignment = center_alignment
-        ws['M1'].font = bold_font
-
-        ws.merge_cells('S1:V1')
-        ws['S1'].alignment = center_alignment
-        ws['S1'].font = bold_font
-
-        for col in range(1, 23):
-            cell = ws.cell(row=2, column=col)
-            cell.font = bold_font
-            cell.alignment = center_alignment
-
-        for row in range(3, len(all_data) + 3):
-            for col in range(1, 23):
-                cell = ws.cell(row=row, column=col)
-                if col in [1, 2]:
-                    cell.alignment = Alignment(horizontal='left', vertical='center')
-                else:
-                    cell.alignment = Alignment(horizontal='center', vertical='center')
+            rows.append(row_data)
 
         column_widths = {
             'A': 12, 'B': 20, 'C': 8, 'D': 8, 'E': 10, 'F': 8, 'G': 8,
@@ -489,1177 +2339,2106 @@ async def parse_sbis(callback_query: CallbackQuery):
             'O': 12, 'P': 8, 'Q': 8, 'R': 8, 'S': 8, 'T': 8, 'U': 8, 'V': 8
         }
 
-        for col_letter, width in column_widths.items():
-            ws.column_dimensions[col_letter].width = width
+        # Заголовки жирные по центру, код и название региона - слева, цены - по центру
+        write_sheet(
+            wb, "Цены", [headers_row1, headers_row2], rows,
+            widths=column_widths,
+            header_style=STYLE_HEADER,
+            row_styles=[STYLE_LEFT, STYLE_LEFT] + [STYLE_CENTER] * 20,
+            merged=['D1:G1', 'H1:K1', 'M1:R1', 'S1:V1']
+        )
+        if diff is not None:
+            write_diff_sheet(wb, diff)
 
-        wb.save(FILE_NAME_SBIS)
+        wb.save(file_name)
 
-    except Exception as e:
+    except Exception:
         try:
             df = pd.DataFrame(all_data)
-            df.to_excel(FILE_NAME_SBIS, index=False)
-        except Exception as e2:
+            df.to_excel(file_name, index=False)
+        except Exception:
             pass
 
-    driver.quit()
+async def parse_sbis(callback_query: CallbackQuery, job, resume_run_id=None):
+    progress_message = await bot.send_message(callback_query.from_user.id, "СБИС: 0%")
+    job.progress_messages[callback_query.from_user.id] = progress_message.message_id
+    job.progress_text = progress_message.text
 
-    await bot.edit_message_text(
-        chat_id=callback_query.from_user.id,
-        message_id=progress_message.message_id,
-        text="✅ СБИС: Готово. Данные сохранены в saby_tariffs_filtered.xlsx"
-    )
+    # Загружаем регионы из конфига
+    regions_to_process = DATA.get('regions_sbis', [])
+    # Преобразуем в кортежи если нужно
+    regions_to_process = [tuple(r) for r in regions_to_process]
 
-    logging.info(f"ОТЛАДКА: cancel_flag = {cancel_flag}")
-    if os.path.exists(FILE_NAME_SBIS):
-        logging.info(f"Файл {FILE_NAME_SBIS} создан, отправляем в чат")
-        if cancel_flag:
-            comment = "⚠️ Парсинг СБИС был отменен. Файл содержит неполные данные"
-            logging.info("Парсинг был отменен, отправляем неполный файл")
-        else:
-            comment = "✅ Парсинг СБИС завершен успешно"
-            logging.info("Парсинг завершен успешно")
+    if not regions_to_process:
+        logging.error("В конфиге отсутствует список регионов для СБИС!")
+        await callback_query.message.answer("❌ Ошибка: список регионов не найден в конфиге")
+        return
 
-        await send_file_into_chat(TELEGRAM_CHAT_ID, FILE_NAME_SBIS, comment)
-        logging.info("Файл СБИС успешно отправлен в чат")
+    logging.info(f"Загружено {len(regions_to_process)} регионов для СБИС из конфига")
+    logging.info(f"СБИС: запускаем {SBIS_WORKERS} браузер(ов)")
 
-async def parse_kontur(callback_query: CallbackQuery):
-    global cancel_flag
+    total = len(regions_to_process)
+    progress = EngineProgress(total)
+    all_data = []
 
-    # === Настройки ===
-    BASE_URL = "https://www.kontur-extern.ru/price-download/77"
-    DOWNLOAD_DIR = os.path.abspath("downloads")
+    # Дата запуска одна для журнала и имени файла: бот работает сутками
+    run_date = run_date_str()
+    file_name = result_file_name("sbis", run_date)
 
-    # === Список регионов ===
-    # Загружаем регионы из конфига
-    regions = DATA.get('regions_kontur', [])
-    # Преобразуем в кортежи если нужно
-    regions = [tuple(r) for r in regions]
-
-    if not regions:
-        logging.error("В конфиге отсутствует список регионов для Контур!")
-        await callback_query.message.answer("❌ Ошибка: список регионов не найден в конфиге")
-        return
-
-    logging.info(f"Загружено {len(regions)} регионов для Контур из конфига")
-
-    total_regions = len(regions)
-    message = await callback_query.message.answer("🔄 Парсинг Контур начат...")
-
-    # === Подготовка ===
-    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
-
-    # === УЛУЧШЕННАЯ НАСТРОЙКА SELENIUM ДЛЯ HEADLESS ===
-    options = webdriver.ChromeOptions()
-
-    # Headless режим с улучшенными настройками
-    options.add_argument('--headless=new')
-    options.add_argument('--no-sandbox')
-    options.add_argument('--disable-dev-shm-usage')
-    options.add_argument('--disable-gpu')
-    options.add_argument('--window-size=1920,1080')
-
-    # Настройки для обхода защиты и улучшения совместимости
-    options.add_argument('--disable-blink-features=AutomationControlled')
-    options.add_experimental_option("excludeSwitches", ["enable-automation", "enable-logging"])
-    options.add_experimental_option('useAutomationExtension', False)
-
-    # Улучшенный User-Agent
-    options.add_argument('--user-agent=Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36')
+    # Журнал запуска: при продолжении пропускаем регионы, уже успешно записанные ранее
+    if resume_run_id is None:
+        run_id = await run_in_engine(journal_start_run, "sbis", run_date)
+        journaled = {}
+    else:
+        run_id = resume_run_id
+        await run_in_engine(journal_reopen_run, run_id)
+        journaled = await run_in_engine(journal_load_regions, run_id)
 
-    # Настройки загрузки файлов
-    profile = {
-        "download.default_directory": DOWNLOAD_DIR,
-        "download.prompt_for_download": False,
-        "download.directory_upgrade": True,
-        "plugins.always_open_pdf_externally": True,
-        "safebrowsing.enabled": True,
-        "profile.default_content_settings.popups": 0
-    }
-    options.add_experimental_option("prefs", profile)
+    done_codes = set(journal_ok_regions(journaled))
+    to_scrape = [region for region in regions_to_process if str(region[0]) not in done_codes]
+    progress.restore(total - len(to_scrape))
+    if resume_run_id is not None:
+        logging.info(f"СБИС: продолжение запуска {run_id}, осталось {len(to_scrape)} из {total} регионов")
 
-    # Дополнительные опции для стабильности
-    options.add_argument('--disable-features=VizDisplayCompositor')
-    options.add_argument('--disable-software-rasterizer')
-    options.add_argument('--disable-extensions')
-    options.add_argument('--disable-plugins')
-    options.add_argument('--disable-background-timer-throttling')
-    options.add_argument('--disable-backgrounding-occluded-windows')
-    options.add_argument('--disable-renderer-backgrounding')
+    def on_result(region_code, region_data):
+        journal_record_region(run_id, region_code, sbis_region_status(region_data), region_data)
 
-    driver = webdriver.Chrome(options=options)
+    reporter = ProgressReporter(job, "СБИС", progress).start()
+    try:
+        # Быстрый режим: сначала пробуем получить регионы без браузера
+        fast_results = {}
+        if SBIS_FETCH_MODE == "http":
+            progress.begin("http")
+            fast_results = await fetch_sbis_regions_http(to_scrape, progress, job.token, on_result)
+
+        # Остальные регионы (или все в режиме browser) обходим пулом браузеров
+        pending = [region for index, region in enumerate(to_scrape) if index not in fast_results]
+        pool_results = []
+        if pending and not job.cancelled:
+            progress.begin()
+            pool_results = await run_in_engine(
+                job.token.bind(run_sbis_pool), pending, SBIS_WORKERS, progress, job.token, on_result
+            )
 
-    # Улучшенное скрытие WebDriver
-    driver.execute_cdp_cmd('Network.setUserAgentOverride', {
-        "userAgent": 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-    })
-    driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {
-        'source': '''
-            Object.defineProperty(navigator, 'webdriver', {
-                get: () => undefined
-            });
-            Object.defineProperty(navigator, 'plugins', {
-                get: () => [1, 2, 3, 4, 5]
-            });
-            Object.defineProperty(navigator, 'languages', {
-                get: () => ['ru-RU', 'ru', 'en-US', 'en']
-            });
-        '''
-    })
+        fresh = {}
+        pool_iter = iter(pool_results)
+        for index, (region_code, region_name) in enumerate(to_scrape):
+            region = fast_results[index] if index in fast_results else next(pool_iter, None)
+            if region is not None:
+                fresh[region_code] = region
+
+        # Собираем данные в порядке конфига: новые результаты, иначе - из журнала
+        for region_code, region_name in regions_to_process:
+            if region_code in fresh:
+                all_data.append(fresh[region_code])
+            elif str(region_code) in journaled:
+                all_data.append(journaled[str(region_code)][1])
+    except Exception as e:
+        logging.error(f"Ошибка в parse_sbis: {str(e)}", exc_info=True)
+    finally:
+        await reporter.stop()
 
-    wait = WebDriverWait(driver, 30)
+    await run_in_engine(journal_finish_run, run_id, [code for code, name in regions_to_process], job.cancelled)
 
-    # === НОВЫЕ ФУНКЦИИ ДЛЯ ИЗВЛЕЧЕНИЯ ДАННЫХ ИЗ НОВОЙ СТРУКТУРЫ ДОКУМЕНТА ===
+    # Сохраняем значения в историю, изменения попадут на отдельный лист
+    history_rows = [
+        (region["Код региона"], region["Название региона"], {field: region.get(field) for field in SBIS_FIELDS})
+        for region in all_data if "Ошибка" not in region
+    ]
+    diff_summary, diff = await run_in_engine(history_report, "sbis", history_rows)
 
-    def convert_doc_to_docx(doc_path):
-        """Конвертирует .doc в .docx используя LibreOffice"""
-        try:
-            docx_path = doc_path + 'x'
+    # СОЗДАЕМ EXCEL ФАЙЛ С ФОРМАТИРОВАНИЕМ
+    await run_in_engine(save_sbis_xlsx, all_data, file_name, diff)
 
-            try:
-                subprocess.run(['libreoffice', '--version'], capture_output=True, check=True)
-                libreoffice_available = True
-            except:
-                libreoffice_available = False
+    await publish_progress(job, "✅ СБИС: Готово. Данные сохранены в saby_tariffs_filtered.xlsx")
 
-            if libreoffice_available:
-                cmd = [
-                    'libreoffice', '--headless', '--convert-to', 'docx',
-                    '--outdir', os.path.dirname(doc_path),
-                    doc_path
-                ]
-                result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+    logging.info(f"ОТЛАДКА: задание #{job.id} отменено = {job.cancelled}")
+    if os.path.exists(file_name):
+        logging.info(f"Файл {file_name} создан, отправляем в чат")
+        if job.cancelled:
+            comment = "⚠️ Парсинг СБИС был отменен. Файл содержит неполные данные"
+            logging.info("Парсинг был отменен, отправляем неполный файл")
+        else:
+            comment = "✅ Парсинг СБИС завершен успешно"
+            logging.info("Парсинг завершен успешно")
+        if diff_summary:
+            comment += f"\n{diff_summary}"
 
-                if result.returncode == 0 and os.path.exists(docx_path):
-                    return docx_path
+        await deliver_result(job, file_name, comment)
+        logging.info("Файл СБИС успешно отправлен в чат")
+        await run_in_engine(
+            result_store, "sbis", run_id, file_name, [code for code, name in regions_to_process],
+            job.cancelled, comment
+        )
+
+# ========== ДВИЖОК ПАРСИНГА КОНТУР ==========
+KONTUR_URL = "https://www.kontur-extern.ru/price-download/77"
+
+KONTUR_PDF_LINKS = [
+    "Скачать прайс-лист на тарифные планы «Общий Лайт», «Нулевая отчетность», «Кадровые отчеты», «Классический»",
+    "Скачать прайс-лист для налоговых представителей",
+    "Скачать прайс-лист на тарифный план «Стартовый онлайн»",
+]
+KONTUR_WORD_LINK = "Скачать полный прайс-лист, часть 2"
+
+# Папки скачиваний кликом в браузере и верхняя граница ожидания одного файла
+KONTUR_DOWNLOAD_PREFIX = "dl-"
+KONTUR_DOWNLOAD_TIMEOUT = 60
+
+# === НОВЫЕ ФУНКЦИИ ДЛЯ ИЗВЛЕЧЕНИЯ ДАННЫХ ИЗ НОВОЙ СТРУКТУРЫ ДОКУМЕНТА ===
+
+def extract_final_price(text):
+    """Извлекает итоговую цену с НДС из текста (последнее число в строке с НДС)"""
+    if not text or text == "❌":
+        return "❌"
 
-            return None
+    # Преобразуем в строку если нужно
+    text = str(text)
 
-        except Exception as e:
-            return None
+    # Ищем числа в формате "X XXX,XX" или "XXXXX" - это итоговые цены с НДС
+    # Они обычно в конце строки и могут быть с пробелами
+    numbers = re.findall(r'(\d{1,3}(?:\s?\d{3})*(?:[.,]\d{2})?)', text)
 
-    def extract_final_price(text):
-        """Извлекает итоговую цену с НДС из текста (последнее число в строке с НДС)"""
-        if not text or text == "❌":
-            return "❌"
+    if numbers:
+        # Берем ПОСЛЕДНЕЕ число - это итоговая стоимость с НДС
+        last_number = numbers[-1]
 
-        # Преобразуем в строку если нужно
-        text = str(text)
+        # Очищаем от пробелов и запятых
+        clean_number = last_number.replace(' ', '').replace(',', '').replace('.', '')
 
-        # Ищем числа в формате "X XXX,XX" или "XXXXX" - это итоговые цены с НДС
-        # Они обычно в конце строки и могут быть с пробелами
-        numbers = re.findall(r'(\d{1,3}(?:\s?\d{3})*(?:[.,]\d{2})?)', text)
+        # Проверяем, что это не базовая цена (базовые обычно в 5-10 раз больше)
+        if clean_number.isdigit():
+            price = int(clean_number)
 
-        if numbers:
-            # Берем ПОСЛЕДНЕЕ число - это итоговая стоимость с НДС
-            last_number = numbers[-1]
+            # Базовая цена без НДС обычно > 100000, итоговая с НДС < 50000 для большинства тарифов
+            # Но для дорогих тарифов (1+499) итоговая может быть большой
+            # Поэтому проверяем по контексту позже
 
-            # Очищаем от пробелов и запятых
-            clean_number = last_number.replace(' ', '').replace(',', '').replace('.', '')
+            return price
 
-            # Проверяем, что это не базовая цена (базовые обычно в 5-10 раз больше)
-            if clean_number.isdigit():
-                price = int(clean_number)
+    return "❌"
 
-                # Базовая цена без НДС обычно > 100000, итоговая с НДС < 50000 для большинства тарифов
-                # Но для дорогих тарифов (1+499) итоговая может быть большой
-                # Поэтому проверяем по контексту позже
+def extract_optimal_plus_from_table(table, results):
+    """Извлекает данные из таблицы Оптимальный плюс"""
+    try:
+        rows = list(table.rows)
 
-                return price
+        # Ищем строки с "Оптимальный плюс" и "1 год"
+        for i, row in enumerate(rows):
+            row_text = [cell.text.strip() for cell in row.cells]
+            row_lower = ' '.join(row_text).lower()
 
-        return "❌"
+            if "оптимальный плюс" in row_lower and "1 год" in row_lower:
+                # Проверяем следующие строки для разных категорий
+                for j in range(i, min(i+8, len(rows))):
+                    check_row = rows[j]
+                    check_text = ' '.join([c.text.lower() for c in check_row.cells])
 
-    def extract_optimal_plus_from_table(table, results):
-        """Извлекает данные из таблицы Оптимальный плюс"""
-        try:
-            rows = list(table.rows)
+                    cells = check_row.cells
+                    if len(cells) >= 8:
 
-            # Ищем строки с "Оптимальный плюс" и "1 год"
-            for i, row in enumerate(rows):
-                row_text = [cell.text.strip() for cell in row.cells]
-                row_lower = ' '.join(row_text).lower()
-
-                if "оптимальный плюс" in row_lower and "1 год" in row_lower:
-                    # Проверяем следующие строки для разных категорий
-                    for j in range(i, min(i+8, len(rows))):
-                        check_row = rows[j]
-                        check_text = ' '.join([c.text.lower() for c in check_row.cells])
-
-                        cells = check_row.cells
-                        if len(cells) >= 8:
-
-                            # Ищем ячейку с итоговой стоимостью (последняя колонка)
-                            final_price_cell = cells[-1].text
-
-                            # Определяем категорию по тексту
-                            if "ип" in check_text:
-                                if "усн" in check_text or "специальная" in check_text:
-                                    # Для ИП УСН итоговая цена 6 500,00
-                                    price = extract_final_price(final_price_cell)
-                                    if price and price != "❌" and 5000 < price < 10000:
-                                        results['ip_usn'] = price
-
-                                elif "общая" in check_text or "осно" in check_text or "смешанная" in check_text:
-                                    # Для ИП ОСНО итоговая цена 9 500,00
-                                    price = extract_final_price(final_price_cell)
-                                    if price and price != "❌" and 8000 < price < 12000:
-                                        results['ip_osno'] = price
-
-                            elif "юл" in check_text:
-                                if "усн" in check_text or "специальная" in check_text:
-                                    # Для ЮЛ УСН итоговая цена 9 500,00
-                                    price = extract_final_price(final_price_cell)
-                                    if price and price != "❌" and 8000 < price < 12000:
-                                        results['ul_usn'] = price
-
-                                elif "общая" in check_text or "осно" in check_text or "смешанная" in check_text:
-                                    # Для ЮЛ ОСНО итоговая цена 12 500,00
-                                    price = extract_final_price(final_price_cell)
-                                    if price and price != "❌" and 10000 < price < 15000:
-                                        results['ul_osno'] = price
-        except Exception as e:
-            pass
+                        # Ищем ячейку с итоговой стоимостью (последняя колонка)
+                        final_price_cell = cells[-1].text
+
+                        # Определяем категорию по тексту
+                        if "ип" in check_text:
+                            if "усн" in check_text or "специальная" in check_text:
+                                # Для ИП УСН итоговая цена 6 500,00
+                                price = extract_final_price(final_price_cell)
+                                if price and price != "❌" and 5000 < price < 10000:
+                                    results['ip_usn'] = price
+
+                            elif "общая" in check_text or "осно" in check_text or "смешанная" in check_text:
+                                # Для ИП ОСНО итоговая цена 9 500,00
+                                price = extract_final_price(final_price_cell)
+                                if price and price != "❌" and 8000 < price < 12000:
+                                    results['ip_osno'] = price
+
+                        elif "юл" in check_text:
+                            if "усн" in check_text or "специальная" in check_text:
+                                # Для ЮЛ УСН итоговая цена 9 500,00
+                                price = extract_final_price(final_price_cell)
+                                if price and price != "❌" and 8000 < price < 12000:
+                                    results['ul_usn'] = price
+
+                            elif "общая" in check_text or "осно" in check_text or "смешанная" in check_text:
+                                # Для ЮЛ ОСНО итоговая цена 12 500,00
+                                price = extract_final_price(final_price_cell)
+                                if price and price != "❌" and 10000 < price < 15000:
+                                    results['ul_osno'] = price
+    except Exception:
+        pass
 
-    def extract_budget_plus_from_table(table, results):
-        """Извлекает данные из таблицы Бюджетник плюс"""
-        try:
-            rows = list(table.rows)
+def extract_budget_plus_from_table(table, results):
+    """Извлекает данные из таблицы Бюджетник плюс"""
+    try:
+        rows = list(table.rows)
+
+        for row in rows:
+            cells = row.cells
+            if len(cells) >= 6:
+                row_text = ' '.join([c.text.lower() for c in cells])
+
+                # Ищем строку с "Бюджетник плюс" и "1 год"
+                if "бюджетник плюс" in row_text and "1 год" in row_text:
+                    # Итоговая стоимость в последней колонке
+                    final_price = extract_final_price(cells[-1].text)
+                    if final_price and final_price != "❌" and 5000 < final_price < 10000:
+                        results['budget_plus'] = final_price
+
+                # Ищем строку с "Бюджетник Максимальный" и "1 год"
+                elif "бюджетник максимальный" in row_text and "1 год" in row_text:
+                    final_price = extract_final_price(cells[-1].text)
+                    if final_price and final_price != "❌" and 10000 < final_price < 20000:
+                        results['budget'] = final_price
+    except Exception:
+        pass
 
-            for row in rows:
-                cells = row.cells
-                if len(cells) >= 6:
-                    row_text = ' '.join([c.text.lower() for c in cells])
+def extract_common_tariffs_from_table(table, results, common_keys):
+    """Извлекает данные из таблицы Общий и Общий плюс"""
+    try:
+        rows = list(table.rows)
+
+        for i, row in enumerate(rows):
+            cells = row.cells
+            if len(cells) >= 4:
+                row_text = ' '.join([c.text.lower() for c in cells])
+
+                # Ищем строки с "Общий" (без плюс) для первого года
+                if "общий" in row_text and "плюс" not in row_text and "1 год" in row_text:
+                    # Проверяем все ключи
+                    for key in common_keys:
+                        key_lower = key.lower().replace('+', '').replace(' ', '')
+                        if key_lower in row_text.replace(' ', '').replace('+', ''):
+                            # Итоговая стоимость в последней колонке
+                            final_price = extract_final_price(cells[-1].text)
+                            if final_price and final_price != "❌":
+                                # Проверяем соответствие ожидаемым значениям
+                                expected_ranges = {
+                                    "1+4": (10000, 20000),      # 14 500
+                                    "1+9": (15000, 25000),      # 18 900
+                                    "1+19": (20000, 35000),     # 28 900
+                                    "1+49": (40000, 70000),     # 58 500
+                                    "1+99": (70000, 100000),    # 89 000
+                                    "1+199": (150000, 200000),  # 168 500
+                                    "1+499": (300000, 350000)   # 319 600
+                                }
+                                if key in expected_ranges:
+                                    min_val, max_val = expected_ranges[key]
+                                    if min_val <= final_price <= max_val:
+                                        results['common'][key] = final_price
+                            break
 
-                    # Ищем строку с "Бюджетник плюс" и "1 год"
-                    if "бюджетник плюс" in row_text and "1 год" in row_text:
-                        # Итоговая стоимость в последней колонке
-                        final_price = extract_final_price(cells[-1].text)
-                        if final_price and final_price != "❌" and 5000 < final_price < 10000:
-                            results['budget_plus'] = final_price
-
-                    # Ищем строку с "Бюджетник Максимальный" и "1 год"
-                    elif "бюджетник максимальный" in row_text and "1 год" in row_text:
-                        final_price = extract_final_price(cells[-1].text)
-                        if final_price and final_price != "❌" and 10000 < final_price < 20000:
-                            results['budget'] = final_price
-        except Exception as e:
-            pass
+                # Ищем строки с "Общий плюс" для первого года
+                elif "общий плюс" in row_text and "1 год" in row_text:
+                    for key in common_keys:
+                        key_lower = key.lower().replace('+', '').replace(' ', '')
+                        if key_lower in row_text.replace(' ', '').replace('+', ''):
+                            final_price = extract_final_price(cells[-1].text)
+                            if final_price and final_price != "❌":
+                                # Ожидаемые диапазоны для Общий плюс
+                                expected_ranges = {
+                                    "1+4": (20000, 30000),      # 24 200
+                                    "1+9": (25000, 35000),      # 30 800
+                                    "1+19": (35000, 50000),     # 42 400
+                                    "1+49": (80000, 100000),    # 90 900
+                                    "1+99": (130000, 160000),   # 145 400
+                                    "1+199": (250000, 300000),  # 269 500
+                                    "1+499": (400000, 450000)   # 418 900
+                                }
+                                if key in expected_ranges:
+                                    min_val, max_val = expected_ranges[key]
+                                    if min_val <= final_price <= max_val:
+                                        results['common_plus'][key] = final_price
+                            break
+    except Exception:
+        pass
 
-    def extract_common_tariffs_from_table(table, results, common_keys):
-        """Извлекает данные из таблицы Общий и Общий плюс"""
+def extract_prices_universal(filepath):
+    """Универсальное извлечение цен из Word документов"""
+    try:
+        return extract_prices_streaming(filepath)
+    except Exception:
+        return ["❌"] * 22
+
+# === ЧТЕНИЕ ФАЙЛОВ .DOC (WORD 97) БЕЗ LIBREOFFICE ===
+# Региональные прайс-листы в формате .doc читаются напрямую: контейнер OLE2 (Compound File),
+# текст документа - по таблице фрагментов (piece table), границы таблиц - по свойствам абзацев
+# (sprmPFInTable / sprmPFTtp). Результат повторяет таблицы, строки и ячейки python-docx
+# (объединенные ячейки повторяются), поэтому дальше работает общий разбор extract_prices_from_tables.
+# LibreOffice остается запасным путем для файлов, которые так прочитать не удалось
+CFB_SIGNATURE = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+CFB_END_OF_CHAIN = 0xFFFFFFFE
+CFB_NO_STREAM = 0xFFFFFFFF
+
+WORD_FIB_IDENT = 0xA5EC
+WORD_FKP_SIZE = 512
+
+SPRM_P_IN_TABLE = 0x2416
+SPRM_P_TTP = 0x2417
+SPRM_P_INNER_TTP = 0x244C
+SPRM_P_ITAP = 0x6649
+SPRM_P_CHG_TABS = 0xC615
+SPRM_T_DEF_TABLE = 0xD608
+
+class CompoundFile:
+    """Минимальный читатель контейнера OLE2: потоки верхнего уровня по имени"""
+
+    def __init__(self, data):
+        if data[:8] != CFB_SIGNATURE:
+            raise ValueError("файл не является контейнером OLE2")
+        self.data = data
+        self.sector_size = 1 << struct.unpack_from("<H", data, 0x1E)[0]
+        self.mini_sector_size = 1 << struct.unpack_from("<H", data, 0x20)[0]
+        (fat_count, first_dir, _, self.mini_cutoff,
+         first_minifat, minifat_count, first_difat, difat_count) = struct.unpack_from("<8I", data, 0x2C)
+
+        # Таблица размещения секторов: первые 109 ссылок в заголовке, остальные - в цепочке DIFAT
+        per_sector = self.sector_size // 4
+        difat = list(struct.unpack_from("<109I", data, 0x4C))
+        sector = first_difat
+        for _ in range(difat_count):
+            entries = struct.unpack(f"<{per_sector}I", self._sector(sector))
+            difat.extend(entries[:-1])
+            sector = entries[-1]
+        self.fat = []
+        for sector in difat[:fat_count]:
+            self.fat.extend(struct.unpack(f"<{per_sector}I", self._sector(sector)))
+
+        directory = self._chain(first_dir)
+        entries = []
+        for offset in range(0, len(directory) - 127, 128):
+            name_length, entry_type = struct.unpack_from("<HB", directory, offset + 64)
+            left, right, child = struct.unpack_from("<III", directory, offset + 68)
+            start, size = struct.unpack_from("<IQ", directory, offset + 116)
+            if self.sector_size == 512:
+                size &= 0xFFFFFFFF
+            name = directory[offset:offset + max(name_length - 2, 0)].decode("utf-16-le", errors="replace")
+            entries.append((name, entry_type, left, right, child, start, size))
+
+        root = entries[0]
+        self.mini_stream = self._chain(root[5])[:root[6]]
+        self.minifat = []
+        if minifat_count:
+            raw = self._chain(first_minifat)
+            self.minifat = list(struct.unpack(f"<{len(raw) // 4}I", raw))
+
+        # Потоки верхнего уровня: обход дерева потомков корня
+        self.streams = {}
+        pending = [root[4]]
+        while pending:
+            index = pending.pop()
+            if index == CFB_NO_STREAM or index >= len(entries):
+                continue
+            name, entry_type, left, right, child, start, size = entries[index]
+            if entry_type == 2:
+                self.streams[name] = (start, size)
+            pending.extend((left, right))
+
+    def _sector(self, sector):
+        offset = (sector + 1) * self.sector_size
+        return self.data[offset:offset + self.sector_size]
+
+    def _chain(self, sector):
+        chunks = []
+        seen = set()
+        while sector != CFB_END_OF_CHAIN:
+            if sector >= len(self.fat) or sector in seen:
+                raise ValueError("поврежденная цепочка секторов")
+            seen.add(sector)
+            chunks.append(self._sector(sector))
+            sector = self.fat[sector]
+        return b"".join(chunks)
+
+    def _mini_chain(self, sector):
+        chunks = []
+        seen = set()
+        while sector != CFB_END_OF_CHAIN:
+            if sector >= len(self.minifat) or sector in seen:
+                raise ValueError("поврежденная цепочка мини-секторов")
+            seen.add(sector)
+            offset = sector * self.mini_sector_size
+            chunks.append(self.mini_stream[offset:offset + self.mini_sector_size])
+            sector = self.minifat[sector]
+        return b"".join(chunks)
+
+    def stream(self, name):
+        if name not in self.streams:
+            raise ValueError(f"в файле нет потока {name}")
+        start, size = self.streams[name]
+        data = self._mini_chain(start) if size < self.mini_cutoff else self._chain(start)
+        return data[:size]
+
+class WordCell:
+    def __init__(self, text):
+        self.text = text
+
+class WordRow:
+    def __init__(self, cells):
+        self.cells = cells
+
+class WordTable:
+    def __init__(self, rows):
+        self.rows = rows
+
+def iter_sprms(grpprl):
+    """Перебирает пары (sprm, операнд) в группе свойств Word 97"""
+    offset = 0
+    while offset + 2 <= len(grpprl):
+        sprm = struct.unpack_from("<H", grpprl, offset)[0]
+        offset += 2
+        spra = sprm >> 13
+        if spra in (0, 1):
+            size = 1
+        elif spra in (2, 4, 5):
+            size = 2
+        elif spra == 3:
+            size = 4
+        elif spra == 7:
+            size = 3
+        elif offset + 2 > len(grpprl):
+            break
+        elif sprm == SPRM_T_DEF_TABLE:
+            # У описания таблицы размер двухбайтовый и на единицу больше длины данных
+            size = struct.unpack_from("<H", grpprl, offset)[0] - 1
+            offset += 2
+        elif sprm == SPRM_P_CHG_TABS and grpprl[offset] == 255:
+            end = offset + 1
+            end += 1 + 4 * grpprl[end]
+            end += 1 + 3 * grpprl[end]
+            offset += 1
+            size = end - offset
+        else:
+            size = grpprl[offset]
+            offset += 1
+        yield sprm, grpprl[offset:offset + size]
+        offset += size
+
+def parse_table_def(operand):
+    """Ячейки строки из sprmTDefTable: [(левая граница, правая граница, гориз. объединение, верт. объединение)]"""
+    count = operand[0]
+    centers = struct.unpack_from(f"<{count + 1}h", operand, 1)
+    cells_offset = 1 + 2 * (count + 1)
+    cells = []
+    for index in range(count):
+        flags = 0
+        if cells_offset + 20 * index + 2 <= len(operand):
+            flags = struct.unpack_from("<H", operand, cells_offset + 20 * index)[0]
+        cells.append((centers[index], centers[index + 1], flags & 3, (flags >> 5) & 3))
+    return cells
+
+def paragraph_props(grpprl):
+    """Табличные свойства абзаца, заданные в группе sprm (только присутствующие)"""
+    props = {}
+    for sprm, operand in iter_sprms(grpprl):
+        if sprm == SPRM_P_IN_TABLE:
+            props["in_table"] = operand[:1] not in (b"", b"\x00")
+        elif sprm == SPRM_P_TTP:
+            props["ttp"] = operand[:1] not in (b"", b"\x00")
+        elif sprm == SPRM_P_INNER_TTP:
+            props["inner_ttp"] = operand[:1] not in (b"", b"\x00")
+        elif sprm == SPRM_P_ITAP and len(operand) == 4:
+            props["itap"] = struct.unpack("<i", operand)[0]
+        elif sprm == SPRM_T_DEF_TABLE and operand:
+            props["cells"] = parse_table_def(operand)
+    return props
+
+def read_doc_paragraphs(filepath):
+    """Абзацы основного текста .doc: [(текст, символ конца абзаца, табличные свойства)]"""
+    with open(filepath, 'rb') as f:
+        cfb = CompoundFile(f.read())
+
+    word = cfb.stream("WordDocument")
+    ident, flags = struct.unpack_from("<H8xH", word, 0)
+    if ident != WORD_FIB_IDENT:
+        raise ValueError("нет заголовка FIB Word 97")
+    if flags & 0x0100:
+        raise ValueError("документ зашифрован")
+    if flags & 0x0004:
+        # После быстрого сохранения свойства абзацев могут лежать в модификаторах фрагментов
+        raise ValueError("документ сохранен быстрым сохранением")
+    table = cfb.stream("1Table" if flags & 0x0200 else "0Table")
+
+    # FIB: FibBase, fibRgW, fibRgLw (ccpText - 4-е значение), fibRgFcLcb (PlcfBtePapx - 13-я пара, Clx - 33-я)
+    offset = 32
+    offset += 2 + 2 * struct.unpack_from("<H", word, offset)[0]
+    ccp_text = struct.unpack_from("<I", word, offset + 2 + 4 * 3)[0]
+    offset += 2 + 4 * struct.unpack_from("<H", word, offset)[0]
+    fc_lcb = offset + 2
+    fc_papx, lcb_papx = struct.unpack_from("<II", word, fc_lcb + 8 * 13)
+    fc_clx, lcb_clx = struct.unpack_from("<II", word, fc_lcb + 8 * 33)
+
+    # Clx: группы свойств фрагментов (Prc), затем таблица фрагментов (Pcdt)
+    clx = table[fc_clx:fc_clx + lcb_clx]
+    piece_grpprls = []
+    pos = 0
+    while pos < len(clx) and clx[pos] == 1:
+        size = struct.unpack_from("<h", clx, pos + 1)[0]
+        piece_grpprls.append(clx[pos + 3:pos + 3 + size])
+        pos += 3 + size
+    if pos >= len(clx) or clx[pos] != 2:
+        raise ValueError("не найдена таблица фрагментов")
+    plc_size = struct.unpack_from("<I", clx, pos + 1)[0]
+    plc = clx[pos + 5:pos + 5 + plc_size]
+    piece_count = (plc_size - 4) // 12
+    cps = struct.unpack_from(f"<{piece_count + 1}I", plc, 0)
+
+    # Свойства абзацев: страницы FKP, на которые ссылается PlcfBtePapx
+    plc_papx = table[fc_papx:fc_papx + lcb_papx]
+    bte_count = (len(plc_papx) - 4) // 8
+    runs = []
+    for index in range(bte_count):
+        page_number = struct.unpack_from("<I", plc_papx, 4 * (bte_count + 1) + 4 * index)[0] & 0x3FFFFF
+        page = word[page_number * WORD_FKP_SIZE:(page_number + 1) * WORD_FKP_SIZE]
+        if len(page) < WORD_FKP_SIZE:
+            continue
+        run_count = page[WORD_FKP_SIZE - 1]
+        bounds = struct.unpack_from(f"<{run_count + 1}I", page, 0)
+        for run in range(run_count):
+            grpprl = b""
+            papx_offset = page[4 * (run_count + 1) + 13 * run] * 2
+            if papx_offset:
+                size = page[papx_offset]
+                if size:
+                    body = page[papx_offset + 1:papx_offset + 2 * size]
+                else:
+                    body = page[papx_offset + 2:papx_offset + 2 + 2 * page[papx_offset + 1]]
+                grpprl = body[2:]
+            runs.append((bounds[run], bounds[run + 1], grpprl))
+    runs.sort()
+    run_starts = [run[0] for run in runs]
+    props_cache = {}
+
+    def props_at(fc):
+        index = bisect.bisect_right(run_starts, fc) - 1
+        grpprl = runs[index][2] if index >= 0 and fc < runs[index][1] else b""
+        if grpprl not in props_cache:
+            props_cache[grpprl] = paragraph_props(grpprl)
+        return props_cache[grpprl]
+
+    paragraphs = []
+    current = []
+    fields = []  # для каждого открытого поля: True, пока идет код поля (он в текст не попадает)
+    for index in range(piece_count):
+        cp_start, cp_end = cps[index], min(cps[index + 1], ccp_text)
+        if cp_start >= ccp_text:
+            break
+        fc_raw, prm = struct.unpack_from("<IH", plc, 4 * (piece_count + 1) + 8 * index + 2)
+        count = cp_end - cp_start
+        if fc_raw & 0x40000000:
+            fc = (fc_raw & 0x3FFFFFFF) // 2
+            width = 1
+            text = word[fc:fc + count].decode("cp1252", errors="replace")
+        else:
+            fc = fc_raw
+            width = 2
+            text = word[fc:fc + 2 * count].decode("utf-16-le", errors="replace")
+
+        piece_props = {}
+        if prm & 1 and (prm >> 1) < len(piece_grpprls):
+            piece_props = paragraph_props(piece_grpprls[prm >> 1])
+
+        for position, char in enumerate(text):
+            if char in "\r\x07":
+                props = {"in_table": False, "ttp": False, "inner_ttp": False, "itap": 0, "cells": None}
+                props.update(props_at(fc + position * width))
+                props.update(piece_props)
+                if props["in_table"] and props["itap"] == 0:
+                    props["itap"] = 1
+                paragraphs.append(("".join(current), char, props))
+                current = []
+            elif char == "\x13":
+                fields.append(True)
+            elif char == "\x14":
+                if fields:
+                    fields[-1] = False
+            elif char == "\x15":
+                if fields:
+                    fields.pop()
+            elif fields and fields[-1]:
+                continue
+            elif char == "\x0b":
+                current.append("\n")
+            elif char == "\x1e":
+                current.append("-")
+            elif char in "\x01\x02\x05\x08\x0c\x1f":
+                continue
+            else:
+                current.append(char)
+    return paragraphs
+
+def build_doc_table(raw_rows):
+    """Строки таблицы с повтором объединенных ячеек по колонкам общей сетки, как в python-docx"""
+    grid = sorted({edge for texts, cells in raw_rows if cells for cell in cells for edge in cell[:2]})
+    rows = []
+    previous = []
+    for texts, cells in raw_rows:
+        expanded = []
+        for index, text in enumerate(texts):
+            span, horizontal, vertical = 1, 0, 0
+            if cells and index < len(cells):
+                # Продолжение горизонтального объединения может иметь нулевую ширину - тогда колонок у него нет
+                left, right, horizontal, vertical = cells[index]
+                span = sum(1 for edge in grid if left <= edge < right)
+            if horizontal == 2 and expanded:
+                text = expanded[-1]
+            if vertical == 1 and len(expanded) < len(previous):
+                text = previous[len(expanded)]
+            expanded.extend([text] * span)
+        rows.append(WordRow([WordCell(text) for text in expanded]))
+        previous = expanded
+    return WordTable(rows)
+
+def read_doc_tables(filepath):
+    """Таблицы файла .doc в том же виде, что doc.tables у python-docx"""
+    tables = []
+    raw_rows = []
+    cells = []
+    cell_lines = []
+    for text, mark, props in read_doc_paragraphs(filepath):
+        if props["itap"] < 1:
+            if raw_rows:
+                tables.append(build_doc_table(raw_rows))
+                raw_rows = []
+            cells, cell_lines = [], []
+        elif props["itap"] == 1 and props["ttp"]:
+            raw_rows.append((cells, props["cells"]))
+            cells, cell_lines = [], []
+        elif props["itap"] == 1 and mark == "\x07":
+            cell_lines.append(text)
+            cells.append("\n".join(cell_lines))
+            cell_lines = []
+        elif not props["inner_ttp"]:
+            # Абзац внутри ячейки (в том числе текст вложенной таблицы)
+            cell_lines.append(text)
+    if raw_rows:
+        tables.append(build_doc_table(raw_rows))
+
+    if not tables:
+        raise ValueError("в документе не найдено таблиц")
+    return tables
+
+def load_word_tables(filepath):
+    """Таблицы Word файла: .docx - через python-docx, .doc - встроенным читателем, при неудаче - через LibreOffice"""
+    file_ext = os.path.splitext(filepath)[1].lower()
+    if file_ext == '.doc':
         try:
-            rows = list(table.rows)
-
-            for i, row in enumerate(rows):
-                cells = row.cells
-                if len(cells) >= 4:
-                    row_text = ' '.join([c.text.lower() for c in cells])
-
-                    # Ищем строки с "Общий" (без плюс) для первого года
-                    if "общий" in row_text and "плюс" not in row_text and "1 год" in row_text:
-                        # Проверяем все ключи
-                        for key in common_keys:
-                            key_lower = key.lower().replace('+', '').replace(' ', '')
-                            if key_lower in row_text.replace(' ', '').replace('+', ''):
-                                # Итоговая стоимость в последней колонке
-                                final_price = extract_final_price(cells[-1].text)
-                                if final_price and final_price != "❌":
-                                    # Проверяем соответствие ожидаемым значениям
-                                    expected_ranges = {
-                                        "1+4": (10000, 20000),      # 14 500
-                                        "1+9": (15000, 25000),      # 18 900
-                                        "1+19": (20000, 35000),     # 28 900
-                                        "1+49": (40000, 70000),     # 58 500
-                                        "1+99": (70000, 100000),    # 89 000
-                                        "1+199": (150000, 200000),  # 168 500
-                                        "1+499": (300000, 350000)   # 319 600
-                                    }
-                                    if key in expected_ranges:
-                                        min_val, max_val = expected_ranges[key]
-                                        if min_val <= final_price <= max_val:
-                                            results['common'][key] = final_price
-                                break
-
-                    # Ищем строки с "Общий плюс" для первого года
-                    elif "общий плюс" in row_text and "1 год" in row_text:
-                        for key in common_keys:
-                            key_lower = key.lower().replace('+', '').replace(' ', '')
-                            if key_lower in row_text.replace(' ', '').replace('+', ''):
-                                final_price = extract_final_price(cells[-1].text)
-                                if final_price and final_price != "❌":
-                                    # Ожидаемые диапазоны для Общий плюс
-                                    expected_ranges = {
-                                        "1+4": (20000, 30000),      # 24 200
-                                        "1+9": (25000, 35000),      # 30 800
-                                        "1+19": (35000, 50000),     # 42 400
-                                        "1+49": (80000, 100000),    # 90 900
-                                        "1+99": (130000, 160000),   # 145 400
-                                        "1+199": (250000, 300000),  # 269 500
-                                        "1+499": (400000, 450000)   # 418 900
-                                    }
-                                    if key in expected_ranges:
-                                        min_val, max_val = expected_ranges[key]
-                                        if min_val <= final_price <= max_val:
-                                            results['common_plus'][key] = final_price
-                                break
+            return read_doc_tables(filepath)
         except Exception as e:
-            pass
-
-    def extract_prices_universal(filepath):
-        """Универсальное извлечение цен из Word документов"""
-        try:
-            file_ext = os.path.splitext(filepath)[1].lower()
-
-            if file_ext == '.docx':
-                return extract_from_docx_by_structure(filepath)
-            elif file_ext == '.doc':
-                converted_path = convert_doc_to_docx(filepath)
-                if converted_path:
-                    return extract_from_docx_by_structure(converted_path)
+            logging.info(f"Файл {os.path.basename(filepath)} не прочитан напрямую ({str(e)}), конвертируем через LibreOffice")
+        filepath = convert_doc_to_docx(filepath)
+        if not filepath:
+            return None
+        file_ext = '.docx'
 
-            return ["❌"] * 22
+    if file_ext != '.docx':
+        return None
 
-        except Exception as e:
-            return ["❌"] * 22
+    from docx import Document
+    return list(Document(filepath).tables)
+
+class OfficeConverter:
+    """
+    Служба конвертации .doc → .docx через LibreOffice. Наличие программы проверяется один раз.
+    Задания ставятся в общую очередь; у каждого воркера свой профиль UserInstallation, чтобы
+    параллельные процессы не конфликтовали, а профиль создавался один раз, а не при каждом запуске.
+    Каждый пакет - отдельный запуск soffice --convert-to (постоянного процесса LibreOffice нет),
+    поэтому воркер, получив задание, еще BATCH_WAIT секунд собирает следующие и конвертирует
+    их все одним запуском. Чтобы пакеты были большими, файлы лучше ставить в очередь все сразу
+    (convert_many), а не по одному по мере скачивания. Размеры пакетов копятся в batch_sizes
+    """
+
+    BATCH_LIMIT = 50
+    BATCH_WAIT = 0.5
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.jobs = queue.Queue()
+        self.threads = []
+        self.lock = threading.Lock()
+        self.checked = False
+        self.binary = None
+        self.profile_root = None
+        self.batch_sizes = []
+
+    def detect(self):
+        """Ищет LibreOffice один раз за время работы бота"""
+        with self.lock:
+            if not self.checked:
+                self.checked = True
+                self.binary = shutil.which("soffice") or shutil.which("libreoffice")
+                if self.binary:
+                    logging.info(f"LibreOffice найден: {self.binary}")
+                else:
+                    logging.error("LibreOffice не найден, файлы .doc конвертироваться не будут")
+        return self.binary
 
-    def convert_doc_to_docx(doc_path):
-        """Конвертирует .doc в .docx используя LibreOffice"""
-        try:
-            docx_path = doc_path + 'x'
+    def start(self):
+        if not self.detect():
+            return
+        with self.lock:
+            if self.threads:
+                return
+            self.profile_root = tempfile.mkdtemp(prefix="office-profiles-")
+            for worker_id in range(self.workers):
+                thread = threading.Thread(target=self._worker, args=(worker_id,), name=f"office-{worker_id}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def _worker(self, worker_id):
+        profile = Path(self.profile_root, f"worker{worker_id}").as_uri()
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            batch = [job]
+            deadline = time.monotonic() + self.BATCH_WAIT
+            while len(batch) < self.BATCH_LIMIT:
+                try:
+                    job = self.jobs.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if job is None:
+                    self.jobs.put(None)
+                    break
+                batch.append(job)
+            self._convert_batch(profile, batch)
+
+    def _convert_batch(self, profile, batch):
+        while batch:
+            # Файлы с одинаковым именем из разных папок конвертируются разными запусками
+            chunk, rest, stems = [], [], set()
+            for doc_path, future in batch:
+                stem = Path(doc_path).stem
+                if stem in stems:
+                    rest.append((doc_path, future))
+                else:
+                    stems.add(stem)
+                    chunk.append((doc_path, future))
 
+            outdir = tempfile.mkdtemp(prefix="office-out-")
+            started = time.monotonic()
+            with self.lock:
+                self.batch_sizes.append(len(chunk))
             try:
-                subprocess.run(['libreoffice', '--version'], capture_output=True, check=True)
-                libreoffice_available = True
-            except:
-                libreoffice_available = False
-
-            if libreoffice_available:
                 cmd = [
-                    'libreoffice', '--headless', '--convert-to', 'docx',
-                    '--outdir', os.path.dirname(doc_path),
-                    doc_path
-                ]
-                result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-
-                if result.returncode == 0 and os.path.exists(docx_path):
-                    return docx_path
-
-            return None
-        except Exception as e:
-            print(f"Ошибка конвертации: {e}")
-            return None
+                    self.binary, f"-env:UserInstallation={profile}",
+                    '--headless', '--norestore', '--convert-to', 'docx',
+                    '--outdir', outdir
+                ] + [doc_path for doc_path, future in chunk]
+                subprocess.run(cmd, capture_output=True, text=True, timeout=30 + 10 * len(chunk))
+
+                converted = 0
+                for doc_path, future in chunk:
+                    produced = os.path.join(outdir, Path(doc_path).stem + ".docx")
+                    if os.path.exists(produced):
+                        docx_path = str(Path(doc_path).with_suffix(".docx"))
+                        shutil.move(produced, docx_path)
+                        future.set_result(docx_path)
+                        converted += 1
+                    else:
+                        future.set_result(None)
+                logging.info(f"LibreOffice: сконвертировано {converted} из {len(chunk)} файлов за {time.monotonic() - started:.1f} с")
+            except Exception as e:
+                logging.error(f"LibreOffice: ошибка конвертации пакета из {len(chunk)} файлов: {str(e)}")
+                for doc_path, future in chunk:
+                    if not future.done():
+                        future.set_result(None)
+            finally:
+                shutil.rmtree(outdir, ignore_errors=True)
+            batch = rest
+
+    def submit(self, doc_path):
+        """Ставит файл в очередь конвертации. Future вернет путь к .docx или None"""
+        future = Future()
+        docx_path = str(Path(doc_path).with_suffix(".docx"))
+        # Файл уже конвертирован (например, сервер вернул тот же .doc с ответом 304)
+        if os.path.exists(docx_path) and os.path.getmtime(docx_path) >= os.path.getmtime(doc_path):
+            future.set_result(docx_path)
+            return future
+        if not self.detect():
+            future.set_result(None)
+            return future
+        self.start()
+        self.jobs.put((doc_path, future))
+        return future
+
+    def convert(self, doc_path, timeout=120):
+        return wait_future(self.submit(doc_path), timeout)
+
+    def log_batch_stats(self):
+        """Пишет в лог размеры пакетов (файлов на один запуск soffice) с прошлого вызова и очищает их"""
+        with self.lock:
+            sizes, self.batch_sizes = self.batch_sizes, []
+        if sizes:
+            logging.info(
+                f"LibreOffice: запусков {len(sizes)}, файлов {sum(sizes)}, "
+                f"в среднем {sum(sizes) / len(sizes):.1f} в пакете, размеры пакетов {sizes}"
+            )
 
-    def extract_number_from_cell(text):
-        """Извлекает число из ячейки таблицы"""
-        if not text:
-            return "❌"
-
-        # Ищем число (с пробелами или без)
-        text = str(text)
-        # Убираем пробелы и заменяем запятую на точку
-        cleaned = text.replace(' ', '').replace(',', '.').replace('–', '').strip()
-
-        # Ищем число в формате XXXX.XX или XXXXX
-        match = re.search(r'(\d+(?:\.\d+)?)', cleaned)
-        if match:
-            num_str = match.group(1)
-            if '.' in num_str:
-                num_str = num_str.split('.')[0]
-            if num_str.isdigit():
-                return int(num_str)
+    def convert_many(self, doc_paths, timeout=600):
+        """Пакетная конвертация: все файлы попадают в очередь сразу и обрабатываются общими запусками"""
+        futures = [self.submit(doc_path) for doc_path in doc_paths]
+        return [wait_future(future, timeout) for future in futures]
+
+    def close(self):
+        with self.lock:
+            threads, self.threads = self.threads, []
+        for thread in threads:
+            self.jobs.put(None)
+        for thread in threads:
+            thread.join(30)
+        if self.profile_root:
+            shutil.rmtree(self.profile_root, ignore_errors=True)
+            self.profile_root = None
+
+OFFICE_CONVERTER = OfficeConverter(KONTUR_OFFICE_WORKERS)
+
+def convert_doc_to_docx(doc_path):
+    """Конвертирует .doc в .docx используя LibreOffice"""
+    try:
+        return OFFICE_CONVERTER.convert(doc_path)
+    except Exception as e:
+        logging.error(f"Ошибка конвертации {doc_path}: {str(e)}")
+        return None
 
+def extract_number_from_cell(text):
+    """Извлекает число из ячейки таблицы"""
+    if not text:
         return "❌"
 
-    def extract_from_docx_by_structure(filepath):
-        """Извлечение данных по структуре документа"""
-        try:
-            from docx import Document
-            doc = Document(filepath)
-
-            # Инициализация результатов
-            ip_usn = "❌"
-            ip_osno = "❌"
-            ul_usn = "❌"
-            ul_osno = "❌"
-            budget_plus = "❌"
-            budget = "❌"
-            common_prices = ["❌"] * 7  # 1+4 до 1+499
-            common_plus_prices = ["❌"] * 7  # 1+4 плюс до 1+499 плюс
-
-            # Получаем все таблицы
-            tables = list(doc.tables)
-
-            # ===== ТАБЛИЦА 1: Оптимальный плюс =====
-            if len(tables) >= 1:
-                table = tables[0]
-                rows = list(table.rows)
-
-                # Ищем строки с "Оптимальный плюс" и "1 год"
-                for i, row in enumerate(rows):
-                    cells = row.cells
-                    if len(cells) >= 8:
-                        # Получаем текст всех ячеек для анализа
-                        row_text = ' '.join([c.text.lower() for c in cells])
-
-                        # Проверяем, что это строка с данными (не заголовок)
-                        if "оптимальный плюс" in row_text and "1 год" in row_text:
-                            # Определяем категорию
-                            if "ип" in row_text:
-                                if "усн" in row_text or "специальная" in row_text:
-                                    # ИП УСН - берем цену из последней ячейки
-                                    price = extract_number_from_cell(cells[-1].text)
-                                    if price != "❌":
-                                        ip_usn = price
-                                elif "общая" in row_text or "осно" in row_text or "смешанная" in row_text:
-                                    # ИП ОСНО
-                                    price = extract_number_from_cell(cells[-1].text)
-                                    if price != "❌":
-                                        ip_osno = price
-                            elif "юл" in row_text:
-                                if "усн" in row_text or "специальная" in row_text:
-                                    # ЮЛ УСН
-                                    price = extract_number_from_cell(cells[-1].text)
-                                    if price != "❌":
-                                        ul_usn = price
-                                elif "общая" in row_text or "осно" in row_text or "смешанная" in row_text:
-                                    # ЮЛ ОСНО
-                                    price = extract_number_from_cell(cells[-1].text)
-                                    if price != "❌":
-                                        ul_osno = price
-
-            # ===== ТАБЛИЦА 3: Бюджетник (индекс 2) =====
-            if len(tables) >= 3:
-                table = tables[2]  # Третья таблица (индекс 2)
-                rows = list(table.rows)
-
-                # Сбрасываем найденные значения
-                found_budget_plus = False
-                found_budget_normal = False
-
-                for row in rows:
-                    cells = row.cells
-                    if len(cells) >= 6:
-                        row_text = ' '.join([c.text.lower() for c in cells])
-
-                        # Пропускаем строки с "Максимальный" - они нам не нужны
-                        if "максимальный" in row_text:
-                            continue
-
-                        # Ищем "Бюджетник плюс" (срок 1 год)
-                        if "бюджетник плюс" in row_text and "1 год" in row_text and not found_budget_plus:
-                            price = extract_number_from_cell(cells[-1].text)
-                            if price != "❌":
-                                budget_plus = price
-                                found_budget_plus = True
+    # Ищем число (с пробелами или без)
+    text = str(text)
+    # Убираем пробелы и заменяем запятую на точку
+    cleaned = text.replace(' ', '').replace(',', '.').replace('–', '').strip()
+
+    # Ищем число в формате XXXX.XX или XXXXX
+    match = re.search(r'(\d+(?:\.\d+)?)', cleaned)
+    if match:
+        num_str = match.group(1)
+        if '.' in num_str:
+            num_str = num_str.split('.')[0]
+        if num_str.isdigit():
+            return int(num_str)
+
+    return "❌"
+
+def extract_from_docx_by_structure(filepath):
+    """Извлечение данных по структуре документа"""
+    from docx import Document
+    return extract_prices_from_tables(list(Document(filepath).tables))
+
+def extract_prices_from_tables(tables):
+    """Извлечение данных по структуре таблиц документа (.docx или .doc)"""
+    try:
+        # Инициализация результатов
+        ip_usn = "❌"
+        ip_osno = "❌"
+        ul_usn = "❌"
+        ul_osno = "❌"
+        budget_plus = "❌"
+        budget = "❌"
+        common_prices = ["❌"] * 7  # 1+4 до 1+499
+        common_plus_prices = ["❌"] * 7  # 1+4 плюс до 1+499 плюс
+
+        # ===== ТАБЛИЦА 1: Оптимальный плюс =====
+        if len(tables) >= 1:
+            table = tables[0]
+            rows = list(table.rows)
 
-                        # Ищем обычный "Бюджетник" (без "плюс" и без "максимальный") со сроком 1 год
-                        elif "бюджетник" in row_text and "плюс" not in row_text and "1 год" in row_text and not found_budget_normal:
-                            # Проверяем, что это действительно обычный бюджетник
-                            if not any(word in row_text for word in ["максимальный", "плюс"]):
-                                price = extract_number_from_cell(cells[-1].text)
-                                if price != "❌":
-                                    budget = price
-                                    found_budget_normal = True
-
-            # ===== ТАБЛИЦА 5: Общий (индекс 4) =====
-            if len(tables) >= 5:
-                table = tables[4]  # Пятая таблица (индекс 4)
-                rows = list(table.rows)
-
-                common_index = 0
-                for row in rows:
-                    cells = row.cells
-                    if len(cells) >= 7:
-                        row_text = ' '.join([c.text.lower() for c in cells])
-
-                        # Ищем строки с "Общий" (без плюс) и "1 год"
-                        if "общий" in row_text and "плюс" not in row_text and "1 год" in row_text:
-                            # Определяем количество абонентов
-                            if "1+4" in row_text and common_index == 0:
-                                price = extract_number_from_cell(cells[-1].text)
-                                if price != "❌":
-                                    common_prices[0] = price
-                                    common_index += 1
-                            elif "1+9" in row_text and common_index <= 1:
-                                price = extract_number_from_cell(cells[-1].text)
-                                if price != "❌":
-                                    common_prices[1] = price
-                                    common_index += 1
-                            elif "1+19" in row_text and common_index <= 2:
-                                price = extract_number_from_cell(cells[-1].text)
-                                if price != "❌":
-                                    common_prices[2] = price
-                                    common_index += 1
-                            elif "1+49" in row_text and common_index <= 3:
-                                price = extract_number_from_cell(cells[-1].text)
-                                if price != "❌":
-                                    common_prices[3] = price
-                                    common_index += 1
-                            elif "1+99" in row_text and common_index <= 4:
-                                price = extract_number_from_cell(cells[-1].text)
-                                if price != "❌":
-                                    common_prices[4] = price
-                                    common_index += 1
-                            elif "1+199" in row_text and common_index <= 5:
-                                price = extract_number_from_cell(cells[-1].text)
-                                if price != "❌":
-                                    common_prices[5] = price
-                                    common_index += 1
-                            elif "1+499" in row_text and common_index <= 6:
-                                price = extract_number_from_cell(cells[-1].text)
-                                if price != "❌":
-                                    common_prices[6] = price
-                                    common_index += 1
-
-            # ===== ТАБЛИЦА 6: Общий плюс (индекс 5) =====
-            if len(tables) >= 6:
-                table = tables[5]  # Шестая таблица (индекс 5)
-                rows = list(table.rows)
-
-                common_plus_index = 0
-                for row in rows:
-                    cells = row.cells
-                    if len(cells) >= 7:
-                        row_text = ' '.join([c.text.lower() for c in cells])
-
-                        # Ищем строки с "Общий плюс" и "1 год"
-                        if "общий плюс" in row_text and "1 год" in row_text:
-                            # Определяем количество абонентов
-                            if "1+4" in row_text and common_plus_index == 0:
-                                price = extract_number_from_cell(cells[-1].text)
-                                if price != "❌":
-                                    common_plus_prices[0] = price
-                                    common_plus_index += 1
-                            elif "1+9" in row_text and common_plus_index <= 1:
-                                price = extract_number_from_cell(cells[-1].text)
-                                if price != "❌":
-                                    common_plus_prices[1] = price
-                                    common_plus_index += 1
-                            elif "1+19" in row_text and common_plus_index <= 2:
-                                price = extract_number_from_cell(cells[-1].text)
-                                if price != "❌":
-                                    common_plus_prices[2] = price
-                                    common_plus_index += 1
-                            elif "1+49" in row_text and common_plus_index <= 3:
+            # Ищем строки с "Оптимальный плюс" и "1 год"
+            for i, row in enumerate(rows):
+                cells = row.cells
+                if len(cells) >= 8:
+                    # Получаем текст всех ячеек для анализа
+                    row_text = ' '.join([c.text.lower() for c in cells])
+
+                    # Проверяем, что это строка с данными (не заголовок)
+                    if "оптимальный плюс" in row_text and "1 год" in row_text:
+                        # Определяем категорию
+                        if "ип" in row_text:
+                            if "усн" in row_text or "специальная" in row_text:
+                                # ИП УСН - берем цену из последней ячейки
                                 price = extract_number_from_cell(cells[-1].text)
                                 if price != "❌":
-                                    common_plus_prices[3] = price
-                                    common_plus_index += 1
-                            elif "1+99" in row_text and common_plus_index <= 4:
+                                    ip_usn = price
+                            elif "общая" in row_text or "осно" in row_text or "смешанная" in row_text:
+                                # ИП ОСНО
                                 price = extract_number_from_cell(cells[-1].text)
                                 if price != "❌":
-                                    common_plus_prices[4] = price
-                                    common_plus_index += 1
-                            elif "1+199" in row_text and common_plus_index <= 5:
+                                    ip_osno = price
+                        elif "юл" in row_text:
+                            if "усн" in row_text or "специальная" in row_text:
+                                # ЮЛ УСН
                                 price = extract_number_from_cell(cells[-1].text)
                                 if price != "❌":
-                                    common_plus_prices[5] = price
-                                    common_plus_index += 1
-                            elif "1+499" in row_text and common_plus_index <= 6:
+                                    ul_usn = price
+                            elif "общая" in row_text or "осно" in row_text or "смешанная" in row_text:
+                                # ЮЛ ОСНО
                                 price = extract_number_from_cell(cells[-1].text)
                                 if price != "❌":
-                                    common_plus_prices[6] = price
-                                    common_plus_index += 1
-
-            # Формируем результат в нужном порядке
-            result = [
-                ip_usn,           # колонка 3: ИП (УСН)
-                ip_osno,          # колонка 4: ИП (ОСНО)
-                ul_usn,           # колонка 5: ЮЛ (УСН)
-                ul_osno,          # колонка 6: ЮЛ (ОСНО)
-                budget_plus,      # колонка 7: Бюджетник плюс
-                budget,           # колонка 8: Обычный Бюджетник (или ❌ если нет)
-                common_prices[0], # колонка 9: 1+4
-                common_prices[1], # колонка 10: 1+9
-                common_prices[2], # колонка 11: 1+19
-                common_prices[3], # колонка 12: 1+49
-                common_prices[4], # колонка 13: 1+99
-                common_prices[5], # колонка 14: 1+199
-                common_prices[6], # колонка 15: 1+499
-                common_plus_prices[0], # колонка 16: 1+4 плюс
-                common_plus_prices[1], # колонка 17: 1+9 плюс
-                common_plus_prices[2], # колонка 18: 1+19 плюс
-                common_plus_prices[3], # колонка 19: 1+49 плюс
-                common_plus_prices[4], # колонка 20: 1+99 плюс
-                common_plus_prices[5], # колонка 21: 1+199 плюс
-                common_plus_prices[6]  # колонка 22: 1+499 плюс
-            ]
-
-            return result
-
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
-            return ["❌"] * 22
-
-    # === СТАРЫЕ ФУНКЦИИ ДЛЯ PDF (ОСТАВЛЯЕМ БЕЗ ИЗМЕНЕНИЙ) ===
-
-    def extract_text_from_pdf(pdf_path):
-        """Извлекает текст из PDF файла"""
-        try:
-            import PyPDF2
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page_num, page in enumerate(pdf_reader.pages):
-                    page_text = page.extract_text()
-                    text += page_text
-                return text
-        except Exception as e:
-            return ""
-
-    def extract_all_null_prices(pdf_path):
-        """
-        Извлекает итоговую стоимость с НДС для Нулевой отчетности по всем регионам
-        """
-        import PyPDF2
-        import re
+                                    ul_osno = price
 
-        try:
-            null_reporting_data = {}
-
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-
-                # Страницы с Нулевой отчетностью (49-54 в документе = индексы 48-53)
-                for page_num in range(48, 54):
-                    page = pdf_reader.pages[page_num]
-                    text = page.extract_text()
-                    lines = text.split('\n')
-
-                    for line in lines:
-                        line_clean = line.strip()
-
-                        # Ищем строки с "Право использования ПО"
-                        if 'Право использования ПО' in line_clean and len(line_clean) >= 2 and line_clean[:2].isdigit():
-                            region_code = line_clean[:2]
+        # ===== ТАБЛИЦА 3: Бюджетник (индекс 2) =====
+        if len(tables) >= 3:
+            table = tables[2]  # Третья таблица (индекс 2)
+            rows = list(table.rows)
 
-                            # Ищем паттерн: "– число" (итоговая стоимость после тире)
-                            # Формат: "... – 2 200,00 ..."
-                            match = re.search(r'–\s+([\d\s,]+)', line_clean)
-                            if match:
-                                price_str = match.group(1).strip()
-                                # Убираем пробелы и заменяем запятую на точку
-                                price_str = price_str.replace(' ', '').replace(',', '.')
+            # Сбрасываем найденные значения
+            found_budget_plus = False
+            found_budget_normal = False
 
-                                try:
-                                    price = float(price_str)
-                                    null_reporting_data[region_code] = price
-                                except ValueError:
-                                    continue
+            for row in rows:
+                cells = row.cells
+                if len(cells) >= 6:
+                    row_text = ' '.join([c.text.lower() for c in cells])
 
-            return null_reporting_data
+                    # Пропускаем строки с "Максимальный" - они нам не нужны
+                    if "максимальный" in row_text:
+                        continue
 
-        except Exception as e:
-            print(f"Ошибка при парсинге Нулевой отчетности: {e}")
-            import traceback
-            traceback.print_exc()
-            return {}
+                    # Ищем "Бюджетник плюс" (срок 1 год)
+                    if "бюджетник плюс" in row_text and "1 год" in row_text and not found_budget_plus:
+                        price = extract_number_from_cell(cells[-1].text)
+                        if price != "❌":
+                            budget_plus = price
+                            found_budget_plus = True
+
+                    # Ищем обычный "Бюджетник" (без "плюс" и без "максимальный") со сроком 1 год
+                    elif "бюджетник" in row_text and "плюс" not in row_text and "1 год" in row_text and not found_budget_normal:
+                        # Проверяем, что это действительно обычный бюджетник
+                        if not any(word in row_text for word in ["максимальный", "плюс"]):
+                            price = extract_number_from_cell(cells[-1].text)
+                            if price != "❌":
+                                budget = price
+                                found_budget_normal = True
 
-    def extract_all_tax_representative_prices(pdf_path):
-        """Извлекает все цены налогового представителя из PDF с учетом регрессивных шкал"""
-        text = extract_text_from_pdf(pdf_path)
-        if not text:
-            return {}
+        # ===== ТАБЛИЦА 5: Общий (индекс 4) =====
+        if len(tables) >= 5:
+            table = tables[4]  # Пятая таблица (индекс 4)
+            rows = list(table.rows)
 
-        regression_zones = extract_regression_zones(text)
+            common_index = 0
+            for row in rows:
+                cells = row.cells
+                if len(cells) >= 7:
+                    row_text = ' '.join([c.text.lower() for c in cells])
 
-        if not regression_zones:
-            pass
+                    # Ищем строки с "Общий" (без плюс) и "1 год"
+                    if "общий" in row_text and "плюс" not in row_text and "1 год" in row_text:
+                        # Определяем количество абонентов
+                        if "1+4" in row_text and common_index == 0:
+                            price = extract_number_from_cell(cells[-1].text)
+                            if price != "❌":
+                                common_prices[0] = price
+                                common_index += 1
+                        elif "1+9" in row_text and common_index <= 1:
+                            price = extract_number_from_cell(cells[-1].text)
+                            if price != "❌":
+                                common_prices[1] = price
+                                common_index += 1
+                        elif "1+19" in row_text and common_index <= 2:
+                            price = extract_number_from_cell(cells[-1].text)
+                            if price != "❌":
+                                common_prices[2] = price
+                                common_index += 1
+                        elif "1+49" in row_text and common_index <= 3:
+                            price = extract_number_from_cell(cells[-1].text)
+                            if price != "❌":
+                                common_prices[3] = price
+                                common_index += 1
+                        elif "1+99" in row_text and common_index <= 4:
+                            price = extract_number_from_cell(cells[-1].text)
+                            if price != "❌":
+                                common_prices[4] = price
+                                common_index += 1
+                        elif "1+199" in row_text and common_index <= 5:
+                            price = extract_number_from_cell(cells[-1].text)
+                            if price != "❌":
+                                common_prices[5] = price
+                                common_index += 1
+                        elif "1+499" in row_text and common_index <= 6:
+                            price = extract_number_from_cell(cells[-1].text)
+                            if price != "❌":
+                                common_prices[6] = price
+                                common_index += 1
 
-        lines = text.split('\n')
-        prices_dict = {}
+        # ===== ТАБЛИЦА 6: Общий плюс (индекс 5) =====
+        if len(tables) >= 6:
+            table = tables[5]  # Шестая таблица (индекс 5)
+            rows = list(table.rows)
 
-        # Список всех настоящих кодов регионов
-        real_region_codes = [str(i).zfill(2) for i in range(1, 96)]
-        real_region_codes += ['77', '78', '79', '83', '86', '87', '89', '90', '91', '92', '93', '94', '95', '99']
+            common_plus_index = 0
+            for row in rows:
+                cells = row.cells
+                if len(cells) >= 7:
+                    row_text = ' '.join([c.text.lower() for c in cells])
 
-        # Объединяем строки для каждого региона
-        current_region = ""
-        combined_text = ""
+                    # Ищем строки с "Общий плюс" и "1 год"
+                    if "общий плюс" in row_text and "1 год" in row_text:
+                        # Определяем количество абонентов
+                        if "1+4" in row_text and common_plus_index == 0:
+                            price = extract_number_from_cell(cells[-1].text)
+                            if price != "❌":
+                                common_plus_prices[0] = price
+                                common_plus_index += 1
+                        elif "1+9" in row_text and common_plus_index <= 1:
+                            price = extract_number_from_cell(cells[-1].text)
+                            if price != "❌":
+                                common_plus_prices[1] = price
+                                common_plus_index += 1
+                        elif "1+19" in row_text and common_plus_index <= 2:
+                            price = extract_number_from_cell(cells[-1].text)
+                            if price != "❌":
+                                common_plus_prices[2] = price
+                                common_plus_index += 1
+                        elif "1+49" in row_text and common_plus_index <= 3:
+                            price = extract_number_from_cell(cells[-1].text)
+                            if price != "❌":
+                                common_plus_prices[3] = price
+                                common_plus_index += 1
+                        elif "1+99" in row_text and common_plus_index <= 4:
+                            price = extract_number_from_cell(cells[-1].text)
+                            if price != "❌":
+                                common_plus_prices[4] = price
+                                common_plus_index += 1
+                        elif "1+199" in row_text and common_plus_index <= 5:
+                            price = extract_number_from_cell(cells[-1].text)
+                            if price != "❌":
+                                common_plus_prices[5] = price
+                                common_plus_index += 1
+                        elif "1+499" in row_text and common_plus_index <= 6:
+                            price = extract_number_from_cell(cells[-1].text)
+                            if price != "❌":
+                                common_plus_prices[6] = price
+                                common_plus_index += 1
+
+        # Формируем результат в нужном порядке
+        result = [
+            ip_usn,           # колонка 3: ИП (УСН)
+            ip_osno,          # колонка 4: ИП (ОСНО)
+            ul_usn,           # колонка 5: ЮЛ (УСН)
+            ul_osno,          # колонка 6: ЮЛ (ОСНО)
+            budget_plus,      # колонка 7: Бюджетник плюс
+            budget,           # колонка 8: Обычный Бюджетник (или ❌ если нет)
+            common_prices[0], # колонка 9: 1+4
+            common_prices[1], # колонка 10: 1+9
+            common_prices[2], # колонка 11: 1+19
+            common_prices[3], # колонка 12: 1+49
+            common_prices[4], # колонка 13: 1+99
+            common_prices[5], # колонка 14: 1+199
+            common_prices[6], # колонка 15: 1+499
+            common_plus_prices[0], # колонка 16: 1+4 плюс
+            common_plus_prices[1], # колонка 17: 1+9 плюс
+            common_plus_prices[2], # колонка 18: 1+19 плюс
+            common_plus_prices[3], # колонка 19: 1+49 плюс
+            common_plus_prices[4], # колонка 20: 1+99 плюс
+            common_plus_prices[5], # колонка 21: 1+199 плюс
+            common_plus_prices[6]  # колонка 22: 1+499 плюс
+        ]
 
-        for line in lines:
-            line_clean = line.strip()
-            if not line_clean:
+        return result
+
+    except Exception:
+        import traceback
+        traceback.print_exc()
+        return ["❌"] * 22
+
+# === ПОТОКОВОЕ ЧТЕНИЕ ТАБЛИЦ .DOCX ===
+# Вместо объектной модели python-docx word/document.xml читается через lxml.iterparse по одной
+# строке: текст ячеек считается один раз, объединенные ячейки повторяются так же, как в row.cells,
+# обработанные строки сразу освобождаются. Чтение прекращается, как только найдены все 20 значений.
+# extract_from_docx_by_structure оставлена для сравнения (--bench-docx)
+W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+W_BODY = W_NS + "body"
+W_TBL = W_NS + "tbl"
+W_TBL_GRID = W_NS + "tblGrid"
+W_GRID_COL = W_NS + "gridCol"
+W_TR = W_NS + "tr"
+W_TC = W_NS + "tc"
+W_TC_PR = W_NS + "tcPr"
+W_GRID_SPAN = W_NS + "gridSpan"
+W_V_MERGE = W_NS + "vMerge"
+W_P = W_NS + "p"
+W_R = W_NS + "r"
+W_HYPERLINK = W_NS + "hyperlink"
+W_T = W_NS + "t"
+W_TAB = W_NS + "tab"
+W_PTAB = W_NS + "ptab"
+W_BR = W_NS + "br"
+W_CR = W_NS + "cr"
+W_NO_BREAK_HYPHEN = W_NS + "noBreakHyphen"
+W_VAL = W_NS + "val"
+W_TYPE = W_NS + "type"
+
+# Таблицы документа, в которых ищутся цены (см. extract_prices_from_tables)
+PRICE_TABLES = {0, 2, 4, 5}
+COMMON_KEYS = ["1+4", "1+9", "1+19", "1+49", "1+99", "1+199", "1+499"]
+
+def docx_paragraph_text(p):
+    """Текст абзаца по тем же правилам, что paragraph.text в python-docx"""
+    parts = []
+    for child in p.iterchildren(W_R, W_HYPERLINK):
+        runs = [child] if child.tag == W_R else child.iterchildren(W_R)
+        for run in runs:
+            for item in run.iterchildren(W_T, W_TAB, W_PTAB, W_BR, W_CR, W_NO_BREAK_HYPHEN):
+                tag = item.tag
+                if tag == W_T:
+                    parts.append(item.text or "")
+                elif tag == W_BR:
+                    parts.append("\n" if item.get(W_TYPE, "textWrapping") == "textWrapping" else "")
+                elif tag == W_CR:
+                    parts.append("\n")
+                elif tag == W_NO_BREAK_HYPHEN:
+                    parts.append("-")
+                else:
+                    parts.append("\t")
+    return "".join(parts)
+
+def iter_docx_rows(filepath, wanted_tables=None):
+    """
+    Потоково выдает строки таблиц верхнего уровня .docx: (номер таблицы, тексты ячеек).
+    Ячейки разложены по колонкам сетки, как row.cells в python-docx
+    """
+    from lxml import etree
+
+    last_table = max(wanted_tables) if wanted_tables else None
+    with zipfile.ZipFile(filepath) as archive, archive.open("word/document.xml") as xml:
+        table_index = -1
+        depth = 0
+        wanted = False
+        col_count = 0
+        flat = []
+        row_count = 0
+        emitted = 0
+
+        for event, elem in etree.iterparse(xml, events=("start", "end"), tag=(W_TBL, W_TBL_GRID, W_TR, W_TC)):
+            tag = elem.tag
+            if tag == W_TBL:
+                if event == "start":
+                    depth += 1
+                    if depth == 1:
+                        wanted = False
+                        if elem.getparent() is not None and elem.getparent().tag == W_BODY:
+                            table_index += 1
+                            if last_table is not None and table_index > last_table:
+                                return
+                            wanted = wanted_tables is None or table_index in wanted_tables
+                            col_count, flat, row_count, emitted = 0, [], 0, 0
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        if wanted:
+                            # Строки, не заполнившие сетку целиком, python-docx отдает укороченными
+                            while emitted < row_count:
+                                yield table_index, flat[emitted * col_count:(emitted + 1) * col_count]
+                                emitted += 1
+                        elem.clear()
+                        while elem.getprevious() is not None:
+                            del elem.getparent()[0]
                 continue
 
-            # Строгая проверка: строка должна начинаться с настоящего кода региона и содержать название
-            is_region_line = False
-            for region_code in real_region_codes:
-                if (line_clean.startswith(region_code + ' ') and
-                    len(line_clean) > 10 and
-                    any(char.isalpha() for char in line_clean[3:10])):
-                    is_region_line = True
-                    break
+            if event != "end" or depth != 1 or not wanted:
+                continue
 
-            if is_region_line:
-                if current_region and combined_text:
-                    process_tax_region_with_zones(current_region, combined_text, prices_dict, real_region_codes, regression_zones)
+            if tag == W_TBL_GRID:
+                col_count = len(elem.findall(W_GRID_COL))
+            elif tag == W_TC and elem.getparent().tag == W_TR:
+                span = 1
+                continues = False
+                tc_pr = elem.find(W_TC_PR)
+                if tc_pr is not None:
+                    grid_span = tc_pr.find(W_GRID_SPAN)
+                    if grid_span is not None:
+                        span = int(grid_span.get(W_VAL, 1))
+                    v_merge = tc_pr.find(W_V_MERGE)
+                    continues = v_merge is not None and v_merge.get(W_VAL, "continue") == "continue"
+                for span_index in range(span):
+                    if continues:
+                        flat.append(flat[-col_count] if col_count and len(flat) >= col_count else "")
+                    elif span_index > 0:
+                        flat.append(flat[-1])
+                    else:
+                        flat.append("\n".join(docx_paragraph_text(p) for p in elem.iterchildren(W_P)))
+            elif tag == W_TR:
+                row_count += 1
+                while col_count and emitted < row_count and len(flat) >= (emitted + 1) * col_count:
+                    yield table_index, flat[emitted * col_count:(emitted + 1) * col_count]
+                    emitted += 1
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+
+def iter_word_rows(filepath, wanted_tables=None):
+    """Строки таблиц Word файла: .docx - потоково, .doc - встроенным читателем, при неудаче - через LibreOffice"""
+    file_ext = os.path.splitext(filepath)[1].lower()
+    if file_ext == '.doc':
+        try:
+            tables = read_doc_tables(filepath)
+        except Exception as e:
+            logging.info(f"Файл {os.path.basename(filepath)} не прочитан напрямую ({str(e)}), конвертируем через LibreOffice")
+            converted_path = convert_doc_to_docx(filepath)
+            return iter_docx_rows(converted_path, wanted_tables) if converted_path else iter(())
+        return iter_table_rows(tables, wanted_tables)
+    if file_ext == '.docx':
+        return iter_docx_rows(filepath, wanted_tables)
+    return iter(())
+
+def iter_table_rows(tables, wanted_tables=None):
+    """Строки уже прочитанных таблиц в том же виде, что iter_word_rows"""
+    return (
+        (index, [cell.text for cell in row.cells])
+        for index, table in enumerate(tables)
+        if wanted_tables is None or index in wanted_tables
+        for row in table.rows
+    )
 
-                current_region = line_clean.split()[0] if line_clean.split() else ""
-                combined_text = line_clean
-            else:
-                if current_region:
-                    combined_text += " " + line_clean
-
-        if current_region and combined_text:
-            process_tax_region_with_zones(current_region, combined_text, prices_dict, real_region_codes, regression_zones)
-
-        return prices_dict
-
-    def extract_regression_zones(text):
-        """Извлекает данные регрессивных шкал из текста PDF"""
-        zones = {}
-
-        lines = text.split('\n')
-
-        # Создаем структуры для всех зон
-        all_zones = ['1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11', '12']
-        for zone in all_zones:
-            zones[zone] = {}
-
-        zone_headers = ['1', '2', '3', '5', '6', '7', '8', '9', '11', '12']
-
-        for i, line in enumerate(lines):
-            line_clean = line.strip()
-
-            if "До 199" in line_clean or "До 192" in line_clean:
-                all_numbers = re.findall(r'\b(\d{2,3})\b', line_clean)
-                prices = all_numbers[1:] if len(all_numbers) > 1 else []
-
-                if len(prices) >= len(zone_headers):
-                    for j, price_str in enumerate(prices):
-                        if j < len(zone_headers):
-                            # ОЧИЩАЕМ от нецифровых символов
-                            clean_str = re.sub(r'[^\d]', '', price_str)
-                            if clean_str.isdigit():
-                                zone_num = zone_headers[j]
-                                zones[zone_num]["до_199"] = int(clean_str)
-
-            elif "От 200 до 499" in line_clean:
-                parts = line_clean.split("499")
-                if len(parts) > 1:
-                    prices_part = parts[1]
-                    prices = re.findall(r'\b(\d{2,3})\b', prices_part)
-
-                    if len(prices) >= len(zone_headers):
-                        for j, price_str in enumerate(prices):
-                            if j < len(zone_headers):
-                                # ОЧИЩАЕМ от нецифровых символов
-                                clean_str = re.sub(r'[^\d]', '', price_str)
-                                if clean_str.isdigit():
-                                    zone_num = zone_headers[j]
-                                    zones[zone_num]["от_200_до_499"] = int(clean_str)
-
-            elif "От 500 до 999" in line_clean:
-                parts = line_clean.split("999")
-                if len(parts) > 1:
-                    prices_part = parts[1]
-                    prices = re.findall(r'\b(\d{2,3})\b', prices_part)
-
-                    if len(prices) >= len(zone_headers):
-                        for j, price_str in enumerate(prices):
-                            if j < len(zone_headers):
-                                # ОЧИЩАЕМ от нецифровых символов
-                                clean_str = re.sub(r'[^\d]', '', price_str)
-                                if clean_str.isdigit():
-                                    zone_num = zone_headers[j]
-                                    zones[zone_num]["от_500_до_999"] = int(clean_str)
-
-            elif "От 1000 до 1999" in line_clean:
-                parts = line_clean.split("1999")
-                if len(parts) > 1:
-                    prices_part = parts[1]
-                    prices = re.findall(r'\b(\d{2,3})\b', prices_part)
-
-                    if len(prices) >= len(zone_headers):
-                        for j, price_str in enumerate(prices):
-                            if j < len(zone_headers):
-                                # ОЧИЩАЕМ от нецифровых символов
-                                clean_str = re.sub(r'[^\d]', '', price_str)
-                                if clean_str.isdigit():
-                                    zone_num = zone_headers[j]
-                                    zones[zone_num]["от_1000_до_1999"] = int(clean_str)
-
-            elif "От 2000" in line_clean and "От 2000 до" not in line_clean:
-                parts = line_clean.split("2000")
-                if len(parts) > 1:
-                    prices_part = parts[1]
-                    prices = re.findall(r'\b(\d{2,3})\b', prices_part)
-
-                    if len(prices) >= len(zone_headers):
-                        for j, price_str in enumerate(prices):
-                            if j < len(zone_headers):
-                                # ОЧИЩАЕМ от нецифровых символов
-                                clean_str = re.sub(r'[^\d]', '', price_str)
-                                if clean_str.isdigit():
-                                    zone_num = zone_headers[j]
-                                    zones[zone_num]["от_2000"] = int(clean_str)
-
-        # ПАРСИМ ДАННЫЕ ДЛЯ ЗОН 4 И 10 ОТДЕЛЬНО (ИЗ ДРУГОЙ ТАБЛИЦЫ)
-        for i, line in enumerate(lines):
-            line_clean = line.strip()
-
-            # Ищем данные для зон 4 и 10 с их специфичными диапазонами
-            if "До 349" in line_clean:
-                all_numbers = re.findall(r'\b(\d{2,3})\b', line_clean)
-                prices = all_numbers[1:] if len(all_numbers) > 1 else []  # Исключаем 349
-                if len(prices) >= 2:
-                    # ОЧИЩАЕМ от нецифровых символов
-                    clean_price1 = re.sub(r'[^\d]', '', prices[0])
-                    clean_price2 = re.sub(r'[^\d]', '', prices[1])
-                    if clean_price1.isdigit():
-                        zones["4"]["до_349"] = int(clean_price1)
-                    if clean_price2.isdigit():
-                        zones["10"]["до_349"] = int(clean_price2)
-
-            elif "От 350 до 599" in line_clean:
-                parts = line_clean.split("599")
-                if len(parts) > 1:
-                    prices_part = parts[1]
-                    prices = re.findall(r'\b(\d{2,3})\b', prices_part)
-                    if len(prices) >= 2:
-                        # ОЧИЩАЕМ от нецифровых символов
-                        clean_price1 = re.sub(r'[^\d]', '', prices[0])
-                        clean_price2 = re.sub(r'[^\d]', '', prices[1])
-                        if clean_price1.isdigit():
-                            zones["4"]["от_350_до_599"] = int(clean_price1)
-                        if clean_price2.isdigit():
-                            zones["10"]["от_350_до_599"] = int(clean_price2)
-
-            elif "От 600 до 999" in line_clean:
-                parts = line_clean.split("999")
-                if len(parts) > 1:
-                    prices_part = parts[1]
-                    prices = re.findall(r'\b(\d{2,3})\b', prices_part)
-                    if len(prices) >= 2:
-                        # ОЧИЩАЕМ от нецифровых символов
-                        clean_price1 = re.sub(r'[^\d]', '', prices[0])
-                        clean_price2 = re.sub(r'[^\d]', '', prices[1])
-                        if clean_price1.isdigit():
-                            zones["4"]["от_600_до_999"] = int(clean_price1)
-                        if clean_price2.isdigit():
-                            zones["10"]["от_600_до_999"] = int(clean_price2)
-
-            # Строка "От 1000" для зон 4 и 10 (у них только один диапазон "от 1000")
-            elif "От 1000" in line_clean:
-                parts = line_clean.split()
-                for idx, part in enumerate(parts):
-                    if part == "1000" and idx + 2 < len(parts):
-                        # ОЧИЩАЕМ от нецифровых символов
-                        clean_price1 = re.sub(r'[^\d]', '', parts[idx + 1])
-                        clean_price2 = re.sub(r'[^\d]', '', parts[idx + 2])
-                        if clean_price1.isdigit():
-                            zones["4"]["от_1000"] = int(clean_price1)
-                        if clean_price2.isdigit():
-                            zones["10"]["от_1000"] = int(clean_price2)
-                        break
-
-        return zones
-
-    def process_tax_region_with_zones(region_code, text, prices_dict, real_region_codes, regression_zones):
-        """Обрабатывает один регион с учетом регрессивных шкал"""
-        if region_code not in real_region_codes:
+class PriceRowMatcher:
+    """
+    Правила поиска цен из extract_prices_from_tables, применяемые к одной готовой строке:
+    текст строки в нижнем регистре собирается один раз, число из последней ячейки - только
+    для подходящей строки. feed() возвращает True, когда дальше читать документ не нужно
+    """
+
+    def __init__(self):
+        self.main = {"ip_usn": "❌", "ip_osno": "❌", "ul_usn": "❌", "ul_osno": "❌"}
+        self.budget_plus = "❌"
+        self.budget = "❌"
+        self.common = ["❌"] * 7
+        self.common_plus = ["❌"] * 7
+        self.common_index = 0
+        self.common_plus_index = 0
+
+    def feed(self, table_index, cells):
+        if table_index > 5:
+            return True
+        if table_index == 0 and len(cells) >= 8:
+            self._optimal_plus(' '.join([text.lower() for text in cells]), cells[-1])
+        elif table_index == 2 and len(cells) >= 6:
+            self._budget(' '.join([text.lower() for text in cells]), cells[-1])
+        elif table_index == 4 and len(cells) >= 7:
+            row_text = ' '.join([text.lower() for text in cells])
+            if "общий" in row_text and "плюс" not in row_text and "1 год" in row_text:
+                self.common_index = self._common(row_text, cells[-1], self.common, self.common_index)
+        elif table_index == 5 and len(cells) >= 7:
+            row_text = ' '.join([text.lower() for text in cells])
+            if "общий плюс" in row_text and "1 год" in row_text:
+                self.common_plus_index = self._common(row_text, cells[-1], self.common_plus, self.common_plus_index)
+                return "❌" not in self.result()
+        return False
+
+    def _optimal_plus(self, row_text, last_cell):
+        if "оптимальный плюс" not in row_text or "1 год" not in row_text:
             return
-
-        # ВАЖНО: Если регион уже обработан, не перезаписываем!
-        if region_code in prices_dict:
+        if "ип" in row_text:
+            prefix = "ip"
+        elif "юл" in row_text:
+            prefix = "ul"
+        else:
             return
+        if "усн" in row_text or "специальная" in row_text:
+            key = f"{prefix}_usn"
+        elif "общая" in row_text or "осно" in row_text or "смешанная" in row_text:
+            key = f"{prefix}_osno"
+        else:
+            return
+        price = extract_number_from_cell(last_cell)
+        if price != "❌":
+            self.main[key] = price
 
-        zone_match = re.search(r'(\d{1,2})(?=\s+\d+\s+\d+\s+\d+\s+\d+)', text)
-        zone_number = None
-
-        if zone_match:
-            zone_number = zone_match.group(1)
+    def _budget(self, row_text, last_cell):
+        if "максимальный" in row_text:
+            return
+        if "бюджетник плюс" in row_text and "1 год" in row_text and self.budget_plus == "❌":
+            price = extract_number_from_cell(last_cell)
+            if price != "❌":
+                self.budget_plus = price
+        elif "бюджетник" in row_text and "плюс" not in row_text and "1 год" in row_text and self.budget == "❌":
+            price = extract_number_from_cell(last_cell)
+            if price != "❌":
+                self.budget = price
+
+    def _common(self, row_text, last_cell, prices, index):
+        # Как цепочка if/elif в extract_prices_from_tables: срабатывает первая подходящая ветка
+        for position, key in enumerate(COMMON_KEYS):
+            if key in row_text and (index == 0 if position == 0 else index <= position):
+                price = extract_number_from_cell(last_cell)
+                if price != "❌":
+                    prices[position] = price
+                    index += 1
+                break
+        return index
+
+    def result(self):
+        return [
+            self.main["ip_usn"], self.main["ip_osno"], self.main["ul_usn"], self.main["ul_osno"],
+            self.budget_plus, self.budget
+        ] + self.common + self.common_plus
+
+def extract_prices_streaming(filepath, tables=None):
+    """
+    Те же 20 значений, что extract_prices_from_tables, но за один проход по строкам с ранним выходом.
+    tables - уже прочитанные таблицы .doc, тогда файл повторно не читается
+    """
+    try:
+        matcher = PriceRowMatcher()
+        if tables is not None:
+            rows = iter_table_rows(tables, PRICE_TABLES)
         else:
-            numbers = re.findall(r'\b(\d{1,2})\b', text)
-            for num in numbers:
-                if num in ['1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11', '12']:
-                    zone_number = num
+            rows = iter_word_rows(filepath, PRICE_TABLES)
+        try:
+            for table_index, cells in rows:
+                if matcher.feed(table_index, cells):
                     break
-
-        tax_data = {
-            "zone": zone_number,
-            "base_price": None,
-            "regression_prices": {}
-        }
-
-        # Ищем паттерн: текст между "Право" и "Услуги"
-        right_pattern = r'Право\s+(.*?)\s+Услуги'
-        right_match = re.search(right_pattern, text)
-
-        if right_match:
-            right_text = right_match.group(1)
-            # Находим все цены
-            prices = re.findall(r'(\d[\d\s]*,\d+)', right_text)
-
-            # Четвёртая цена (индекс 3) = итоговая за 12 месяцев
-            if len(prices) >= 4:
-                tax_price_str = prices[3].replace(' ', '').replace(',', '.')
-
-                try:
-                    tax_price = float(tax_price_str)
-
-                    # ФИЛЬТР: Базовый имеет цены в диапазоне 6500-17000
-                    if 6500 <= tax_price <= 17000:
-                        tax_data["base_price"] = tax_price
-
-                        if zone_number and zone_number in regression_zones:
-                            tax_data["regression_prices"] = regression_zones[zone_number]
-
-                        prices_dict[region_code] = tax_data
-                except ValueError:
-                    pass
-
+        finally:
+            if hasattr(rows, "close"):
+                rows.close()
+        return matcher.result()
+    except Exception as e:
+        logging.error(f"Ошибка разбора {os.path.basename(filepath)}: {str(e)}")
+        return ["❌"] * 20
+
+def bench_docx(paths, repeat=5):
+    """Сравнение python-docx (extract_from_docx_by_structure) и потокового чтения на файлах .docx"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(str(p) for p in Path(path).glob("*.docx")))
+        else:
+            files.append(path)
+    if not files:
+        print("Укажите файлы .docx или папку с ними: --bench-docx <путь> [...]")
         return
 
-    def extract_all_start_online_prices(pdf_path):
-        """Извлекает все цены Стартовый онлайн из PDF"""
-        text = extract_text_from_pdf(pdf_path)
-        if not text:
-            return {}
-
-        lines = text.split('\n')
-        prices_dict = {}
-
-        current_region = ""
-        current_text = ""
-
-        for i, line in enumerate(lines):
-            line = line.strip()
-            if not line:
-                continue
+    total_legacy = total_streaming = 0.0
+    for path in files:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            legacy = extract_from_docx_by_structure(path)
+        legacy_time = (time.perf_counter() - started) / repeat
+
+        started = time.perf_counter()
+        for _ in range(repeat):
+            streaming = extract_prices_streaming(path)
+        streaming_time = (time.perf_counter() - started) / repeat
+
+        total_legacy += legacy_time
+        total_streaming += streaming_time
+        same = "совпадает" if legacy[:20] == streaming else "РАЗЛИЧАЕТСЯ"
+        print(f"{os.path.basename(path)}: python-docx {legacy_time * 1000:.1f} мс, "
+              f"потоково {streaming_time * 1000:.1f} мс, результат {same}")
+
+    print(f"Итого по {len(files)} файлам: python-docx {total_legacy * 1000:.1f} мс, "
+          f"потоково {total_streaming * 1000:.1f} мс (x{total_legacy / max(total_streaming, 1e-9):.1f})")
+
+# === РАЗБОР PDF ===
+# Функции разбора общих PDF прайс-листов находятся в kontur_pdf.py
+
+def bench_tax(pdf_path, repeat=20):
+    """Сравнение прежнего и однопроходного разбора текста налогового представителя"""
+    if not pdf_path or not os.path.isfile(pdf_path):
+        print("Укажите PDF прайс-лист налоговых представителей: --bench-tax <файл.pdf>")
+        return
+    text = extract_text_from_pdf(pdf_path)
+    print(f"{os.path.basename(pdf_path)}: {len(text)} символов, {text.count(chr(10)) + 1} строк")
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        legacy = parse_tax_representative_text_legacy(text)
+    legacy_time = (time.perf_counter() - started) / repeat
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        tokenized = parse_tax_representative_text(text)
+    tokenized_time = (time.perf_counter() - started) / repeat
+
+    same = "совпадает" if legacy == tokenized else "РАЗЛИЧАЕТСЯ"
+    print(f"Прежний разбор {legacy_time * 1000:.2f} мс, за один проход {tokenized_time * 1000:.2f} мс "
+          f"(x{legacy_time / max(tokenized_time, 1e-9):.1f}), регионов {len(tokenized)}, результат {same}")
+
+# === ПАРАЛЛЕЛЬНЫЙ РАЗБОР PDF ===
+# Три общих PDF разбираются независимо друг от друга в отдельных процессах (PyPDF2 и регулярные
+# выражения упираются в процессор и GIL), пока браузер уже обходит регионы за Word файлами.
+# Процессы запускаются методом spawn: форк процесса с потоками браузеров и HTTP-клиента небезопасен
+
+pdf_executor = None
+pdf_executor_lock = threading.RLock()
+
+def get_pdf_executor():
+    """Пул процессов создается при первом разборе и живет до остановки бота"""
+    global pdf_executor
+    with pdf_executor_lock:
+        if pdf_executor is None:
+            pdf_executor = ProcessPoolExecutor(
+                max_workers=KONTUR_PDF_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_pdf_worker,
+                initargs=(LOG_FILE_NAME,)
+            )
+        return pdf_executor
+
+@contextmanager
+def main_script_hidden():
+    """
+    Новый процесс spawn по умолчанию заново выполняет главный скрипт под именем __mp_main__.
+    Пока запускаются процессы разбора, скрипт помечен как модуль "__main__" без пути -
+    такой модуль multiprocessing в процессе не загружает, и процесс импортирует только kontur_pdf
+    """
+    main = sys.modules['__main__']
+    saved = main.__spec__
+    main.__spec__ = importlib.machinery.ModuleSpec('__main__', None)
+    try:
+        yield
+    finally:
+        main.__spec__ = saved
+
+def submit_pdf_job(func, *args):
+    """Ставит задание в пул разбора PDF (процессы пул запускает при постановке заданий)"""
+    with pdf_executor_lock, main_script_hidden():
+        return get_pdf_executor().submit(func, *args)
+
+def warm_pdf_executor():
+    """Запускает процессы заранее: импорт модулей в новом процессе занимает несколько секунд"""
+    for future in [submit_pdf_job(os.getpid) for _ in range(KONTUR_PDF_PROCESSES)]:
+        future.result()
+
+def close_pdf_executor():
+    global pdf_executor
+    with pdf_executor_lock:
+        if pdf_executor is not None:
+            pdf_executor.shutdown(wait=True, cancel_futures=True)
+            pdf_executor = None
+
+def resolve_pdf_job(job, futures, parsers, content_hash):
+    """Раздает результат задания по Future отдельных разборщиков и сохраняет его в кэш"""
+    try:
+        results = job.result()
+    except Exception as e:
+        for parser in parsers:
+            futures[parser].set_exception(e)
+        return
+    for parser in parsers:
+        try:
+            parse_cache_put(parser, content_hash, results[parser])
+        except Exception as e:
+            logging.error(f"Кэш разбора: не удалось сохранить {parser}: {str(e)}")
+        futures[parser].set_result(results[parser])
+
+def submit_pdf_extraction(pdf_files):
+    """
+    Ставит разбор PDF в пул процессов. pdf_files: {разборщик: путь или None}.
+    Возвращает {разборщик: Future} со словарем "код региона → значения"
+    """
+    futures = {}
+    jobs = {}
+    for parser, path in pdf_files.items():
+        futures[parser] = Future()
+        if not path:
+            futures[parser].set_result({})
+            continue
+        content_hash = file_sha256(path)
+        cached = parse_cache_get(parser, content_hash, path)
+        if cached is not None:
+            futures[parser].set_result(cached)
+        else:
+            jobs.setdefault((path, content_hash), []).append(parser)
 
-            if re.match(r'^\d{2}', line):
-                if current_region and current_text:
-                    process_region_for_start_online_improved(current_region, current_text, prices_dict)
+    for (path, content_hash), parsers in jobs.items():
+        try:
+            job = submit_pdf_job(run_pdf_extractors, path, parsers)
+        except Exception as e:
+            logging.error(f"Контур: не удалось запустить процесс разбора PDF: {str(e)}")
+            job = Future()
+            job.set_exception(e)
+        job.add_done_callback(functools.partial(
+            resolve_pdf_job, futures=futures, parsers=parsers, content_hash=content_hash
+        ))
+    return futures
+
+def collect_pdf_results(futures, pdf_files):
+    """Дожидается разбора PDF; если процесс упал, файл разбирается здесь же"""
+    results = {}
+    for parser, future in futures.items():
+        try:
+            results[parser] = future.result()
+        except Exception as e:
+            logging.error(f"Контур: разбор {parser} в отдельном процессе не удался, разбираем здесь: {str(e)}")
+            try:
+                results[parser] = cached_parse(parser, PDF_EXTRACTORS[parser], pdf_files[parser])
+            finally:
+                release_pdf_indexes()
+    return results
 
-                current_region = line.split()[0] if line.split() else ""
-                current_text = line
-            else:
-                if current_region:
-                    current_text += " " + line
+# === СТАРЫЕ ФУНКЦИИ ДЛЯ WORD (БОЛЬШЕ НЕ ИСПОЛЬЗУЕМ, НО ОСТАВЛЯЕМ ДЛЯ СОВМЕСТИМОСТИ) ===
+# Они заменены на новые выше, но оставляем чтобы не ломать код
 
-        if current_region and current_text:
-            process_region_for_start_online_improved(current_region, current_text, prices_dict)
+def extract_price_from_text(text):
+    """Извлекает цену из текста"""
+    if not text:
+        return "❌"
 
-        return prices_dict
+    cleaned = re.sub(r'[^\d\s]', '', str(text))
+    cleaned = cleaned.replace(' ', '')
 
-    def process_region_for_start_online_improved(region_code, text, prices_dict):
-        """Обрабатывает текст региона для извлечения цен Стартовый онлайн"""
+    if cleaned and cleaned.isdigit():
+        return int(cleaned)
 
-        # Ищем все пары чисел в формате "число1 – число2" где число2 - итоговая цена
-        pattern = r'(\d[\d\s,\.]*)\s*–\s*(\d[\d\s,\.]+)'
-        matches = re.findall(pattern, text)
+    return "❌"
 
-        prices = []
+def extract_common_prices_universal(filepath):
+    """Универсальное извлечение тарифов 'Общий' и 'Общий плюс' из Word файлов"""
+    try:
+        # Таблицы .docx или .doc (при необходимости - через конвертацию)
+        tables = load_word_tables(filepath)
+        if tables is None:
+            return ["❌"] * 14
 
-        for base_price, final_price in matches:
-            # Очищаем итоговую цену (второе число после тире)
-            clean_price = final_price.replace(' ', '').replace(',', '').replace('\xa0', '').strip()
+        # Основная логика извлечения
+        target_keys = ["1+4", "1+9", "1+19", "1+49", "1+99", "1+199", "1+499"]
 
-            # Число приходит с копейками: "4 800,00" -> "480000"
-            # Делим на 100 чтобы получить правильную цену
-            if clean_price.isdigit() and len(clean_price) >= 5:
-                price = int(clean_price) // 100
+        common_prices = {key: "❌" for key in target_keys}
+        common_plus_prices = {key: "❌" for key in target_keys}
 
-                if 3000 <= price <= 20000 and price != int(region_code):
-                    prices.append(price)
+        for table in tables:
+            for row in table.rows:
+                row_text = [cell.text.strip() for cell in row.cells]
 
-        # НЕ удаляем дубликаты! Нам нужны все 4 цены для 4 категорий
-        if len(prices) >= 4:
-            prices_dict[region_code] = prices[:4]
-        else:
-            alternative_prices = extract_start_online_alternative_improved(text, region_code)
-            if alternative_prices and len(alternative_prices) >= 4:
-                prices_dict[region_code] = alternative_prices
-
-    def extract_start_online_alternative_improved(text, region_code):
-        """Альтернативный метод извлечения цен Стартовый онлайн"""
-        spaced_prices = re.findall(r'(\d{1,2}\s?\d{3})', text)
-        if spaced_prices:
-            prices = []
-            for price_str in spaced_prices:
-                clean_price = int(price_str.replace(' ', ''))
-                if 3000 <= clean_price <= 20000 and clean_price != int(region_code):
-                    prices.append(clean_price)
-                    if len(prices) >= 4:
-                        break
-            if len(prices) >= 4:
-                return prices[:4]
-        return None
+                if len(row_text) >= 3:
+                    key_cell = row_text[0]
+                    common_cell = row_text[1] if len(row_text) > 1 else ""
+                    common_plus_cell = row_text[2] if len(row_text) > 2 else ""
 
-    # === СТАРЫЕ ФУНКЦИИ ДЛЯ WORD (БОЛЬШЕ НЕ ИСПОЛЬЗУЕМ, НО ОСТАВЛЯЕМ ДЛЯ СОВМЕСТИМОСТИ) ===
-    # Они заменены на новые выше, но оставляем чтобы не ломать код
+                    for key in target_keys:
+                        if key in key_cell:
+                            if common_prices[key] == "❌":
+                                common_prices[key] = clean_price(common_cell)
+                            if common_plus_prices[key] == "❌":
+                                common_plus_prices[key] = clean_price(common_plus_cell)
 
-    def extract_price_from_text(text):
-        """Извлекает цену из текста"""
-        if not text:
-            return "❌"
+        common_list = [common_prices[key] for key in target_keys]
+        common_plus_list = [common_plus_prices[key] for key in target_keys]
 
-        cleaned = re.sub(r'[^\d\s]', '', str(text))
-        cleaned = cleaned.replace(' ', '')
+        return common_list + common_plus_list
 
-        if cleaned and cleaned.isdigit():
-            return int(cleaned)
+    except Exception:
+        return ["❌"] * 14
 
+def clean_price(price_str):
+    """Очищает цену от лишних символов"""
+    if not price_str:
         return "❌"
-
-    def extract_common_prices_universal(filepath):
-        """Универсальное извлечение тарифов 'Общий' и 'Общий плюс' из Word файлов"""
+    cleaned = re.sub(r'[^\d\s]', '', price_str)
+    cleaned = cleaned.replace(' ', '')
+    if cleaned and cleaned.isdigit():
+        return int(cleaned)
+    return "❌"
+
+# === ФУНКЦИЯ ДЛЯ СКАЧИВАНИЯ ФАЙЛОВ ===
+
+# === ПРЯМОЕ СКАЧИВАНИЕ ФАЙЛОВ ПО HTTP ===
+# Ссылка на файл известна сразу после поиска на странице, поэтому файл забирается HTTP-клиентом
+# с cookies браузера, а не кликом с ожиданием в папке загрузок. Для каждого адреса запоминаются
+# ETag/Last-Modified: неизменившийся файл сервер не передает повторно (ответ 304)
+
+def http_cache_get(url):
+    """Сохраненные заголовки и путь к файлу для адреса или None"""
+    with closing(db_connect()) as connection:
+        row = connection.execute(
+            "SELECT etag, last_modified, file_path FROM http_cache WHERE url = ?", (url,)
+        ).fetchone()
+    if row is None:
+        return None
+    return {"etag": row[0], "last_modified": row[1], "file_path": row[2]}
+
+def http_cache_put(url, etag, last_modified, file_path):
+    with closing(db_connect()) as connection, connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO http_cache (url, etag, last_modified, file_path, fetched_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (url, etag, last_modified, file_path, now_str())
+        )
+
+def response_file_name(response, url):
+    """Имя файла из Content-Disposition, иначе - последняя часть адреса"""
+    disposition = response.content_disposition
+    if disposition is not None and disposition.filename:
+        return os.path.basename(disposition.filename)
+    name = os.path.basename(unquote(urlparse(url).path))
+    return name or "file"
+
+def browser_cookie_header(driver):
+    """Cookies текущей страницы браузера в виде заголовка Cookie"""
+    return "; ".join(f"{cookie['name']}={cookie['value']}" for cookie in driver.get_cookies())
+
+def write_hashed_chunk(f, digest, chunk):
+    f.write(chunk)
+    digest.update(chunk)
+
+class HttpDownloader:
+    """
+    Общий HTTP-клиент для файлов: собственный цикл событий в отдельном потоке и пул соединений aiohttp.
+    submit() возвращает concurrent.futures.Future с путем к файлу, поэтому файлы скачиваются
+    параллельно, пока браузер открывает следующие регионы. Запись на диск, хэш и запросы к базе
+    выполняются в потоках ввода-вывода, чтобы цикл событий продолжал принимать другие файлы
+    """
+
+    def __init__(self, connections):
+        self.connections = connections
+        self.loop = None
+        self.thread = None
+        self.session = None
+        self.io_executor = None
+        self.lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target=self.loop.run_forever, name="http-downloader", daemon=True)
+                self.thread.start()
+                self.io_executor = ThreadPoolExecutor(max_workers=self.connections, thread_name_prefix="http-io")
+
+    async def _io(self, func, *args):
+        """Выполняет блокирующую работу с диском или базой в потоке ввода-вывода"""
+        return await self.loop.run_in_executor(self.io_executor, functools.partial(func, *args))
+
+    @staticmethod
+    def _cached_version(url):
+        """Запись кэша HTTP для условного запроса, если сохраненный файл еще на месте"""
+        cached = http_cache_get(url)
+        return cached if cached and os.path.exists(cached["file_path"]) else None
+
+    @staticmethod
+    def _finish_file(part_path, file_path, directory, content_hash, url, etag, last_modified):
+        """Переносит докачанный файл в хранилище и запоминает его версию для условных запросов"""
+        os.replace(part_path, file_path)
+        file_path = store_file(file_path, content_hash)
         try:
-            # Определяем тип файла и конвертируем при необходимости
-            file_ext = os.path.splitext(filepath)[1].lower()
-
-            if file_ext == '.doc':
-                # Конвертируем .doc в .docx
-                converted_path = convert_doc_to_docx(filepath)
-                if not converted_path:
-                    return ["❌"] * 14
-                filepath = converted_path
-                file_ext = '.docx'
+            os.rmdir(directory)
+        except OSError:
+            pass
+        http_cache_put(url, etag, last_modified, file_path)
+        return file_path
+
+    async def _download(self, url, cookie_header, referer):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connections),
+                timeout=aiohttp.ClientTimeout(total=180),
+                headers={"User-Agent": BROWSER_USER_AGENT}
+            )
 
-            if file_ext != '.docx':
-                return ["❌"] * 14
+        headers = {}
+        if cookie_header:
+            headers["Cookie"] = cookie_header
+        if referer:
+            headers["Referer"] = referer
+
+        cached = await self._io(self._cached_version, url)
+        if cached:
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        started = time.monotonic()
+        async with self.session.get(url, headers=headers) as response:
+            if response.status == 304 and cached:
+                logging.info(f"Файл не изменился (304), берем сохраненный: {cached['file_path']}")
+                return await self._io(store_file, cached["file_path"])
+            response.raise_for_status()
+            if response.content_type == "text/html":
+                raise ValueError("вместо файла получена HTML-страница")
+
+            # Каждый адрес - в своей папке, чтобы одноименные файлы разных регионов не перезаписывали друг друга
+            directory = os.path.join(HTTP_DOWNLOAD_DIR, hashlib.sha1(url.encode()).hexdigest()[:16])
+            await self._io(functools.partial(os.makedirs, directory, exist_ok=True))
+            file_path = os.path.join(directory, response_file_name(response, url))
+            part_path = file_path + ".part"
+
+            # sha256 для хранилища считается по ходу скачивания, файл повторно не читается
+            digest = hashlib.sha256()
+            size = 0
+            f = await self._io(open, part_path, "wb")
+            try:
+                async for chunk in response.content.iter_chunked(65536):
+                    await self._io(write_hashed_chunk, f, digest, chunk)
+                    size += len(chunk)
+            finally:
+                await self._io(f.close)
+            if size <= 100:
+                await self._io(os.remove, part_path)
+                raise ValueError(f"слишком маленький файл ({size} байт)")
+            file_path = await self._io(
+                self._finish_file, part_path, file_path, directory, digest.hexdigest(),
+                url, response.headers.get("ETag"), response.headers.get("Last-Modified")
+            )
 
-            # Основная логика извлечения
-            from docx import Document
+        logging.info(f"Скачан {os.path.basename(file_path)}: {size} байт за {time.monotonic() - started:.1f} с")
+        return file_path
+
+    def submit(self, url, cookie_header=None, referer=None):
+        """Ставит файл в очередь скачивания, возвращает Future"""
+        self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(self._download(url, cookie_header, referer), self.loop)
+
+    def close(self):
+        with self.lock:
+            if self.loop is None:
+                return
+            if self.session is not None:
+                asyncio.run_coroutine_threadsafe(self.session.close(), self.loop).result(10)
+                self.session = None
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(10)
+            self.loop.close()
+            self.loop = None
+            self.io_executor.shutdown(wait=True)
+            self.io_executor = None
+
+KONTUR_DOWNLOADER = HttpDownloader(KONTUR_HTTP_CONNECTIONS)
+
+def find_download_link(driver, text):
+    """Находит на странице ссылку на файл по ее тексту (None, если не нашлась)"""
+    wait = WebDriverWait(driver, 30)
+    # Ждем полной загрузки страницы
+    wait_for("kontur.page", lambda: kontur_links_ready(driver), 3)
+
+    # Прокручиваем страницу вниз чтобы увидеть все элементы
+    driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+    wait_for("kontur.scroll_down", dom_stable(driver, 200), 2)
+    driver.execute_script("window.scrollTo(0, 0);")
+    wait_for("kontur.scroll_up", dom_stable(driver, 200), 1)
+
+    # Пробуем разные стратегии поиска ссылки
+    link = None
+    strategies = [
+        f"//a[contains(text(), '{text}')]",
+        f"//a[contains(., '{text.split('«')[0]}')]",
+        "//a[contains(@class, 'link')]",
+        f"//*[contains(text(), '{text.split()[0]}')]",
+    ]
+
+    for strategy in strategies:
+        try:
+            link = wait.until(EC.element_to_be_clickable((By.XPATH, strategy)))
+            if link:
+                break
+        except Exception:
+            continue
 
-            doc = Document(filepath)
-            target_keys = ["1+4", "1+9", "1+19", "1+49", "1+99", "1+199", "1+499"]
+    if not link:
+        all_links = driver.find_elements(By.TAG_NAME, "a")
+        for l in all_links:
+            try:
+                link_text = l.text
+                if text in link_text or any(word in link_text for word in text.split()[:2]):
+                    link = l
+                    break
+            except:
+                continue
 
-            common_prices = {key: "❌" for key in target_keys}
-            common_plus_prices = {key: "❌" for key in target_keys}
+    return link
 
-            for table in doc.tables:
-                for row in table.rows:
-                    row_text = [cell.text.strip() for cell in row.cells]
+def start_download_by_text(driver, text):
+    """Находит ссылку и ставит файл в очередь прямого HTTP-скачивания. Возвращает Future или None"""
+    if KONTUR_DOWNLOAD_MODE != "http":
+        return None
+    try:
+        link = find_download_link(driver, text)
+        file_url = link.get_attribute('href') if link else None
+        if not file_url:
+            return None
+        return KONTUR_DOWNLOADER.submit(file_url, browser_cookie_header(driver), driver.current_url)
+    except Exception as e:
+        logging.info(f"Контур: не удалось поставить в очередь скачивание '{text}': {str(e)}")
+        return None
 
-                    if len(row_text) >= 3:
-                        key_cell = row_text[0]
-                        common_cell = row_text[1] if len(row_text) > 1 else ""
-                        common_plus_cell = row_text[2] if len(row_text) > 2 else ""
+def download_result(future, label, timeout=180):
+    """Путь к файлу из Future прямого скачивания или None, если скачать не удалось"""
+    if future is None:
+        return None
+    try:
+        return wait_future(future, timeout)
+    except Exception as e:
+        logging.info(f"Контур: прямое скачивание ({label}) не удалось, скачаем через браузер: {str(e)}")
+        return None
 
-                        for key in target_keys:
-                            if key in key_cell:
-                                if common_prices[key] == "❌":
-                                    common_prices[key] = clean_price(common_cell)
-                                if common_plus_prices[key] == "❌":
-                                    common_plus_prices[key] = clean_price(common_plus_cell)
+def download_file_by_text(driver, text, label="file"):
+    """Скачивание файла кликом по ссылке в браузере (запасной путь и режим browser)"""
+    download_dir = None
+    try:
+        link = find_download_link(driver, text)
+        if not link:
+            return None
 
-            common_list = [common_prices[key] for key in target_keys]
-            common_plus_list = [common_plus_prices[key] for key in target_keys]
+        # Получаем URL
+        file_url = link.get_attribute('href')
 
-            return common_list + common_plus_list
+        if not file_url:
+            return None
 
-        except Exception as e:
-            return ["❌"] * 14
+        # Прокручиваем к элементу с отступом
+        driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", link)
+        wait_for("kontur.scroll_to_link", dom_stable(driver, 200), 2)
 
-    def clean_price(price_str):
-        """Очищает цену от лишних символов"""
-        if not price_str:
-            return "❌"
-        cleaned = re.sub(r'[^\d\s]', '', price_str)
-        cleaned = cleaned.replace(' ', '')
-        if cleaned and cleaned.isdigit():
-            return int(cleaned)
-        return "❌"
+        # Выделяем элемент для визуализации
+        driver.execute_script("arguments[0].style.border='3px solid red';", link)
 
-    # === ФУНКЦИЯ ДЛЯ СКАЧИВАНИЯ ФАЙЛОВ (ОСТАВЛЯЕМ БЕЗ ИЗМЕНЕНИЙ) ===
+        # Файл скачивается в собственную папку этого запроса
+        download_dir = tempfile.mkdtemp(prefix=f"{KONTUR_DOWNLOAD_PREFIX}{label}-", dir=DOWNLOAD_DIR)
+        driver.execute_cdp_cmd("Page.setDownloadBehavior", {"behavior": "allow", "downloadPath": download_dir})
 
-    def download_file_by_text(text):
-        """Улучшенная функция скачивания файлов по тексту ссылки"""
+        # Пробуем разные методы клика
         try:
-            # Ждем полной загрузки страницы
-            time.sleep(3)
-
-            # Прокручиваем страницу вниз чтобы увидеть все элементы
-            driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-            time.sleep(2)
-            driver.execute_script("window.scrollTo(0, 0);")
-            time.sleep(1)
-
-            # Пробуем разные стратегии поиска ссылки
-            link = None
-            strategies = [
-                f"//a[contains(text(), '{text}')]",
-                f"//a[contains(., '{text.split('«')[0]}')]",
-                "//a[contains(@class, 'link')]",
-                f"//*[contains(text(), '{text.split()[0]}')]",
-            ]
+            link.click()
+        except:
+            try:
+                driver.execute_script("arguments[0].click();", link)
+            except:
+                from selenium.webdriver.common.action_chains import ActionChains
+                actions = ActionChains(driver)
+                actions.move_to_element(link).click().perform()
 
-            for strategy in strategies:
-                try:
-                    link = wait.until(EC.element_to_be_clickable((By.XPATH, strategy)))
-                    if link:
-                        break
-                except Exception as e:
-                    continue
-
-            if not link:
-                all_links = driver.find_elements(By.TAG_NAME, "a")
-                for l in all_links:
-                    try:
-                        link_text = l.text
-                        if text in link_text or any(word in link_text for word in text.split()[:2]):
-                            link = l
-                            break
-                    except:
-                        continue
+        # Файл возвращается сразу по завершении загрузки
+        downloaded = wait_download(download_dir, KONTUR_DOWNLOAD_TIMEOUT)
+        if not downloaded:
+            return None
+        return store_file(downloaded)
 
-            if not link:
-                return None
+    except Exception:
+        return None
+    finally:
+        # Папка dl-* удаляется и при таймауте, ошибке или отмене
+        if download_dir:
+            shutil.rmtree(download_dir, ignore_errors=True)
+
+def open_kontur_region(session, region_id):
+    """Открывает страницу прайс-листов региона и ждет появления ссылок"""
+    driver = session.driver
+    session.get(KONTUR_URL.replace("77", region_id))
+    WebDriverWait(driver, 30).until(EC.presence_of_element_located((By.TAG_NAME, "body")))
+    wait_for("kontur.region", lambda: kontur_links_ready(driver), 5)
+
+# Колонки общих PDF в таблице Контур
+NULL_COL = 23
+TAX_BASE_COL = 24
+ZONE_COL = 25
+
+# МАППИНГ ДЛЯ ПЕРВОЙ ТАБЛИЦЫ (зоны 1,2,3,5,6,7,8,9,11,12)
+REGRESSION_COLS_MAIN = {
+    'до_199': 26,
+    'от_200_до_499': 27,
+    'от_500_до_999': 28,
+    'от_1000_до_1999': 29,
+    'от_2000': 30
+}
+
+REGRESSION_COLS_4_10 = {
+    'до_349': 26,           # Для зон 4 и 10: до 349
+    'от_350_до_599': 27,    # Для зон 4 и 10: от 350 до 599
+    'от_600_до_999': 28,    # Для зон 4 и 10: от 600 до 999
+    'от_1000': 29           # Для зон 4 и 10: от 1000
+}
+
+START_COLS = [31, 32, 33, 34]
+
+def fill_kontur_pdf_columns(sink, index, region_id, pdf_prices):
+    """Записывает в строку региона значения из общих PDF"""
+    # Нулевая отчетность
+    if region_id in pdf_prices['null_prices']:
+        null_price = pdf_prices['null_prices'][region_id]
+        sink.set(index, NULL_COL, null_price)
+
+    # Налоговый представитель с регрессивными шкалами
+    if region_id in pdf_prices['tax_rep_prices']:
+        tax_data = pdf_prices['tax_rep_prices'][region_id]
+
+        if isinstance(tax_data, dict):
+            if 'base_price' in tax_data and tax_data['base_price'] is not None:
+                sink.set(index, TAX_BASE_COL, tax_data['base_price'])
+
+            if 'zone' in tax_data and tax_data['zone'] is not None:
+                sink.set(index, ZONE_COL, tax_data['zone'])
+
+            regression_prices = tax_data.get('regression_prices', {})
+            if regression_prices:
+                # Получаем номер зоны
+                zone_number = tax_data.get('zone')
+
+                # Выбираем правильный маппинг
+                if zone_number in ['4', '10']:
+                    regression_mapping = REGRESSION_COLS_4_10
+                else:
+                    regression_mapping = REGRESSION_COLS_MAIN
 
-            # Получаем URL
-            file_url = link.get_attribute('href')
+                for range_key, col_idx in regression_mapping.items():
+                    if range_key in regression_prices and regression_prices[range_key] is not None:
+                        sink.set(index, col_idx, regression_prices[range_key])
+        else:
+            sink.set(index, TAX_BASE_COL, tax_data)
+
+    # Стартовый онлайн
+    if region_id in pdf_prices['start_online_prices']:
+        prices = pdf_prices['start_online_prices'][region_id]
+        for i, price in enumerate(prices):
+            if i < len(START_COLS):
+                sink.set(index, START_COLS[i], price)
+
+def write_kontur_word_prices(sink, index, all_prices):
+    """Записывает в строку региона тарифы из его Word файла"""
+    # Распаковываем результаты (22 значения)
+    # Порядок: [ip_usn, ip_osno, ul_usn, ul_osno, budget_plus, budget,
+    #           1+4, 1+9, 1+19, 1+49, 1+99, 1+199, 1+499,
+    #           1+4_plus, 1+9_plus, 1+19_plus, 1+49_plus, 1+99_plus, 1+199_plus, 1+499_plus]
+
+    ip_usn = all_prices[0] if len(all_prices) > 0 else "❌"
+    ip_osno = all_prices[1] if len(all_prices) > 1 else "❌"
+    ul_usn = all_prices[2] if len(all_prices) > 2 else "❌"
+    ul_osno = all_prices[3] if len(all_prices) > 3 else "❌"
+    budget_plus = all_prices[4] if len(all_prices) > 4 else "❌"
+    budget = all_prices[5] if len(all_prices) > 5 else "❌"
+
+    # Общие тарифы (7 значений)
+    common_prices = all_prices[6:13] if len(all_prices) >= 13 else ["❌"] * 7
+
+    # Общие плюс тарифы (7 значений)
+    common_plus_prices = all_prices[13:20] if len(all_prices) >= 20 else ["❌"] * 7
+
+    # Обновляем строку таблицы
+    # Основные тарифы
+    sink.set(index, 3, ip_usn)      # ИП (УСН)
+    sink.set(index, 4, ip_osno)     # ИП (ОСНО)
+    sink.set(index, 5, ul_usn)      # ЮЛ (УСН)
+    sink.set(index, 6, ul_osno)     # ЮЛ (ОСНО)
+    sink.set(index, 7, budget_plus) # Бюджетник плюс
+    sink.set(index, 8, budget)      # Бюджетник
+
+    # Тарифы Общий (колонки 9-15)
+    for i, price in enumerate(common_prices):
+        if i < 7:
+            sink.set(index, 9 + i, price)
+
+    # Тарифы Общий плюс (колонки 16-22)
+    for i, price in enumerate(common_plus_prices):
+        if i < 7:
+            sink.set(index, 16 + i, price)
+
+def kontur_region_status(word_file, row):
+    """
+    Статус региона Контур для журнала: ok, только если Word файл скачан и из него получена
+    хоть одна цена (колонки 3-22). Иначе регион при продолжении обходится заново, а запуск
+    не считается полным и его файл не выдается из кэша результатов
+    """
+    if not word_file:
+        return "failed"
+    word_values = row[2:NULL_COL - 1]
+    return "ok" if any(value not in (None, "", "❌") for value in word_values) else "failed"
+
+# === КОНВЕЙЕР РЕГИОНОВ КОНТУР ===
+# Регион проходит этапы: ссылка в браузере → скачивание → конвертация .doc → разбор.
+# Этапы работают одновременно над разными регионами: пока один регион скачивается,
+# предыдущий конвертируется, а еще более ранний разбирается. Строки пишутся в таблицу по порядку
+
+# Сколько регионов может ждать между соседними этапами
+KONTUR_PIPELINE_QUEUE = 4
+
+def kontur_stage_link(region, _):
+    """Открывает страницу региона: в режиме http ставит Word файл в очередь скачивания, иначе скачивает кликом"""
+    idx, region_id, region_name = region
+    try:
+        with BROWSER_POOL.session("kontur") as session:
+            open_kontur_region(session, region_id)
+            if KONTUR_DOWNLOAD_MODE == "http":
+                pending = start_download_by_text(session.driver, KONTUR_WORD_LINK)
+            else:
+                pending = download_file_by_text(session.driver, KONTUR_WORD_LINK, f"region{region_id}")
+            report_network_usage(session.driver, f"Контур, регион {region_id}")
+        return pending
+    except Exception as e:
+        logging.info(f"Контур: регион {region_id} - ссылка на Word файл не получена: {str(e)}")
+        return None
 
-            if not file_url:
-                return None
+def kontur_stage_download(region, pending):
+    """Дожидается прямого скачивания; если оно не удалось - скачивает кликом в браузере"""
+    idx, region_id, region_name = region
+    if KONTUR_DOWNLOAD_MODE != "http":
+        return pending
+    word_file = download_result(pending, f"регион {region_id}")
+    if not word_file and not job_cancelled():
+        with BROWSER_POOL.session("kontur") as session:
+            open_kontur_region(session, region_id)
+            word_file = download_file_by_text(session.driver, KONTUR_WORD_LINK, f"region{region_id}")
+            report_network_usage(session.driver, f"Контур, регион {region_id}")
+    return word_file
+
+# Результат разбора региона, чей .doc ждет общей конвертации LibreOffice после конвейера
+KONTUR_NEEDS_CONVERSION = "needs_conversion"
+
+def kontur_stage_convert(region, word_file):
+    """
+    .doc, еще не разобранный, читается встроенным читателем, и таблицы передаются на разбор.
+    Если прочитать не удалось, файл помечается для LibreOffice: такие файлы всех регионов
+    конвертируются вместе после конвейера, чтобы запусков soffice было как можно меньше.
+    Возвращает (файл, таблицы .doc или None, нужна ли конвертация)
+    """
+    if not word_file or not word_file.lower().endswith('.doc') or is_parse_cached("kontur_word", word_file):
+        return word_file, None, False
+    try:
+        return word_file, read_doc_tables(word_file), False
+    except Exception as e:
+        logging.info(f"Файл {os.path.basename(word_file)} не прочитан напрямую ({str(e)}), конвертируем через LibreOffice")
+    return word_file, None, True
+
+def kontur_stage_extract(region, read):
+    """
+    Возвращает (файл, 20 значений тарифов, None или KONTUR_NEEDS_CONVERSION).
+    Результат кэшируется по содержимому исходного файла
+    """
+    word_file, tables, needs_conversion = read
+    if not word_file:
+        return None, None
+    if needs_conversion:
+        return word_file, KONTUR_NEEDS_CONVERSION
+    try:
+        if tables is not None:
+            parse = lambda path: extract_prices_streaming(path, tables)
+        else:
+            parse = extract_prices_universal
+        return word_file, cached_parse("kontur_word", parse, word_file)
+    except Exception as e:
+        logging.error(f"Контур: регион {region[1]} - ошибка разбора Word файла: {str(e)}")
+        return word_file, None
 
-            # Прокручиваем к элементу с отступом
-            driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", link)
-            time.sleep(2)
+def kontur_extract_converted(region_id, word_file, docx_path):
+    """Разбор .docx, полученного из .doc региона; результат кэшируется по исходному .doc"""
+    if not docx_path:
+        return ["❌"] * 20
+    try:
+        return cached_parse("kontur_word", lambda path: extract_prices_streaming(docx_path), word_file)
+    except Exception as e:
+        logging.error(f"Контур: регион {region_id} - ошибка разбора Word файла: {str(e)}")
+        return None
 
-            # Выделяем элемент для визуализации
-            driver.execute_script("arguments[0].style.border='3px solid red';", link)
-            time.sleep(1)
+KONTUR_STAGES = [
+    ("ссылка", kontur_stage_link, 1),
+    ("скачивание", kontur_stage_download, KONTUR_HTTP_CONNECTIONS),
+    ("конвертация", kontur_stage_convert, KONTUR_OFFICE_WORKERS),
+    ("разбор", kontur_stage_extract, KONTUR_PARSE_WORKERS),
+]
 
-            # Пробуем разные методы клика
-            try:
-                link.click()
-            except:
-                try:
-                    driver.execute_script("arguments[0].click();", link)
-                except:
-                    from selenium.webdriver.common.action_chains import ActionChains
-                    actions = ActionChains(driver)
-                    actions.move_to_element(link).click().perform()
-
-            # Увеличиваем время ожидания скачивания
-            time.sleep(15)
-
-            # Ищем скачанный файл
-            files = [f for f in os.listdir(DOWNLOAD_DIR)
-                    if not f.startswith('.') and not f.startswith('~') and not f.endswith('.crdownload')]
-            if files:
-                latest_file = max([os.path.join(DOWNLOAD_DIR, f) for f in files], key=os.path.getctime)
-                file_size = os.path.getsize(latest_file)
-
-                if file_size > 100:
-                    return latest_file
-                else:
-                    return None
-            else:
-                return None
+def run_kontur_engine(regions, progress, is_cancelled, done_rows, on_region):
+    """Блокирующая часть парсинга Контур: выполняется в пуле движка, а не в цикле событий бота"""
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 
-        except Exception as e:
-            return None
+    # Папки скачиваний прошлого запуска больше не нужны
+    for name in os.listdir(DOWNLOAD_DIR):
+        if name.startswith(KONTUR_DOWNLOAD_PREFIX):
+            shutil.rmtree(os.path.join(DOWNLOAD_DIR, name), ignore_errors=True)
+    evict_file_store()
 
-    # === ОСНОВНАЯ ЛОГИКА ПАРСИНГА ===
     try:
-        # Создаем Excel файл
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Тарифы"
+        # Таблица результатов в памяти; xlsx собирается один раз после парсинга
 
         # ОБНОВЛЕННЫЕ ЗАГОЛОВКИ С КОЛОНКАМИ ДЛЯ РЕГРЕССИВНЫХ ШКАЛ
         headers = [
@@ -1675,215 +4454,224 @@ async def parse_kontur(callback_query: CallbackQuery):
             "Стартовый онлайн ИП (УСН)", "Стартовый онлайн ИП (ОСНО)",
             "Стартовый онлайн ЮЛ (УСН)", "Стартовый онлайн ЮЛ (ОСНО)"
         ]
-        ws.append(headers)
+        sink = ResultSink(headers)
 
         # Создаем строки для всех регионов
         for region_id, region_name in regions:
             row = [int(region_id), region_name] + ["❌"] * (len(headers) - 2)
-            ws.append(row)
-
-        # Переходим на страницу для доступа к ссылкам
-        driver.get(BASE_URL.replace("77", "01"))
-        wait.until(EC.presence_of_element_located((By.TAG_NAME, "body")))
-        time.sleep(5)
-
-        # Скачиваем PDF файлы
-        null_pdf = download_file_by_text("Скачать прайс-лист на тарифные планы «Общий Лайт», «Нулевая отчетность», «Кадровые отчеты», «Классический»")
-        tax_pdf = download_file_by_text("Скачать прайс-лист для налоговых представителей")
-        start_pdf = download_file_by_text("Скачать прайс-лист на тарифный план «Стартовый онлайн»")
-
-        # Извлекаем данные из PDF
-        null_prices = extract_all_null_prices(null_pdf) if null_pdf else {}
-        tax_rep_prices = extract_all_tax_representative_prices(tax_pdf) if tax_pdf else {}
-        start_online_prices = extract_all_start_online_prices(start_pdf) if start_pdf else {}
-
-        # ОПРЕДЕЛЕНИЕ КОЛОНОК ДЛЯ РАЗНЫХ ТИПОВ ДАННЫХ
-
-        NULL_COL = 23
-        TAX_BASE_COL = 24
-        ZONE_COL = 25
-
-        # МАППИНГ ДЛЯ ПЕРВОЙ ТАБЛИЦЫ (зоны 1,2,3,5,6,7,8,9,11,12)
-        REGRESSION_COLS_MAIN = {
-            'до_199': 26,
-            'от_200_до_499': 27,
-            'от_500_до_999': 28,
-            'от_1000_до_1999': 29,
-            'от_2000': 30
-        }
-
-        REGRESSION_COLS_4_10 = {
-            'до_349': 26,           # Для зон 4 и 10: до 349
-            'от_350_до_599': 27,    # Для зон 4 и 10: от 350 до 599
-            'от_600_до_999': 28,    # Для зон 4 и 10: от 600 до 999
-            'от_1000': 29           # Для зон 4 и 10: от 1000
-        }
-
-        START_COLS = [31, 32, 33, 34]
+            sink.append(row)
+
+        with BROWSER_POOL.session("kontur") as session:
+            driver = session.driver
+            wait = WebDriverWait(driver, 30)
+
+            # Переходим на страницу для доступа к ссылкам
+            session.get(KONTUR_URL.replace("77", "01"))
+            wait.until(EC.presence_of_element_located((By.TAG_NAME, "body")))
+            wait_for("kontur.region", lambda: kontur_links_ready(driver), 5)
+
+            # Скачиваем PDF файлы: все три ссылки сразу ставим в очередь HTTP-скачивания,
+            # а то, что не скачалось напрямую, забираем кликом в браузере
+            pdf_futures = [start_download_by_text(driver, text) for text in KONTUR_PDF_LINKS]
+            null_pdf, tax_pdf, start_pdf = [
+                download_result(future, text) or download_file_by_text(driver, text, "pdf")
+                for future, text in zip(pdf_futures, KONTUR_PDF_LINKS)
+            ]
 
-        for row_idx in range(2, len(regions) + 2):
-            region_id_cell = ws.cell(row=row_idx, column=1).value
-            if region_id_cell is not None:
-                region_id = str(region_id_cell).zfill(2)
-                region_name = ws.cell(row=row_idx, column=2).value
+        # Общие PDF разбираются в отдельных процессах, пока браузер обходит регионы;
+        # их значения понадобятся только при записи первой строки региона
+        pdf_files = {"null_prices": null_pdf, "tax_rep_prices": tax_pdf, "start_online_prices": start_pdf}
+        pdf_futures = submit_pdf_extraction(pdf_files)
+        pdf_prices = None
 
-                # Нулевая отчетность
-                if region_id in null_prices:
-                    null_price = null_prices[region_id]
-                    ws.cell(row=row_idx, column=NULL_COL).value = null_price
+        # === ОБРАБОТКА WORD ФАЙЛОВ ДЛЯ РЕГИОНОВ ===
+        written_rows = set()
 
-                # Налоговый представитель с регрессивными шкалами
-                if region_id in tax_rep_prices:
-                    tax_data = tax_rep_prices[region_id]
+        # Регионы, успешно обработанные в прерванном запуске, берем из журнала
+        for idx, (region_id, region_name) in enumerate(regions, 1):
+            if str(region_id) in done_rows:
+                sink.set_row(idx - 1, done_rows[str(region_id)])
+                written_rows.add(idx - 1)
+                progress.restore()
+
+        # Остальные регионы проходят конвейер, строки записываются в порядке регионов
+        pending_regions = [
+            (idx, str(region_id), region_name)
+            for idx, (region_id, region_name) in enumerate(regions, 1)
+            if str(region_id) not in done_rows
+        ]
+        def finish_region(idx, region_id, word_file, all_prices):
+            nonlocal pdf_prices
+            index = idx - 1
+            if all_prices is not None:
+                write_kontur_word_prices(sink, index, all_prices)
+
+            if pdf_prices is None:
+                pdf_prices = collect_pdf_results(pdf_futures, pdf_files)
+            fill_kontur_pdf_columns(sink, index, region_id.zfill(2), pdf_prices)
+            written_rows.add(index)
+
+            # Контрольная точка: строка региона дописывается в журнал, xlsx целиком не пересохраняется
+            row = sink.row(index)
+            on_region(region_id, kontur_region_status(word_file, row), row)
+
+            # Отмечаем прогресс
+            progress.advance()
+
+        pipeline = StagePipeline("kontur", KONTUR_STAGES, KONTUR_PIPELINE_QUEUE, is_cancelled)
+        progress.begin()
+        needs_conversion = []
+        for (idx, region_id, region_name), result, error in pipeline.run(pending_regions):
+            # После отмены оставшиеся регионы не записываются, конвейер только дочищается
+            if error is not None and is_cancelled():
+                continue
 
-                    if isinstance(tax_data, dict):
-                        if 'base_price' in tax_data and tax_data['base_price'] is not None:
-                            ws.cell(row=row_idx, column=TAX_BASE_COL).value = tax_data['base_price']
+            word_file, all_prices = result if error is None else (None, None)
+            if all_prices == KONTUR_NEEDS_CONVERSION:
+                needs_conversion.append((idx, region_id, word_file))
+                continue
+            finish_region(idx, region_id, word_file, all_prices)
+
+        # Файлы .doc, не прочитанные напрямую, конвертируются все вместе: общие запуски soffice
+        if needs_conversion and not is_cancelled():
+            logging.info(f"Контур: {len(needs_conversion)} файлов .doc конвертируются через LibreOffice")
+            docx_paths = OFFICE_CONVERTER.convert_many([word_file for _, _, word_file in needs_conversion])
+            for (idx, region_id, word_file), docx_path in zip(needs_conversion, docx_paths):
+                if is_cancelled():
+                    break
+                finish_region(idx, region_id, word_file, kontur_extract_converted(region_id, word_file, docx_path))
 
-                        if 'zone' in tax_data and tax_data['zone'] is not None:
-                            ws.cell(row=row_idx, column=ZONE_COL).value = tax_data['zone']
+        # При отмене оставшиеся регионы получают хотя бы значения из общих PDF
+        if pdf_prices is None:
+            pdf_prices = collect_pdf_results(pdf_futures, pdf_files)
+        for index in range(len(sink)):
+            if index not in written_rows:
+                fill_kontur_pdf_columns(sink, index, str(sink.get(index, 1)).zfill(2), pdf_prices)
 
-                        regression_prices = tax_data.get('regression_prices', {})
-                        if regression_prices:
-                            # Получаем номер зоны
-                            zone_number = tax_data.get('zone')
+        return sink
 
-                            # Выбираем правильный маппинг
-                            if zone_number in ['4', '10']:
-                                regression_mapping = REGRESSION_COLS_4_10
-                            else:
-                                regression_mapping = REGRESSION_COLS_MAIN
+    finally:
+        log_wait_stats("kontur.")
+        OFFICE_CONVERTER.log_batch_stats()
 
-                            for range_key, col_idx in regression_mapping.items():
-                                if range_key in regression_prices and regression_prices[range_key] is not None:
-                                    ws.cell(row=row_idx, column=col_idx).value = regression_prices[range_key]
-                    else:
-                        ws.cell(row=row_idx, column=TAX_BASE_COL).value = tax_data
+def save_kontur_xlsx(sink, file_name, diff=None):
+    """Записывает таблицу Контур (и лист изменений, если он есть) одним проходом"""
+    wb = new_xlsx_workbook()
+    write_sheet(wb, "Тарифы", [sink.headers], sink.rows())
+    if diff is not None:
+        write_diff_sheet(wb, diff)
+    wb.save(file_name)
 
-                # Стартовый онлайн
-                if region_id in start_online_prices:
-                    prices = start_online_prices[region_id]
-                    for i, price in enumerate(prices):
-                        if i < len(START_COLS):
-                            ws.cell(row=row_idx, column=START_COLS[i]).value = price
+async def parse_kontur(callback_query: CallbackQuery, job, resume_run_id=None):
 
-        # === ОБРАБОТКА WORD ФАЙЛОВ ДЛЯ РЕГИОНОВ ===
-        successful_downloads = 0
+    # === Список регионов ===
+    # Загружаем регионы из конфига
+    regions = DATA.get('regions_kontur', [])
+    # Преобразуем в кортежи если нужно
+    regions = [tuple(r) for r in regions]
 
-        for idx, (region_id, region_name) in enumerate(regions, 1):
-            if cancel_flag:
-                await message.edit_text("❌ Контур: Парсинг отменен.")
-                break
+    if not regions:
+        logging.error("В конфиге отсутствует список регионов для Контур!")
+        await callback_query.message.answer("❌ Ошибка: список регионов не найден в конфиге")
+        return
 
-            try:
-                region_url = BASE_URL.replace("77", region_id)
-                driver.get(region_url)
-                wait.until(EC.presence_of_element_located((By.TAG_NAME, "body")))
-                time.sleep(5)
-
-                # Очищаем папку от старых файлов
-                for f in os.listdir(DOWNLOAD_DIR):
-                    if f.endswith(('.doc', '.docx')):
-                        try:
-                            os.remove(os.path.join(DOWNLOAD_DIR, f))
-                        except:
-                            pass
-
-                # Скачиваем Word файл
-                word_file = download_file_by_text("Скачать полный прайс-лист, часть 2")
-
-                if word_file:
-                    successful_downloads += 1
-
-                    # === НОВАЯ ЛОГИКА ИЗВЛЕЧЕНИЯ ДАННЫХ ===
-                    # Извлекаем все данные одной функцией
-                    all_prices = extract_prices_universal(word_file)
-
-                    # Распаковываем результаты (22 значения)
-                    # Порядок: [ip_usn, ip_osno, ul_usn, ul_osno, budget_plus, budget,
-                    #           1+4, 1+9, 1+19, 1+49, 1+99, 1+199, 1+499,
-                    #           1+4_plus, 1+9_plus, 1+19_plus, 1+49_plus, 1+99_plus, 1+199_plus, 1+499_plus]
-
-                    ip_usn = all_prices[0] if len(all_prices) > 0 else "❌"
-                    ip_osno = all_prices[1] if len(all_prices) > 1 else "❌"
-                    ul_usn = all_prices[2] if len(all_prices) > 2 else "❌"
-                    ul_osno = all_prices[3] if len(all_prices) > 3 else "❌"
-                    budget_plus = all_prices[4] if len(all_prices) > 4 else "❌"
-                    budget = all_prices[5] if len(all_prices) > 5 else "❌"
-
-                    # Общие тарифы (7 значений)
-                    common_prices = all_prices[6:13] if len(all_prices) >= 13 else ["❌"] * 7
-
-                    # Общие плюс тарифы (7 значений)
-                    common_plus_prices = all_prices[13:20] if len(all_prices) >= 20 else ["❌"] * 7
-
-                    # Обновляем данные в Excel
-                    row_idx = idx + 1
-
-                    # Основные тарифы
-                    ws.cell(row=row_idx, column=3).value = ip_usn      # ИП (УСН)
-                    ws.cell(row=row_idx, column=4).value = ip_osno     # ИП (ОСНО)
-                    ws.cell(row=row_idx, column=5).value = ul_usn      # ЮЛ (УСН)
-                    ws.cell(row=row_idx, column=6).value = ul_osno     # ЮЛ (ОСНО)
-                    ws.cell(row=row_idx, column=7).value = budget_plus # Бюджетник плюс
-                    ws.cell(row=row_idx, column=8).value = budget      # Бюджетник
-
-                    # Тарифы Общий (колонки 9-15)
-                    for i, price in enumerate(common_prices):
-                        if i < 7:
-                            ws.cell(row=row_idx, column=9 + i).value = price
-
-                    # Тарифы Общий плюс (колонки 16-22)
-                    for i, price in enumerate(common_plus_prices):
-                        if i < 7:
-                            ws.cell(row=row_idx, column=16 + i).value = price
+    logging.info(f"Загружено {len(regions)} регионов для Контур из конфига")
 
-            except Exception as e:
-                pass
+    total_regions = len(regions)
+    message = await callback_query.message.answer("🔄 Парсинг Контур начат...")
+    job.progress_messages[message.chat.id] = message.message_id
+    job.progress_text = message.text
+    progress = EngineProgress(total_regions)
+
+    # Дата запуска одна для журнала и имени файла: бот работает сутками
+    run_date = run_date_str()
+    file_name = result_file_name("kontur", run_date)
+
+    # Журнал запуска: при продолжении берем готовые строки регионов из журнала
+    if resume_run_id is None:
+        run_id = await run_in_engine(journal_start_run, "kontur", run_date)
+        done_rows = {}
+    else:
+        run_id = resume_run_id
+        await run_in_engine(journal_reopen_run, run_id)
+        journaled = await run_in_engine(journal_load_regions, run_id)
+        done_rows = journal_ok_regions(journaled)
+        logging.info(f"Контур: продолжение запуска {run_id}, уже готово {len(done_rows)} из {total_regions} регионов")
 
-            # Обновляем прогресс
-            progress = int((idx) / total_regions * 100)
-            await message.edit_text(f"🔄 Прогресс: {progress}%")
+    def on_region(region_id, status, row):
+        journal_record_region(run_id, region_id, status, row)
 
-            # Периодически сохраняем Excel
-            if idx % 5 == 0:
-                wb.save(FILE_NAME_KONTUR)
+    reporter = ProgressReporter(job, "🔄 Контур", progress).start()
+    try:
+        try:
+            sink = await run_in_engine(
+                job.token.bind(run_kontur_engine), regions, progress, job.token, done_rows, on_region
+            )
+        finally:
+            await reporter.stop()
+        await run_in_engine(journal_finish_run, run_id, [code for code, name in regions], job.cancelled)
+
+        # Сохраняем значения в историю, затем собираем xlsx вместе с листом изменений
+        history_rows = [
+            (region_id, region_name, dict(zip(sink.headers[2:], row[2:])))
+            for (region_id, region_name), row in zip(regions, sink.rows())
+        ]
+        diff_summary, diff = await run_in_engine(history_report, "kontur", history_rows)
+        await run_in_engine(save_kontur_xlsx, sink, file_name, diff)
 
-        # Финальное сохранение
-        wb.save(FILE_NAME_KONTUR)
+        if job.cancelled:
+            await publish_progress(job, "❌ Контур: Парсинг отменен.")
 
         # === ОТПРАВКА РЕЗУЛЬТАТА В ЧАТ ===
-        if os.path.exists(FILE_NAME_KONTUR):
-            logging.info(f"Файл {FILE_NAME_KONTUR} создан, отправляем в чат")
-            if cancel_flag:
-                comment = f"⚠️ Парсинг Контур был отменен. Файл содержит неполные данные"
+        if os.path.exists(file_name):
+            logging.info(f"Файл {file_name} создан, отправляем в чат")
+            if job.cancelled:
+                comment = "⚠️ Парсинг Контур был отменен. Файл содержит неполные данные"
                 logging.info("Парсинг был отменен, отправляем неполный файл")
             else:
-                comment = f"✅ Парсинг Контур завершен успешно"
+                comment = "✅ Парсинг Контур завершен успешно"
+            if diff_summary:
+                comment += f"\n{diff_summary}"
 
-            await send_file_into_chat(TELEGRAM_CHAT_ID, FILE_NAME_KONTUR, comment)
+            await deliver_result(job, file_name, comment)
             logging.info("Файл Контур успешно отправлен в чат")
+            await run_in_engine(
+                result_store, "kontur", run_id, file_name, [code for code, name in regions],
+                job.cancelled, comment
+            )
         else:
             await callback_query.message.answer("❌ Не удалось создать файл с результатами")
-            logging.error(f"Файл {FILE_NAME_KONTUR} не найден")
+            logging.error(f"Файл {file_name} не найден")
 
     except Exception as e:
         error_msg = f"❌ Ошибка парсинга: {str(e)}"
         logging.error(f"Ошибка в parse_kontur: {str(e)}", exc_info=True)
+        await publish_progress(job, error_msg)
         try:
             await callback_query.message.answer(error_msg)
         except Exception as e2:
             logging.error(f"Не удалось отправить сообщение об ошибке: {str(e2)}")
 
-    finally:
-        try:
-            driver.quit()
-        except:
-            pass
-
 # Запуск бота
 async def main():
-    await dp.start_polling(bot)
+    # Браузеры стартуют вместе с ботом, чтобы первая команда не ждала холодного запуска Chrome
+    asyncio.ensure_future(run_in_engine(BROWSER_POOL.start, BROWSER_WARM))
+    # LibreOffice ищется один раз при старте, воркеры конвертации запускаются сразу
+    asyncio.ensure_future(run_in_engine(OFFICE_CONVERTER.start))
+    # Процессы разбора PDF тоже запускаются заранее
+    asyncio.ensure_future(run_in_engine(warm_pdf_executor))
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await run_in_engine(BROWSER_POOL.close)
+        await run_in_engine(KONTUR_DOWNLOADER.close)
+        await run_in_engine(OFFICE_CONVERTER.close)
+        await run_in_engine(close_pdf_executor)
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    if len(sys.argv) > 1 and sys.argv[1] == '--bench-docx':
+        bench_docx(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == '--bench-tax':
+        bench_tax(sys.argv[2] if len(sys.argv) > 2 else None)
+    else:
+        asyncio.run(main())